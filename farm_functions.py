@@ -0,0 +1,257 @@
+import asyncio
+import re
+from gcode_functions import process_g_code_lines
+from job_functions import assemble_job
+
+_TOOL = re.compile(r'^T(-?\d+)', re.MULTILINE)
+
+
+def get_job_materials(layers):
+    """Returns set of materials of a job (layers: {z: {material: g_code}})."""
+    return set(material for layer in layers.values() for material in layer.keys())
+
+
+def retarget_printer_settings(printer_settings, printer, materials):
+    """Returns printer settings of a job for a printer (tools of the printer for job materials).
+
+    Args:
+        printer_settings (dict): printer settings of the job (temps, cooling, prime_macro, mesh_bed)
+        printer (dict): printer with keys 'tools' ({material: tool}) and optional 'tool_fans'
+        materials (set): materials of the job (see get_job_materials)
+
+    Returns:
+        dict: printer settings
+    """
+    printer_settings = dict(printer_settings)
+    printer_settings['tools'] = {material: tool for material, tool in printer['tools'].items()
+                                 if material in materials}
+    return printer_settings
+
+
+class Print_farm:
+    """
+    Dispatcher of generated jobs to several tool changer printers (asyncio).
+    A job (layers of geometry g_code) is assigned to a printer which has tools for all
+    materials of the job, the printer with the earliest estimated finish is chosen (load
+    balancing by estimated print time). Job g_code is assembled for the chosen printer
+    (tool numbers and fan pins of the printer), the geometry is not regenerated.
+
+    Printers are reached over TCP with a simple protocol (see stand_in_printer):
+        'JOB <name> <size in bytes> <estimated time in sec>\n' + g_code
+        -> 'OK\n' (printing) ... 'DONE\n' or 'ERROR <message>\n'
+
+    Job states: 'queued', 'uploading', 'printing', 'done', 'failed'.
+    Unreachable printers are marked offline, their jobs are reassigned to other
+    compatible printers.
+    """
+
+    def __init__(self, printers, tool_unload_time=3, tool_load_time=20):
+        """
+        Params:
+        printers            ... list of dicts with keys 'name', 'host', 'port', 'tools' ({material: tool})
+                                and optional 'tool_fans' ({tool: fan pin}, see load_tool)
+        tool_unload_time    ... time for tool unload in sec (see process_g_code)
+        tool_load_time      ... time for tool load in sec (see process_g_code)
+        """
+        self.printers = {printer['name']: printer for printer in printers}
+        self.tool_unload_time = tool_unload_time
+        self.tool_load_time = tool_load_time
+        self.jobs = {}
+        self.load = {name: 0 for name in self.printers} # estimated busy time of printers in sec
+        self.offline = set()
+        self._queues = None
+
+
+    def get_compatible_printers(self, materials):
+        """Returns names of printers with tools for all materials."""
+        return [name for name, printer in self.printers.items()
+                if name not in self.offline and materials <= set(printer['tools'].keys())]
+
+
+    def submit(self, name, layers, printer_settings, printing_params=None):
+        """Adds a job and assigns it to a printer.
+
+        Params:
+        name                ... job name
+        layers              ... {z: {material: g_code}} or list of (z, {material: g_code}) (see assemble_job)
+        printer_settings    ... printer settings of the job, tools are taken from the printer
+        printing_params     ... printing params of materials (see assemble_job)
+
+        Returns:
+        job                 ... dict with keys 'name', 'materials', 'printer', 'state',
+                                'print_time_sec', 'size_bytes', 'error', 'g_code',
+                                'layers', 'printer_settings', 'printing_params'
+        """
+        if isinstance(layers, dict):
+            layers = sorted(layers.items())
+        layers = list(layers)
+        materials = get_job_materials(dict(layers))
+        compatible = self.get_compatible_printers(materials)
+        if not compatible:
+            raise Exception(f'No printer has tools for materials {sorted(materials)} of job "{name}".')
+
+        # printer with the earliest estimated finish (tool numbers do not change the print time)
+        printer_name = min(compatible, key=lambda printer_name: self.load[printer_name])
+        printer = self.printers[printer_name]
+        g_code = assemble_job(layers, retarget_printer_settings(printer_settings, printer, materials),
+                              tool_fans=printer.get('tool_fans'), printing_params=printing_params)
+        estimate = process_g_code_lines(g_code.split('\n'),
+                                        tool_unload_time=self.tool_unload_time,
+                                        tool_load_time=self.tool_load_time)['print_time_sec']
+
+        previous = self.jobs.get(name)
+        if previous is not None and previous['state'] != 'failed': # reassigned job
+            self.load[previous['printer']] -= previous['print_time_sec']
+        job = {
+            'name': name,
+            'materials': sorted(materials),
+            'printer': printer_name,
+            'state': 'queued',
+            'print_time_sec': float(estimate),
+            'size_bytes': len(g_code.encode()),
+            'error': None,
+            'g_code': g_code,
+            'layers': layers,
+            'printer_settings': printer_settings,
+            'printing_params': printing_params,
+        }
+        self.jobs[name] = job
+        self.load[printer_name] += estimate
+        if self._queues is not None:
+            self._enqueue(job)
+        return job
+
+
+    def _enqueue(self, job):
+        self._pending += 1
+        self._idle.clear()
+        self._queues[job['printer']].put_nowait(job)
+
+
+    def fail_job(self, job, error):
+        """Marks job as failed and removes its estimated time from the printer load."""
+        if job['state'] != 'failed':
+            self.load[job['printer']] -= job['print_time_sec']
+        job['state'] = 'failed'
+        job['error'] = error
+
+
+    async def send_job(self, job):
+        """Uploads job g_code to its printer and waits until it is printed.
+        Jobs of unreachable printers are reassigned (see submit)."""
+        printer = self.printers[job['printer']]
+        job['state'] = 'uploading'
+        try:
+            reader, writer = await asyncio.open_connection(printer['host'], printer['port'])
+        except OSError as error:
+            self.offline.add(job['printer'])
+            if self.get_compatible_printers(set(job['materials'])): # reassigned
+                self.submit(job['name'], job['layers'], job['printer_settings'], job['printing_params'])
+            else:
+                self.fail_job(job, str(error))
+            return
+        try:
+            data = job['g_code'].encode()
+            writer.write(f'JOB {job["name"]} {len(data)} {job["print_time_sec"]}\n'.encode())
+            writer.write(data)
+            await writer.drain()
+            response = (await reader.readline()).decode().strip()
+            if response == 'OK':
+                job['state'] = 'printing'
+                response = (await reader.readline()).decode().strip()
+            if response == 'DONE':
+                job['state'] = 'done'
+            else:
+                self.fail_job(job, response if response else 'connection closed')
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+    async def _printer_worker(self, queue):
+        while True:
+            job = await queue.get()
+            try:
+                await self.send_job(job)
+            except Exception as error: # e.g. malformed reply or failed reassignment
+                self.fail_job(job, f'{type(error).__name__}: {error}')
+            finally:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.set()
+
+
+    async def run(self):
+        """Sends all submitted jobs to printers (jobs of a printer one after another,
+        printers in parallel). Jobs can be submitted while running.
+
+        Returns:
+        report  ... dict with keys 'jobs' ({name: state}), 'printers' ({name: [job names]}),
+                    'load_sec' ({printer name: estimated busy time}), 'makespan_sec',
+                    'offline' (list of printer names)
+        """
+        self._queues = {name: asyncio.Queue() for name in self.printers}
+        self._pending = 0 # jobs in queues or being sent
+        self._idle = asyncio.Event()
+        self._idle.set()
+        for job in list(self.jobs.values()):
+            if job['state'] == 'queued':
+                self._enqueue(job)
+
+        workers = [asyncio.create_task(self._printer_worker(queue)) for queue in self._queues.values()]
+        await self._idle.wait()
+        for worker in workers:
+            worker.cancel()
+        self._queues = None
+
+        printers_jobs = {name: [] for name in self.printers}
+        for job in self.jobs.values():
+            printers_jobs[job['printer']].append(job['name'])
+        report = {
+            'jobs': {name: job['state'] for name, job in self.jobs.items()},
+            'printers': printers_jobs,
+            'load_sec': {name: round(float(load), 2) for name, load in self.load.items()},
+            'makespan_sec': round(float(max(self.load.values())), 2),
+            'offline': sorted(self.offline),
+        }
+        return report
+
+
+async def stand_in_printer(tools, host='127.0.0.1', port=0, time_scale=0.0):
+    """Starts a local stand-in printer endpoint (asyncio server) for testing of Print_farm.
+    Received jobs are checked for tools the printer does not have and "printed"
+    for estimated time * time_scale.
+
+    Params:
+    tools       ... {material: tool} of the printer
+    host, port  ... address of the server (port 0 - random free port)
+    time_scale  ... simulated print time as a fraction of estimated time
+
+    Returns:
+    server      ... asyncio.Server (address: server.sockets[0].getsockname()),
+                    server.received is a list of (job name, g_code)
+    """
+    tool_numbers = set(tool[1:] for tool in tools.values()) | {'-1'}
+
+    async def handle(reader, writer):
+        header = (await reader.readline()).decode().split()
+        name, size, print_time = header[1], int(header[2]), float(header[3])
+        g_code = (await reader.readexactly(size)).decode()
+        server.received.append((name, g_code))
+        unknown = set(_TOOL.findall(g_code)) - tool_numbers
+        if unknown:
+            writer.write(f'ERROR unknown tools {sorted(unknown)}\n'.encode())
+        else:
+            writer.write(b'OK\n')
+            await writer.drain()
+            await asyncio.sleep(print_time * time_scale)
+            writer.write(b'DONE\n')
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    server.received = []
+    return server
@@ -0,0 +1,222 @@
+"""Command-line batch generation of g_code from declarative job files.
+
+Usage:
+    python gcode_cli.py job_1.json job_2.json --jobs 4 --output-dir generated_gcodes
+    python gcode_cli.py job_1.json --compress auto --tee
+
+Job file (.json) with one job or a list of jobs:
+    {
+        "name": "pads",
+        "printing_params": {"PLA": "PLA_default", "TPU": "TPU_default"},
+        "printer_settings": {"tools": ..., "temps": ..., ...} or "path/to/settings.json",
+        "regions": {"region name": {region specs}, ...} or "path/to/regions.json",
+        "output": "generated_gcodes/pads.gcode",    (optional, defaults to output_dir/name.gcode)
+        "header": true,                             (optional, printing params header)
+        "plot": "generated_gcodes/pads.png",        (optional, plot of regions)
+        "compression": "gzip"                       (optional, see G_code_writer)
+    }
+Printing params are names of files in printing_params directory or paths to .json files.
+Relative paths are relative to the job file.
+
+Compressed g_code is written in a background thread while the job is generated.
+Loaded printing params, generators and g_code of regions are cached and reused by all jobs
+of a process (with --jobs N each worker process keeps its own caches).
+NumPy and matplotlib are imported only when a job is built or plotted.
+"""
+import argparse
+import json
+import os
+import time
+
+_profiles = {} # {params filepath: Material_profile}
+_generators = {} # {params filepaths: generator_multi}
+_region_caches = {} # {params filepaths: {region key: g_code}}
+
+
+def _resolve_path(path, base_dir):
+    if os.path.isabs(path):
+        return path
+    return os.path.join(base_dir, path)
+
+
+def _load_json(value, base_dir):
+    """Returns value or content of the .json file if value is a path."""
+    if isinstance(value, str):
+        with open(_resolve_path(value, base_dir)) as f:
+            return json.load(f)
+    return value
+
+
+def load_jobs(filepaths):
+    """Loads jobs from job files.
+
+    Args:
+        filepaths (list): paths to job files (.json)
+
+    Returns:
+        list: list of job dicts with key 'base_dir' (directory of the job file)
+    """
+    jobs = []
+    for filepath in filepaths:
+        with open(filepath) as f:
+            file_jobs = json.load(f)
+        if isinstance(file_jobs, dict):
+            file_jobs = [file_jobs]
+        base_dir = os.path.dirname(os.path.abspath(filepath))
+        for i, job in enumerate(file_jobs):
+            job = dict(job)
+            job.setdefault('name', f'{os.path.splitext(os.path.basename(filepath))[0]}_{i}')
+            job['base_dir'] = base_dir
+            jobs.append(job)
+    return jobs
+
+
+def get_params_filepath(name, base_dir, params_dir):
+    """Returns path to printing params: .json path or name in params_dir."""
+    if name.endswith('.json'):
+        return os.path.abspath(_resolve_path(name, base_dir))
+    return os.path.abspath(os.path.join(params_dir, name + '.json'))
+
+
+def get_profile(filepath):
+    """Returns compiled Material_profile of printing params (cached)."""
+    if filepath not in _profiles:
+        from tool_changer_functions import load_params
+        from gcode_generator import compile_profile
+        _profiles[filepath] = compile_profile(load_params(filepath))
+    return _profiles[filepath]
+
+
+def get_generators(params_filepaths):
+    """Returns generator_multi and region g_code cache for printing params (cached).
+
+    Args:
+        params_filepaths (dict): {material: params filepath}
+    """
+    key = tuple(sorted(params_filepaths.items()))
+    if key not in _generators:
+        from gcode_generator import generator_multi
+        profiles = {mat: get_profile(filepath) for mat, filepath in params_filepaths.items()}
+        _generators[key] = generator_multi(profiles)
+        _region_caches[key] = {}
+    return _generators[key], _region_caches[key]
+
+
+def plot_job(regions, filepath, trace_width=0.42):
+    """Saves plot of all regions of a job (matplotlib is imported here)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from plotting_functions import plot_defined_regions
+
+    layers = sorted(set(reg['layer'] for reg in regions.values()))
+    fig, ax = plt.subplots()
+    plot_defined_regions(fig, ax, regions, layers, trace_width=trace_width)
+    fig.savefig(filepath)
+    plt.close(fig)
+
+
+def build_job(job, output_dir='generated_gcodes', params_dir='printing_params',
+              compression=None, tee=False):
+    """Builds g_code of one job and writes it to a file.
+
+    Args:
+        job (dict): job specs (see module docstring), 'base_dir' for relative paths
+        output_dir (string, optional): default output directory. Defaults to 'generated_gcodes'.
+        params_dir (string, optional): directory of printing params. Defaults to 'printing_params'.
+        compression (string, optional): default compression of jobs (see G_code_writer).
+                                        Defaults to None (by file extension).
+        tee (bool, optional): writes also uncompressed g_code (output path without
+                              compression extension). Defaults to False.
+
+    Returns:
+        dict: includes keys 'name', 'filepath', 'layers', 'size_bytes', 'time_sec'
+    """
+    t0 = time.perf_counter()
+    from job_functions import generate_layers, iter_job, resolve_compression, G_code_writer
+    from gcode_functions import g_code_header
+
+    base_dir = job.get('base_dir', '.')
+    params_filepaths = {mat: get_params_filepath(name, base_dir, params_dir)
+                        for mat, name in job['printing_params'].items()}
+    generators, cache = get_generators(params_filepaths)
+    printer_settings = _load_json(job['printer_settings'], base_dir)
+    regions = _load_json(job['regions'], base_dir)
+
+    if 'output' in job:
+        filepath = _resolve_path(job['output'], base_dir)
+    else:
+        filepath = os.path.join(output_dir, job['name'] + '.gcode')
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+
+    with generators.stream():
+        layers = generate_layers(regions, generators, cache=cache)
+    chunks = iter_job(layers, printer_settings,
+                      tool_fans=job.get('tool_fans'), beep=job.get('beep', True),
+                      printing_params=generators)
+    if job.get('header', False):
+        header = g_code_header({mat: dict(gen.printing_params)
+                                for mat, gen in generators.__dict__.items()})
+        chunks = [header, *chunks]
+    filepath, compression = resolve_compression(filepath, job.get('compression', compression))
+    tee_filepath = None
+    if tee and compression != 'none':
+        tee_filepath = os.path.splitext(filepath)[0]
+    with G_code_writer(filepath, compression=compression, tee_filepath=tee_filepath) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    if 'plot' in job:
+        plot_job(regions, _resolve_path(job['plot'], base_dir))
+
+    return {
+        'name': job['name'],
+        'filepath': filepath,
+        'layers': len(layers),
+        'size_bytes': os.path.getsize(filepath),
+        'time_sec': time.perf_counter() - t0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates g_code of jobs defined in job files.')
+    parser.add_argument('job_files', nargs='+', help='job files (.json)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of jobs built in parallel (worker processes)')
+    parser.add_argument('--output-dir', '-o', default='generated_gcodes',
+                        help='output directory for jobs without "output"')
+    parser.add_argument('--params-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             'printing_params'),
+                        help='directory of printing params .json files')
+    parser.add_argument('--compress', choices=['gzip', 'zstd', 'auto'], default=None,
+                        help='compression of g_code files (auto - zstd if installed, else gzip)')
+    parser.add_argument('--tee', action='store_true',
+                        help='writes also uncompressed g_code files')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    jobs = load_jobs(args.job_files)
+
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        results = executor.map(build_job, jobs, [args.output_dir] * len(jobs),
+                               [args.params_dir] * len(jobs), [args.compress] * len(jobs),
+                               [args.tee] * len(jobs))
+    else:
+        executor = None
+        results = (build_job(job, args.output_dir, args.params_dir, args.compress, args.tee)
+                   for job in jobs)
+
+    total_size = 0
+    for result in results:
+        total_size += result['size_bytes']
+        print(f'{result["name"]}: {result["layers"]} layers, {result["size_bytes"] / 1e3:.1f} kB, '
+              f'{result["time_sec"]:.3f} s -> {result["filepath"]}')
+    if executor is not None:
+        executor.shutdown()
+    print(f'{len(jobs)} jobs, {total_size / 1e3:.1f} kB, {time.perf_counter() - t0:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 import numpy as np
 import traceback
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 def g_code_header(printing_params):
     """Generates commented g_code of printing params for each material 
@@ -56,12 +59,152 @@ def get_print_limits(regions):
     return r
 
 
-def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
+def process_g_code(filepath, tool_unload_time=3, tool_load_time=20, breakdown=False,
+                   processes=1):
     """
     Args:
         filepath (string): path to g_code file .g
         tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
         tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+        breakdown (bool, optional): returns also breakdown table (see process_g_code_lines). 
+                                    Defaults to False.
+        processes (int, optional): number of processes for parsing of the file 
+                                   (see process_g_code_parallel), None for os.cpu_count(). 
+                                   Defaults to 1.
+
+    Returns:
+        return_dict (dict): see process_g_code_lines
+        breakdown_table (list): only if breakdown=True
+    """
+    
+    if processes != 1:
+        if breakdown:
+            raise Exception('Breakdown is not supported with parallel parsing.')
+        return process_g_code_parallel(filepath, 
+                                       tool_unload_time=tool_unload_time, 
+                                       tool_load_time=tool_load_time,
+                                       processes=processes)
+    
+    # reading g_code lines
+    with open(filepath) as f:
+        lines = f.readlines()
+    
+    return process_g_code_lines(lines, 
+                                tool_unload_time=tool_unload_time, 
+                                tool_load_time=tool_load_time,
+                                breakdown=breakdown)
+
+
+def get_section_name(comment_line):
+    """Returns (name, 'start' or 'end') of a section comment line 
+    ('; name - start', '; name - end') or (None, None).
+    """
+    line = comment_line.strip()
+    for kind in ['start', 'end']:
+        if line.startswith(';') and line.endswith(f' - {kind}'):
+            return line[1:-len(f' - {kind}')].strip(), kind
+    return None, None
+
+
+def get_layers_z(z):
+    """Assigns moves to layers: print heights are local minima of z,
+    lifts and travels before the first path of a layer belong to that layer.
+
+    Args:
+        z (numpy array): z coordinate of each move
+
+    Returns:
+        numpy array: layer z of each move
+    """
+    n = len(z)
+    if n == 0:
+        return z
+    prev = np.concatenate([[np.inf], z[:-1]])
+    nxt = np.concatenate([z[1:], [np.inf]])
+    is_min = (z <= prev) & (z <= nxt)
+    # backward fill from next minimum
+    next_min = np.where(is_min, np.arange(n), n)
+    next_min = np.minimum.accumulate(next_min[::-1])[::-1]
+    # forward fill after the last minimum
+    last_min = np.flatnonzero(is_min)[-1]
+    next_min[next_min == n] = last_min
+    return np.round(z[next_min], 5)
+
+
+def _breakdown_table(durations, extrusions, categories, tools, regions, layers_z, materials):
+    """Groups durations and extrusions by tool, layer, region and category (vectorized).
+
+    Returns:
+        list: rows (dicts) of the breakdown table
+    """
+    tool_names, tool_ids = np.unique(np.asarray(tools, dtype=str), return_inverse=True)
+    region_names, region_ids = np.unique(np.asarray(regions, dtype=str), return_inverse=True)
+    category_names, category_ids = np.unique(np.asarray(categories, dtype=str), return_inverse=True)
+    layer_values, layer_ids = np.unique(layers_z, return_inverse=True)
+    
+    keys = np.ravel_multi_index((tool_ids.ravel(), layer_ids.ravel(), region_ids.ravel(), category_ids.ravel()),
+                                (len(tool_names), len(layer_values), len(region_names), len(category_names)))
+    groups, group_ids = np.unique(keys, return_inverse=True)
+    group_time = np.bincount(group_ids, weights=durations)
+    group_extrusion = np.bincount(group_ids, weights=extrusions)
+    group_count = np.bincount(group_ids)
+    
+    rows = []
+    for g, key in enumerate(groups):
+        t, l, r, c = np.unravel_index(key, (len(tool_names), len(layer_values), 
+                                            len(region_names), len(category_names)))
+        tool = str(tool_names[t])
+        rows.append({
+            'tool': tool if tool != '' else None,
+            'material': materials.get(tool),
+            'layer_z': float(layer_values[l]),
+            'region': str(region_names[r]) if region_names[r] != '' else None,
+            'category': str(category_names[c]),
+            'time_sec': round(float(group_time[g]), 3),
+            'extrusion_mm': round(float(group_extrusion[g]), 5),
+            'lines': int(group_count[g]),
+        })
+    return rows
+
+
+def _set_firmware_retraction(retraction, words):
+    """Updates firmware retraction params {S, F, T, R} with words of M207 line."""
+    for word in words[1:]:
+        if len(word) > 1 and word[0] in 'SFTR':
+            retraction[word[0]] = float(word[1:])
+    if 'T' not in retraction and 'F' in retraction: # unretract feedrate defaults to retract feedrate
+        retraction['T'] = retraction['F']
+
+
+def _firmware_retraction_move(retraction, words):
+    """Returns (extrusion, feedrate) of G10/G11 firmware retraction line
+    (as the equivalent G1 E move) or None if the line is not a firmware retraction
+    or the retraction params are not set (M207)."""
+    if len(words) != 1 or 'S' not in retraction: # G10 with params sets tool offsets and temps
+        return None
+    if words[0] == 'G10':
+        return -retraction['S'], retraction['F']
+    if words[0] == 'G11':
+        return retraction['S'] + retraction.get('R', 0), retraction['T']
+    return None
+
+
+def process_g_code_lines(lines, tool_unload_time=3, tool_load_time=20, from_first_point=False,
+                         breakdown=False):
+    """Estimates print time and used filament of g_code lines 
+    (generated g_code does not need to be saved to a file first).
+
+    Args:
+        lines (list): list of g_code lines (or g_code string with \n line split)
+        tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
+        tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+        from_first_point (bool, optional): the first move starts at its own point instead of 
+                                           at the origin (for parts of g_code, e.g. layers). 
+                                           Defaults to False.
+        breakdown (bool, optional): returns also breakdown table - time, extrusion and number of 
+                                    lines grouped by tool, layer, region (section comment) and 
+                                    category (extrusion, travel, retract_wipe, tool_change). 
+                                    Defaults to False.
 
     Returns:
         return_dict (dict): includes keys:
@@ -73,11 +216,13 @@ def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
                                 'only_extrusion_duration_sec'
                                 'tool_unloads_duration'
                                 'tool_loads_duration'
+        breakdown_table (list): only if breakdown=True, list of dicts with keys:
+                                'tool', 'material', 'layer_z', 'region', 'category',
+                                'time_sec', 'extrusion_mm', 'lines'
     """
     
-    # reading g_code lines
-    with open(filepath) as f:
-        lines = f.readlines()
+    if isinstance(lines, str):
+        lines = lines.split('\n')
     
     coordinates = []
     extrusions = []
@@ -86,6 +231,16 @@ def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
     num_tool_unloads = 0
     num_tool_loads = 0
     
+    # breakdown context
+    move_g1 = []
+    move_tools = []
+    move_regions = []
+    tool_events = [] # (move index, tool, region)
+    materials = {} # tool: material (from tool load/change comments)
+    tool = ''
+    open_regions = []
+    retraction = {} # firmware retraction params (M207)
+    
     for l in lines: # iterating through lines
         
         try:
@@ -99,10 +254,37 @@ def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
             if ';' in words:
                 comment_index = words.index(';')
                 if comment_index == 0: # line with only comment
+                    if breakdown:
+                        name, kind = get_section_name(l)
+                        if name is None:
+                            pass
+                        elif name.startswith('---'): # tool load/change comments
+                            if name.count(':') >= 2 and kind == 'start':
+                                tools_str, mats_str = name.split(':', 1)[1].rsplit(':', 1)
+                                for t, m in zip(tools_str.split('->'), mats_str.split('->')):
+                                    materials[t.strip()] = m.strip()
+                        elif kind == 'start':
+                            open_regions.append(name)
+                        elif name in open_regions:
+                            open_regions.remove(name)
                     continue
                 else:
                     words = words[:comment_index]
 
+            if words[0] == 'M207':
+                _set_firmware_retraction(retraction, words)
+
+            if words[0] in ['G10', 'G11']: # firmware retraction - extrusion without movement
+                move = _firmware_retraction_move(retraction, words)
+                if move is not None:
+                    coordinates.append([x, y, z])
+                    extrusions.append(move[0])
+                    feedrates.append(move[1])
+                    if breakdown:
+                        move_g1.append(True)
+                        move_tools.append(tool)
+                        move_regions.append(open_regions[-1] if open_regions else '')
+
             if words[0] in ['G0', 'G1']: # iterating over moving and printing lines
 
                 coord = [None, None, None]
@@ -138,12 +320,21 @@ def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
                 coordinates.append(coord)
                 extrusions.append(extrusion)
                 feedrates.append(feedrate)
+                if breakdown:
+                    move_g1.append(words[0] == 'G1')
+                    move_tools.append(tool)
+                    move_regions.append(open_regions[-1] if open_regions else '')
 
             if words[0][0] == 'T': # tool loads and unloads
                 if words[0] == 'T-1':
                     num_tool_unloads += 1
                 else:
                     num_tool_loads += 1
+                if breakdown:
+                    tool_events.append((len(coordinates), words[0], 
+                                        open_regions[-1] if open_regions else ''))
+                    if len(words) == 1: # tool selection (not activation 'T1 P0')
+                        tool = words[0] if words[0] != 'T-1' else ''
         
         except Exception:
             print(f'Error at line:{l}')
@@ -153,7 +344,9 @@ def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
     all_extrusions = np.sum(extrusions)
     
     # calculating durations:
-    distances = np.abs(np.diff(np.asarray(coordinates), axis=0, prepend=0)) # razlike med posameznimi koordinatami
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+    prepend = coordinates[:1] if from_first_point else 0
+    distances = np.abs(np.diff(coordinates, axis=0, prepend=prepend)) # razlike med posameznimi koordinatami
     absolute_distances = np.sqrt(np.sum(np.square(distances), axis=1)) # sqrt(x^2 + y^2 + z^2) - dolžina vektroja pomika
     print_durations = absolute_distances / (np.asarray(feedrates) / 60)
     print_duration = np.sum(print_durations)
@@ -185,9 +378,241 @@ def process_g_code(filepath, tool_unload_time=3, tool_load_time=20):
         'tool_loads_duration': round(tool_loads_duration, 2)
     }
     
-    return return_dict
+    if not breakdown:
+        return return_dict
+    
+    # breakdown - durations and categories of all moves and tool events
+    extrusions = np.asarray(extrusions, dtype=float)
+    durations = print_durations.astype(float)
+    durations[no_movement_args.ravel()] += only_extrusion_durations.ravel()
+    is_g1 = np.asarray(move_g1, dtype=bool)
+    categories = np.where(~is_g1, 'travel', 
+                          np.where((absolute_distances > 0) & (extrusions > 0), 'extrusion', 'retract_wipe'))
+    layers_z = get_layers_z(coordinates[:,2]) if len(coordinates) > 0 else np.zeros(0)
+    
+    # tool events are attributed to the layer of the next move
+    event_index = np.array([min(e[0], len(coordinates) - 1) for e in tool_events], dtype=int)
+    event_tools = [e[1] if e[1] != 'T-1' else (move_tools[e[0] - 1] if e[0] > 0 else '') 
+                   for e in tool_events]
+    event_durations = [tool_unload_time if e[1] == 'T-1' else tool_load_time for e in tool_events]
+    
+    table = _breakdown_table(
+        durations=np.concatenate([durations, event_durations]),
+        extrusions=np.concatenate([extrusions, np.zeros(len(tool_events))]),
+        categories=list(categories) + ['tool_change'] * len(tool_events),
+        tools=move_tools + event_tools,
+        regions=move_regions + [e[2] for e in tool_events],
+        layers_z=np.concatenate([layers_z, layers_z[event_index] if len(layers_z) > 0 
+                                 else np.full(len(tool_events), np.nan)]),
+        materials=materials)
+    
+    return return_dict, table
+
+
+
+
+def _move_durations(coordinates, previous, extrusions, feedrates):
+    """Durations of moves (as in process_g_code_lines) from the previous coordinate.
+
+    Returns:
+        print_duration (float), only_extrusion_duration (float)
+    """
+    distances = np.abs(np.diff(coordinates, axis=0, prepend=previous))
+    absolute_distances = np.sqrt(np.sum(np.square(distances), axis=1))
+    print_duration = np.sum(absolute_distances / (feedrates / 60))
+    no_movement = absolute_distances == 0
+    only_extrusion_duration = np.sum(np.abs(extrusions[no_movement]) / (feedrates[no_movement] / 60))
+    return print_duration, only_extrusion_duration
+
+
+def _forward_fill(values):
+    """Fills NaN values in columns with previous defined values."""
+    index = np.where(np.isnan(values), 0, np.arange(len(values))[:,None])
+    index = np.maximum.accumulate(index, axis=0)
+    return np.take_along_axis(values, index, axis=0)
+
 
+def _process_g_code_chunk(args):
+    """Parses a newline-aligned byte range of a g_code file (runs in a worker process).
+    The file is memory-mapped in the worker, only numbers are returned.
+    Moves before X, Y, Z and F are all defined in the chunk (head) are returned 
+    unprocessed, they are completed with the modal state of previous chunks.
+    Firmware retractions (G10/G11) are only counted in order with M207 lines of the chunk,
+    they are completed with the retraction params merged over all previous chunks.
 
+    Args:
+        args (tuple): (filepath, start, end)
+
+    Returns:
+        dict: partial sums, head moves and last modal state of the chunk
+    """
+    filepath, start, end = args
+    with open(filepath, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        text = mm[start:end].decode()
+        mm.close()
+    
+    values = [] # x, y, z, e, f
+    num_tool_unloads = 0
+    num_tool_loads = 0
+    retraction_log = [] # M207 words and counts of consecutive G10/G11 in order
+    for l in text.split('\n'):
+        words = l.split()
+        if len(words) == 0:
+            continue
+        if ';' in words:
+            comment_index = words.index(';')
+            if comment_index == 0:
+                continue
+            words = words[:comment_index]
+        if words[0] in ['G0', 'G1']:
+            move = [np.nan, np.nan, np.nan, 0, np.nan]
+            for word in words:
+                if len(word) < 2:
+                    continue
+                i = 'XYZEF'.find(word[0])
+                if i >= 0:
+                    move[i] = float(word[1:])
+            values.append(move)
+        if words[0] == 'M207':
+            retraction_log.append(['M207', words])
+        if words[0] in ['G10', 'G11'] and len(words) == 1:
+            if retraction_log and retraction_log[-1][0] == words[0]:
+                retraction_log[-1][1] += 1
+            else:
+                retraction_log.append([words[0], 1])
+        if words[0][0] == 'T':
+            if words[0] == 'T-1':
+                num_tool_unloads += 1
+            else:
+                num_tool_loads += 1
+    
+    values = np.asarray(values, dtype=float).reshape(-1, 5)
+    filled = _forward_fill(values[:,[0, 1, 2, 4]])
+    known = np.flatnonzero(~np.any(np.isnan(filled), axis=1))
+    h = known[0] if len(known) > 0 else len(values) # first move with complete modal state
+    
+    # body - moves after the first complete move
+    body = filled[h:]
+    print_duration, only_extrusion_duration = 0, 0
+    if len(body) > 1:
+        print_duration, only_extrusion_duration = _move_durations(
+            body[1:,:3], body[:1,:3], values[h+1:,3], body[1:,3])
+    
+    return {
+        'extrusions': np.sum(values[:,3]),
+        'print_duration': print_duration,
+        'only_extrusion_duration': only_extrusion_duration,
+        'head': values[:h+1],
+        'retraction_log': retraction_log,
+        'last': filled[-1] if len(filled) > 0 else None,
+        'num_tool_unloads': num_tool_unloads,
+        'num_tool_loads': num_tool_loads,
+    }
+
+
+def get_file_chunks(filepath, n_chunks):
+    """Splits a file into newline-aligned byte ranges.
+
+    Returns:
+        list: list of (start, end) byte offsets
+    """
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return []
+    with open(filepath, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        bounds = [0]
+        for i in range(1, n_chunks):
+            pos = mm.find(b'\n', max(size * i // n_chunks, bounds[-1]))
+            if pos < 0:
+                break
+            if pos + 1 > bounds[-1] and pos + 1 < size:
+                bounds.append(pos + 1)
+        bounds.append(size)
+        mm.close()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def process_g_code_parallel(filepath, tool_unload_time=3, tool_load_time=20, 
+                            processes=None, chunks_per_process=4):
+    """Parallel version of process_g_code for large files. The file is split into 
+    newline-aligned chunks which are parsed from memory-mapped file in a process pool.
+    Chunks are stitched together by carrying the modal state (last X, Y, Z, F) and
+    firmware retraction params (M207), results are the same as with serial parsing.
+
+    Args:
+        filepath (string): path to g_code file .g
+        tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
+        tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+        processes (int, optional): number of processes. Defaults to os.cpu_count().
+        chunks_per_process (int, optional): number of chunks per process. Defaults to 4.
+
+    Returns:
+        return_dict (dict): see process_g_code_lines
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    chunks = get_file_chunks(filepath, processes * chunks_per_process)
+    tasks = [(filepath, start, end) for start, end in chunks]
+    
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(_process_g_code_chunk, tasks))
+    
+    all_extrusions = 0
+    print_duration = 0
+    only_extrusion_duration = 0
+    num_tool_unloads = 0
+    num_tool_loads = 0
+    state = np.zeros(4) # modal x, y, z, f (serial parse measures first move from origin)
+    retraction = {} # firmware retraction params (M207) merged over chunks
+    for r in results:
+        all_extrusions += r['extrusions']
+        for command, value in r['retraction_log']:
+            if command == 'M207':
+                _set_firmware_retraction(retraction, value)
+                continue
+            move = _firmware_retraction_move(retraction, [command])
+            if move is not None:
+                all_extrusions += value * move[0]
+                only_extrusion_duration += value * abs(move[0]) / (move[1] / 60)
+        num_tool_unloads += r['num_tool_unloads']
+        num_tool_loads += r['num_tool_loads']
+        print_duration += r['print_duration']
+        only_extrusion_duration += r['only_extrusion_duration']
+        
+        # head moves completed with modal state of previous chunks
+        head = r['head']
+        if len(head) > 0:
+            filled = _forward_fill(np.vstack([state, head[:,[0, 1, 2, 4]]]))
+            durations = _move_durations(filled[1:,:3], filled[:1,:3], head[:,3], filled[1:,3])
+            print_duration += durations[0]
+            only_extrusion_duration += durations[1]
+            state = filled[-1]
+        if r['last'] is not None and not np.any(np.isnan(r['last'])):
+            state = r['last']
+    
+    # tool changes:
+    tool_unloads_duration = num_tool_unloads * tool_unload_time
+    tool_loads_duration = num_tool_loads * tool_load_time
+    
+    # print time:
+    print_time = print_duration + only_extrusion_duration + tool_unloads_duration + tool_loads_duration
+    print_time_mins = print_time / 60
+    print_time_hours = print_time_mins / 60
+    
+    return_dict = {
+        'print_time_hours': round(print_time_hours, 2),
+        'print_time_mins': round(print_time_mins, 2),
+        'print_time_sec': round(print_time, 2),
+        'all_extrusions_mm': round(all_extrusions, 2),
+        'print_duration_sec': round(print_duration, 2),
+        'only_extrusion_duration_sec': round(only_extrusion_duration, 2),
+        'tool_unloads_duration': round(tool_unloads_duration, 2),
+        'tool_loads_duration': round(tool_loads_duration, 2)
+    }
+    
+    return return_dict
 
 
 def move_g_code(g_code, dX=0, dY=0, dZ=0):
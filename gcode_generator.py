@@ -1,60 +1,239 @@
+import contextlib
+import contextvars
+import threading
+import weakref
+from dataclasses import dataclass
+from types import MappingProxyType
 import numpy as np
 
+
+@dataclass(frozen=True)
+class Material_profile:
+    """Immutable printing params of a material with derived constants (see compile_profile).
+    Feedrates are in mm/min.
+    """
+    printing_params: MappingProxyType
+    d_nozzle: float
+    d_filament: float
+    layer_height: float
+    trace_width: float
+    trace_spacing: float
+    extrude_factor: float
+    move_feedrate: float
+    print_feedrate: float
+    nozzle_lift: float
+    retract_len: float
+    retract_feedrate: float
+    wipe_len: float
+    wipe_feedrate: float
+    max_volumetric_flow: float
+    max_print_feedrate: float
+    pressure_advance: float
+    firmware_retraction: bool
+    filament_area: float
+    trace_area: float
+    extrusion_area_ratio: float
+
+    def __reduce__(self): # pickled as printing params (e.g. for process pools)
+        return (compile_profile, (dict(self.printing_params),))
+
+
+def compile_profile(printing_params):
+    """Compiles printing params of a material into an immutable profile.
+
+    Args:
+        printing_params (dict or Material_profile): printing params (see G_code_generator)
+
+    Returns:
+        Material_profile: profile with feedrates in mm/min, filament and trace cross-section
+                          areas in mm^2 and their ratio (extruded filament length per trace length)
+    """
+    if isinstance(printing_params, Material_profile):
+        return printing_params
+
+    max_print_feedrate = printing_params.get('max_print_feedrate')
+    if max_print_feedrate is None:
+        max_print_feedrate = printing_params['print_feedrate']
+
+    w = printing_params['trace_width']
+    h = printing_params['layer_height']
+    filament_area = np.pi * printing_params['d_filament']**2 / 4
+    trace_area = (w - h) * h + np.pi * h**2 / 4
+
+    return Material_profile(
+        printing_params=MappingProxyType(dict(printing_params)),
+        d_nozzle=printing_params['d_nozzle'],
+        d_filament=printing_params['d_filament'],
+        layer_height=h,
+        trace_width=w,
+        trace_spacing=printing_params['trace_spacing'],
+        extrude_factor=printing_params['extrude_factor'],
+        # feedrates: mm/s to mm/min
+        move_feedrate=printing_params['move_feedrate'] * 60,
+        print_feedrate=printing_params['print_feedrate'] * 60,
+        nozzle_lift=printing_params['nozzle_lift'],
+        retract_len=printing_params['retract_len'],
+        retract_feedrate=printing_params['retract_feedrate'] * 60,
+        wipe_len=printing_params['wipe_len'],
+        wipe_feedrate=printing_params['wipe_feedrate'] * 60,
+        max_volumetric_flow=printing_params.get('max_volumetric_flow'),
+        max_print_feedrate=max_print_feedrate * 60,
+        pressure_advance=printing_params.get('pressure_advance'),
+        firmware_retraction=bool(printing_params.get('firmware_retraction', False)),
+        filament_area=filament_area,
+        trace_area=trace_area,
+        extrusion_area_ratio=trace_area / filament_area,
+    )
+
+
+class Path_context:
+    """Path state of one g_code stream (nozzle history and current z)."""
+
+    def __init__(self):
+        self.nozzle_locations = []
+        self.current_z = None
+        self.current_layer_height = None
+
+
+# path contexts of generators: {generator: Path_context} (weak keys - contexts are freed
+# with their generators), one mapping for each stream (see G_code_generator.stream)
+# and one for each thread outside of streams
+_stream_contexts = contextvars.ContextVar('stream_path_contexts', default=None)
+_thread_contexts = threading.local()
+
+
 class generator_multi():
     """Creates an object with attributes being G_code_generator object, 
     defined by the mat_params_dict.
     
     Params:
     mat_params_dict [dict] - keys = materials, values = dict of print parameters
+                             or Material_profile (shared between generators)
     """
     def __init__(self, mat_params_dict):
         for mat, params in mat_params_dict.items():
             self.__dict__[mat] = G_code_generator(params)
 
+    @contextlib.contextmanager
+    def stream(self):
+        """Renders with new path contexts of all generators (see G_code_generator.stream)."""
+        with contextlib.ExitStack() as stack:
+            yield {mat: stack.enter_context(gen.stream()) for mat, gen in self.__dict__.items()}
+
 class G_code_generator:
     """
     Class for generating g-code for FDM/FFF 3D printing.
+    Printing params are compiled into an immutable Material_profile, the path state
+    (nozzle_locations, current_z) is kept in a Path_context of the current stream or
+    thread - one generator can render several g_code streams concurrently (see stream).
+    Asyncio tasks of the same thread share the path state unless they render inside stream.
     """
 
     def __init__(self, printing_params):
         """
         Params:
-        printing_params [dict]
+        printing_params [dict or Material_profile]
             printing parameters: 
                 d_nozzle, d_filament, layer_height, 
                 trace_width, trace_spacing, extrude_factor, 
                 move_feedrate, print_feedrate, nozzle_lift, 
                 retract_len, retract_feedrate, wipe_len, 
                 wipe_feedrate
+            optional printing params:
+                max_volumetric_flow (mm^3/s) - enables feedrate planning (see plan_feedrates),
+                max_print_feedrate (mm/s) - defaults to print_feedrate
+                pressure_advance (s) - K-factor emitted at tool load/change (see assemble_job)
+                firmware_retraction (bool) - retracts with G10/G11 instead of G1 E moves, without wipe
+                                             (retraction params at tool load/change, see set_firmware_retraction)
         """
         
-        # defining printing params:
-        self.printing_params = printing_params
-        self.d_nozzle = printing_params['d_nozzle']
-        self.d_filament = printing_params['d_filament']
-        self.layer_height = printing_params['layer_height']
-        self.trace_width = printing_params['trace_width']
-        self.trace_spacing = printing_params['trace_spacing']
-        self.extrude_factor = printing_params['extrude_factor']
-        self.move_feedrate = printing_params['move_feedrate']
-        self.print_feedrate = printing_params['print_feedrate']
-        self.nozzle_lift = printing_params['nozzle_lift']
-        self.retract_len = printing_params['retract_len']
-        self.retract_feedrate = printing_params['retract_feedrate']
-        self.wipe_len = printing_params['wipe_len']
-        self.wipe_feedrate = printing_params['wipe_feedrate']
-        
-        # feedrates: mm/s to mm/min
-        self.move_feedrate = self.move_feedrate * 60
-        self.print_feedrate = self.print_feedrate * 60
-        self.retract_feedrate = self.retract_feedrate * 60
-        self.wipe_feedrate = self.wipe_feedrate * 60
-        
-        # internal history
-        self.nozzle_locations = []
-        self.current_layer_height = None
+        # defining printing params (feedrates in mm/min):
+        self.profile = compile_profile(printing_params)
+        self.printing_params = self.profile.printing_params
+        self.d_nozzle = self.profile.d_nozzle
+        self.d_filament = self.profile.d_filament
+        self.layer_height = self.profile.layer_height
+        self.trace_width = self.profile.trace_width
+        self.trace_spacing = self.profile.trace_spacing
+        self.extrude_factor = self.profile.extrude_factor
+        self.move_feedrate = self.profile.move_feedrate
+        self.print_feedrate = self.profile.print_feedrate
+        self.nozzle_lift = self.profile.nozzle_lift
+        self.retract_len = self.profile.retract_len
+        self.retract_feedrate = self.profile.retract_feedrate
+        self.wipe_len = self.profile.wipe_len
+        self.wipe_feedrate = self.profile.wipe_feedrate
+        self.max_volumetric_flow = self.profile.max_volumetric_flow
+        self.max_print_feedrate = self.profile.max_print_feedrate
+        self.pressure_advance = self.profile.pressure_advance
+        self.firmware_retraction = self.profile.firmware_retraction
     
 
+    def __reduce__(self): # pickled/copied with printing params only (without path state)
+        return (G_code_generator, (self.profile,))
+
+
+    @property
+    def context(self):
+        """Path context of the current stream (created for each thread outside of streams)."""
+        contexts = _stream_contexts.get()
+        if contexts is not None and self in contexts:
+            return contexts[self]
+        contexts = getattr(_thread_contexts, 'contexts', None)
+        if contexts is None:
+            contexts = _thread_contexts.contexts = weakref.WeakKeyDictionary()
+        context = contexts.get(self)
+        if context is None:
+            context = contexts[self] = Path_context()
+        return context
+
+
+    @contextlib.contextmanager
+    def stream(self, context=None):
+        """Renders with a separate path context in the current thread or asyncio task
+        (until the end of the with block), e.g. for rendering from a thread pool:
+            with gen.stream():
+                g_code = gen.print_region(region)
+
+        Params:
+        context ... Path_context to continue, defaults to a new one
+        """
+        if context is None:
+            context = Path_context()
+        contexts = weakref.WeakKeyDictionary(_stream_contexts.get() or {})
+        contexts[self] = context
+        token = _stream_contexts.set(contexts)
+        try:
+            yield context
+        finally:
+            _stream_contexts.reset(token)
+
+
+    @property
+    def nozzle_locations(self):
+        return self.context.nozzle_locations
+
+    @nozzle_locations.setter
+    def nozzle_locations(self, value):
+        self.context.nozzle_locations = value
+
+    @property
+    def current_z(self):
+        return self.context.current_z
+
+    @current_z.setter
+    def current_z(self, value):
+        self.context.current_z = value
+
+    @property
+    def current_layer_height(self):
+        return self.context.current_layer_height
+
+    @current_layer_height.setter
+    def current_layer_height(self, value):
+        self.context.current_layer_height = value
+
+
     def move_to_point(self, point, z, speed_factor=1, comment=None):
         """
         Generates G0 command for nozzle movement to x, y, z point.
@@ -106,8 +285,10 @@ class G_code_generator:
     
     def retract(self):
         """
-        Generates G1 command for retract.
+        Generates G1 command for retract (G10 with firmware retraction).
         """
+        if self.firmware_retraction:
+            return 'G10 ; retract\n'
         g_code  = f'G1 '
         g_code += f'E{-self.retract_len:.5f} '
         g_code += f'F{self.retract_feedrate:.0f} '
@@ -117,8 +298,10 @@ class G_code_generator:
         
     def unretract(self):
         """
-        Generates G1 command for unretract.
+        Generates G1 command for unretract (G11 with firmware retraction).
         """
+        if self.firmware_retraction:
+            return 'G11 ; unretract\n'
         g_code  = f'G1 '
         g_code += f'E{self.retract_len:.5f} '
         g_code += f'F{self.retract_feedrate:.0f} '
@@ -129,12 +312,14 @@ class G_code_generator:
     def wipe(self, angle):
         """
         Generates nozzle movement for wiping with G1 command.
-        Wipes back and forth.
+        Wipes back and forth, no wipe with firmware retraction.
         Params:
         angle   ... float 0 - 360 deg (0 deg parallel with x axis)
         Returns:
         g_code  ... string (2 lines)
         """
+        if self.firmware_retraction:
+            return ''
         # last nozzle location
         x0, y0, z0 = self.nozzle_locations[-1]
         # calculation of point 1
@@ -165,13 +350,36 @@ class G_code_generator:
         Returns:
         extrude_length  ... float in mm
         """
-        w = self.trace_width
-        h = self.layer_height
-        A_in = np.pi * self.d_filament**2 / 4
-        A_out = (w - h) * h + np.pi * h**2 / 4
-        extrude_length = A_out / A_in * trace_length * self.extrude_factor
+        extrude_length = self.profile.extrusion_area_ratio * trace_length * self.extrude_factor
         return extrude_length
 
+    def plan_feedrates(self, trace_lengths, extrude_lengths, speed_factor=1):
+        """
+        Calculates printing feedrate of each segment (vectorized). 
+        Without max_volumetric_flow in printing params feedrate is print_feedrate * speed_factor.
+        With max_volumetric_flow feedrate is raised or lowered to reach the max volumetric
+        flow of the material, limited by max_print_feedrate * speed_factor.
+        Params:
+        trace_lengths   ... array of segment lengths in mm
+        extrude_lengths ... array of filament lengths of segments in mm (with extrude factors)
+        speed_factor    ... float: scales printing feedrate
+        Returns:
+        feedrates       ... array of feedrates in mm/min
+        """
+        trace_lengths = np.asarray(trace_lengths, dtype=float)
+        extrude_lengths = np.abs(np.asarray(extrude_lengths, dtype=float))
+        
+        if self.max_volumetric_flow is None:
+            return np.full(trace_lengths.shape, self.print_feedrate * speed_factor)
+        
+        volumes = extrude_lengths * self.profile.filament_area # extruded volume of segments in mm^3
+        # feedrate at max volumetric flow: v = Q_max * L / V
+        flow_feedrates = np.full(trace_lengths.shape, np.inf)
+        extruding = volumes > 0
+        flow_feedrates[extruding] = self.max_volumetric_flow * trace_lengths[extruding] / volumes[extruding] * 60
+        return np.minimum(flow_feedrates, self.max_print_feedrate * speed_factor)
+
+
     def _print_line(self, point0, point1,
                     extrude_factor=1, speed_factor=1, 
                     comment=None):
@@ -197,6 +405,7 @@ class G_code_generator:
         point1 = np.array(point1)
         line_length = np.sqrt(np.sum((point1-point0)**2))
         extrude_length = self.calculate_extrusion_length(line_length)
+        feedrate = self.plan_feedrates([line_length], [extrude_length * extrude_factor], speed_factor)[0]
 
         g_code = ''
         # 1) move to print point
@@ -207,7 +416,7 @@ class G_code_generator:
         g_code += f'Y{y1:.3f} '
         g_code += f'Z{z1:.3f} '
         g_code += f'E{extrude_length * extrude_factor:.5f} '
-        g_code += f'F{self.print_feedrate * speed_factor:.0f} '
+        g_code += f'F{feedrate:.0f} '
         g_code += f'; {comment}\n'
         self.nozzle_locations.append(point1) # adding point1 to object history
 
@@ -231,6 +440,7 @@ class G_code_generator:
         x1, y1 = point1
         line_length = np.sqrt((x1 - x0)**2 + (y1 - y0)**2)
         extrude_length = self.calculate_extrusion_length(line_length)
+        feedrate = self.plan_feedrates([line_length], [extrude_length * extrude_factor], speed_factor)[0]
         
         self.current_z = z
         
@@ -244,7 +454,7 @@ class G_code_generator:
         g_code += f'X{x1:.3f} '
         g_code += f'Y{y1:.3f} '
         g_code += f'E{extrude_length * extrude_factor:.5f} '
-        g_code += f'F{self.print_feedrate * speed_factor:.0f} '
+        g_code += f'F{feedrate:.0f} '
         g_code += f'; {comment}\n'
         self.nozzle_locations.append([x1, y1, z]) # adding point1 to object history
         # 4) retract
@@ -270,8 +480,9 @@ class G_code_generator:
         6) lift Z
         
         Params:
-        lines   ... array of lines - [[x1, y1], [x2, y2]] in mm
-        z       ... z height in mm
+        lines           ... array of lines - [[x1, y1], [x2, y2]] in mm
+        z               ... z height in mm
+        speed_factor    ... float or array (one for each line)
         """
         if comment == None:
             comment = 'connected line'
@@ -286,21 +497,23 @@ class G_code_generator:
         if self.extrude_factor != 0: # in case of no extrusion, unretract is not performed
             g_code += self.unretract()
         # 3) print lines
-        for line in lines:
+        lines = np.asarray(lines)
+        lengths = np.sqrt(np.sum(np.abs(lines[:,1] - lines[:,0])**2, axis=1))
+        extrusions = self.calculate_extrusion_length(lengths) * extrude_factor
+        feedrates = self.plan_feedrates(lengths, extrusions, speed_factor)
+        nozzle_locations = self.nozzle_locations
+        for line, e, f in zip(lines, extrusions, feedrates):
 
             x1, y1 = line[1]
-
-            l = self.calc_line_length(line[0], line[1])
-            e = self.calculate_extrusion_length(l)
     
             g_code += f'G1 '
             g_code += f'X{x1:.3f} '
             g_code += f'Y{y1:.3f} '
-            g_code += f'E{e * extrude_factor:.5f} '
-            g_code += f'F{self.print_feedrate * speed_factor:.0f} '
+            g_code += f'E{e:.5f} '
+            g_code += f'F{f:.0f} '
             g_code += f'; {comment}\n'
             
-            self.nozzle_locations.append([x1, y1, z]) # adding point1 to object history
+            nozzle_locations.append([x1, y1, z]) # adding point1 to object history
             
         # 4) retract
         if self.extrude_factor != 0: # in case of no extrusion, retract is not performed
@@ -372,25 +585,36 @@ class G_code_generator:
     def print_surface(self, surface, z, infill_angle=0, start=['x0', 'y0'],
                       perimeter=False, overlap_factor=0.25,
                       speed_factor=1, extrude_factor=1, comment=None,
-                      return_points=False):
+                      return_points=False, infill_spacing=None):
         """
         Generates g-code for a rectangle surface.
         Params:
         surface         ... [lower_left_vertice, upper_right_vertice] in [x, y] format in mm
         z               ... z height for nozzle tip
-        infill_angle    ... 0 (x direction) or 90 (y direction) deg
+        infill_angle    ... 0 (x direction) or 90 (y direction) deg, 
+                            other angles are printed with print_polygon
         start           ... 'left' or 'right'
         perimeter       ... bool (infill surface is adjusted to accomodate perimeter)
         overlap_factor  ... overlap between perimeter and infill in factor of self.trace_width
         ...
         return_points   ... returns list: [g_code, points, lines]
+        infill_spacing  ... distance between infill traces in mm, defaults to self.trace_spacing
         """
         
         if comment == None:
             comment = 'unnamed surface'
         
+        if infill_angle not in (0, 90): # arbitrary infill angle - surface is printed as a polygon
+            (x0, y0), (x1, y1) = np.asarray(surface)
+            polygon = [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+            return self.print_polygon(polygon, z, infill_angle=infill_angle, start=start,
+                                      perimeter=perimeter, overlap_factor=overlap_factor,
+                                      speed_factor=speed_factor, extrude_factor=extrude_factor,
+                                      comment=comment, return_points=return_points,
+                                      infill_spacing=infill_spacing)
+        
         w = self.trace_width
-        s = self.trace_spacing
+        s = self.trace_spacing if infill_spacing is None else infill_spacing
         # self.current_z = z
         
         # if perimeter is selected, infill surface is reduced by a trace width with defined overlap
@@ -533,14 +757,235 @@ class G_code_generator:
 
         return output
     
+    
+    def offset_polygon(self, polygon, distance):
+        """Offsets polygon edges inwards for the distance (mitered vertices).
+        
+        Params:
+        polygon     ... array of vertices [[x, y], ...] in mm (not closed)
+        distance    ... offset in mm, positive is inwards
+        Returns:
+        polygon     ... numpy array of offset vertices in counter-clockwise direction
+        """
+        polygon = np.asarray(polygon, dtype=float)
+        # removing duplicated consecutive vertices (zero length edges)
+        keep = np.any(polygon != np.roll(polygon, -1, axis=0), axis=1)
+        polygon = polygon[keep]
+        # counter-clockwise orientation (positive signed area)
+        x, y = polygon[:,0], polygon[:,1]
+        area = np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) / 2
+        if area < 0:
+            polygon = polygon[::-1]
+        
+        edges = np.roll(polygon, -1, axis=0) - polygon
+        edges = edges / np.linalg.norm(edges, axis=1)[:,None]
+        normals = np.column_stack([-edges[:,1], edges[:,0]]) # inward normals of edges
+        normals_prev = np.roll(normals, 1, axis=0) # normals of edges ending in vertex
+        miter = normals + normals_prev
+        miter_norm = np.linalg.norm(miter, axis=1)
+        miter_norm[miter_norm == 0] = 1
+        miter = miter / miter_norm[:,None]
+        # miter length, limited for sharp vertices
+        cos_half = np.clip(np.sum(miter * normals, axis=1), 0.25, 1)
+        return polygon + miter * (distance / cos_half)[:,None]
+    
+    
+    def get_polygon_infill_points(self, polygon, infill_angle=0, start=['x0', 'y0'], spacing=None):
+        """Calculates zig-zag infill points of a polygon for arbitrary infill angle.
+        Scanlines are intersected with all polygon edges at once (vectorized).
+        Polygon is not offset - infill traces are centered on polygon edges.
+        
+        Params:
+        polygon         ... array of vertices [[x, y], ...] in mm (not closed)
+        infill_angle    ... deg, 0 is x direction
+        start           ... ['x0' or 'x1', 'y0' or 'y1'] in coordinates rotated for infill_angle
+                            (x: direction of first trace, y: side of first trace)
+        spacing         ... distance between scanlines in mm, defaults to self.trace_spacing
+        Returns:
+        chains          ... list of numpy arrays of points [[x, y], ...], 
+                            each is printed as connected lines
+        """
+        s = self.trace_spacing if spacing is None else spacing
+        a = np.deg2rad(infill_angle)
+        rot = np.array([[np.cos(a), -np.sin(a)], 
+                        [np.sin(a), np.cos(a)]])
+        
+        # polygon rotated so that scanlines are parallel with x axis
+        p = np.asarray(polygon, dtype=float) @ rot
+        q = np.roll(p, -1, axis=0)
+        
+        # scanlines - centered between min and max y
+        y_min, y_max = p[:,1].min(), p[:,1].max()
+        N_scan = int(np.floor((y_max - y_min) / s)) + 1
+        y0_scan = y_min + (y_max - y_min - (N_scan - 1) * s) / 2
+        
+        # scanline index range crossed by each edge (half-open: lo <= y < hi)
+        lo = np.minimum(p[:,1], q[:,1])
+        hi = np.maximum(p[:,1], q[:,1])
+        k_lo = np.clip(np.ceil((lo - y0_scan) / s), 0, N_scan).astype(int)
+        k_hi = np.clip(np.ceil((hi - y0_scan) / s), 0, N_scan).astype(int)
+        counts = k_hi - k_lo
+        
+        # all (scanline, edge) intersections
+        edge_i = np.repeat(np.arange(len(p)), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        scan_i = k_lo[edge_i] + np.arange(len(edge_i)) - first
+        y_scan = y0_scan + scan_i * s
+        t = (y_scan - p[edge_i,1]) / (q[edge_i,1] - p[edge_i,1])
+        x_cross = p[edge_i,0] + t * (q[edge_i,0] - p[edge_i,0])
+        
+        # sorting by scanline and x; pairs of crossings are infill segments
+        order = np.lexsort((x_cross, scan_i))
+        x_cross = x_cross[order].reshape(-1, 2)
+        scan_seg = scan_i[order][0::2]
+        
+        # spliting segments into chains which can be printed as one zig-zag
+        seg_per_scan = np.bincount(scan_seg, minlength=N_scan)
+        scan_order = range(N_scan) if start[1] == 'y0' else range(N_scan - 1, -1, -1)
+        seg_first = np.cumsum(seg_per_scan) - seg_per_scan
+        
+        chains = []
+        open_chains = {} # segment index on scanline: list of segments
+        prev_count = None
+        for k in scan_order:
+            count = seg_per_scan[k]
+            if count != prev_count: # topology changes - closing all chains
+                chains += list(open_chains.values())
+                open_chains = {}
+            for j in range(count):
+                xa, xb = x_cross[seg_first[k] + j]
+                chain = open_chains.get(j)
+                if chain is not None and (xa > chain[-1][2] or xb < chain[-1][1]):
+                    chains.append(chain) # no overlap with previous segment
+                    chain = None
+                if chain is None:
+                    chain = []
+                    open_chains[j] = chain
+                chain.append((y0_scan + k * s, xa, xb))
+            prev_count = count
+        chains += list(open_chains.values())
+        
+        # zig-zag points of chains, rotated back
+        chains_points = []
+        for chain in chains:
+            chain = np.asarray(chain)
+            points = np.zeros((2 * len(chain), 2))
+            points[0::2,1] = chain[:,0]
+            points[1::2,1] = chain[:,0]
+            forward = (np.arange(len(chain)) % 2 == 0) == (start[0] == 'x0')
+            points[0::2,0] = np.where(forward, chain[:,1], chain[:,2])
+            points[1::2,0] = np.where(forward, chain[:,2], chain[:,1])
+            chains_points.append(points @ rot.T)
+        
+        return chains_points
+    
+    
+    def print_polygon_perimeter(self, polygon, z, 
+                                speed_factor=1, extrude_factor=1, comment=None):
+        """
+        Generates g-code for a perimeter of a polygon (trace inside the polygon).
+        Params:
+        polygon     ... array of vertices [[x, y], ...] in mm (not closed), starts at first vertex
+        z           ... z height for nozzle tip
+        """
+        if comment == None:
+            comment = 'unnamed polygon perimeter'
+        
+        points = self.offset_polygon(polygon, self.trace_width / 2)
+        points = np.vstack([points, points[:1]]) # closing polygon
+        lines = np.stack([points[:-1], points[1:]], axis=1)
+        
+        g_code = self.print_connected_lines(
+            lines,
+            z,
+            speed_factor=speed_factor,
+            extrude_factor=extrude_factor,
+            comment=comment)
+        
+        return g_code
+    
+    
+    def print_polygon(self, polygon, z, infill_angle=0, start=['x0', 'y0'],
+                      perimeter=False, overlap_factor=0.25,
+                      speed_factor=1, extrude_factor=1, comment=None,
+                      return_points=False, infill_spacing=None):
+        """
+        Generates g-code for a polygon surface with arbitrary infill angle.
+        Params:
+        polygon         ... array of vertices [[x, y], ...] in mm (not closed)
+        z               ... z height for nozzle tip
+        infill_angle    ... deg, 0 is x direction
+        start           ... see get_polygon_infill_points
+        perimeter       ... bool (infill surface is adjusted to accomodate perimeter)
+        overlap_factor  ... overlap between perimeter and infill in factor of self.trace_width
+        ...
+        return_points   ... returns list: [g_code, list of points, list of lines] (one for each chain)
+        infill_spacing  ... distance between infill traces in mm, defaults to self.trace_spacing
+        """
+        if comment == None:
+            comment = 'unnamed polygon'
+        
+        w = self.trace_width
+        
+        g_code = ''
+        # if perimeter is selected, infill polygon is reduced by a trace width with defined overlap
+        if perimeter:
+            g_code += self.print_polygon_perimeter(
+                polygon,
+                z,
+                speed_factor=speed_factor,
+                extrude_factor=extrude_factor,
+                comment=f'{comment} - perimeter')
+            infill_offset = w * (1 - overlap_factor) + w/2
+        else:
+            infill_offset = w/2
+        infill_polygon = self.offset_polygon(polygon, infill_offset)
+        
+        chains_points = self.get_polygon_infill_points(infill_polygon, infill_angle, start=start,
+                                                       spacing=infill_spacing)
+        chains_lines = []
+        for points in chains_points:
+            if len(points) < 2:
+                continue
+            lines = np.stack([points[:-1], points[1:]], axis=1)
+            chains_lines.append(lines)
+            g_code += self.print_connected_lines(
+                lines, 
+                z, 
+                speed_factor, 
+                extrude_factor, 
+                comment=f'{comment} - infill'
+            )
+        
+        if return_points:
+            output = [g_code, chains_points, chains_lines]
+        else:
+            output = g_code
+        
+        return output
+
+
+    def region_z(self, region_params):
+        """Returns z height (nozzle tip) of a region in mm.
 
+        Args:
+            region_params (dict): dict of region params with keys: layer, z_height
+
+        Returns:
+            float: z height in mm
+        """
+        if region_params['z_height'] is None: # checks if layer is defined as layer number or z height
+            z = region_params['layer'] * self.layer_height
+        else:
+            z = region_params['z_height']
+        return z
 
 
     def print_region(self, region_params, **kwargs):
         """
         TODO: update docstring
-        Generates g-code based on region parameters. Utilises print_surface and 
-        print_rectangular_perimeter functions of the class.
+        Generates g-code based on region parameters. Utilises print_surface, 
+        print_polygon and print_rectangular_perimeter functions of the class.
 
         Args:
             region_params (dict): dict of regions params with keys: 
@@ -548,6 +993,7 @@ class G_code_generator:
                                             position, dimensions, start_pos,
                                             infill_angle, perimeter, overlap_factor,
                                             speed_factor, extrude_factor, heading
+                                            (and vertices for region_type 'polygon')
         
             **kwargs: overide of the the region params with kwargs
         """
@@ -560,10 +1006,7 @@ class G_code_generator:
         pos = np.asarray(region_params['position'])
         dims = np.asarray(region_params['dimensions'])
         surface = [pos, pos + dims]
-        if region_params['z_height'] is None: # checks if layer is defined as layer number or z height
-            z = region_params['layer'] * self.layer_height
-        else:
-            z = region_params['z_height']
+        z = self.region_z(region_params)
         start = region_params['start_pos']
         speed_factor = region_params['speed_factor']
         extrude_factor = region_params['extrude_factor']
@@ -579,6 +1022,14 @@ class G_code_generator:
                                         speed_factor=speed_factor, extrude_factor=extrude_factor, 
                                         comment=comment, return_points=False)
         
+        elif region_params['region_type'] == 'polygon':
+            g_code = self.print_polygon(polygon=region_params['vertices'], z=z, 
+                                        infill_angle=region_params['infill_angle'], start=start, 
+                                        perimeter=region_params['perimeter'], 
+                                        overlap_factor=region_params['overlap_factor'],
+                                        speed_factor=speed_factor, extrude_factor=extrude_factor, 
+                                        comment=comment, return_points=False)
+        
         elif region_params['region_type'] == 'perimeter':
             g_code = self.print_rectangular_perimeter(rectangle=surface, z=z, start=start, 
                                                       speed_factor=speed_factor, 
@@ -587,8 +1038,170 @@ class G_code_generator:
         return g_code
     
     
+    def _stacked_arange(self, start, stop, step):
+        """Returns np.arange(start[k], stop[k], step[k]) for all k as (K, n) array
+        (same length n for all k, values equal to np.arange).
+        """
+        n = int(np.ceil((stop[0] - start[0]) / step[0]))
+        delta = (start + step) - start # np.arange fills with start + i * (second - first)
+        values = start[:,None] + np.arange(n) * delta[:,None]
+        values[:,0] = start
+        if n > 1:
+            values[:,1] = start + step
+        return values
+
+
+    def _zigzag_points(self, x0, y0, x1, y1, infill_angle, starts):
+        """Returns zig-zag infill points of rectangles with the same number of infill
+        lines (stacked print_surface points).
+
+        Args:
+            x0, y0, x1, y1 (numpy array): corners of infill surfaces, shape (K,)
+            infill_angle (int): 0 or 90 deg
+            starts (numpy array): bool array shape (K, 2), True for 'x1' and 'y1' start
+
+        Returns:
+            numpy array: shape (K, N, 2)
+        """
+        w = self.trace_width
+        s = self.trace_spacing
+        if infill_angle == 0: # zig-zag along y, lines in x direction
+            a0, a1, b0, b1 = x0, x1, y0, y1
+            start_a, start_b = starts[:,0], starts[:,1]
+        else: # zig-zag along x, lines in y direction
+            a0, a1, b0, b1 = y0, y1, x0, x1
+            start_a, start_b = starts[:,1], starts[:,0]
+
+        # line ends (first two arange points) and zig-zag coordinates
+        a_first = a0 + w/2
+        a_second = a_first + ((a1 - a0) - w)
+        b_points = self._stacked_arange(b0 + w/2, b1, np.full(len(b0), s))
+        b_max = b_points[:,-1] + w/2
+        b_corr = b1 - b_max
+        b_points = b_points + b_corr[:,None]/2
+
+        n = b_points.shape[1]
+        p = np.arange(2 * n)
+        second_end = (p % 4 == 1) | (p % 4 == 2)
+        a = np.where(second_end != start_a[:,None], a_second[:,None], a_first[:,None])
+        b_index = np.where(start_b[:,None], n - 1 - p//2, p//2)
+        b = np.take_along_axis(b_points, b_index, axis=1)
+
+        if infill_angle == 0:
+            return np.stack([a, b], axis=2)
+        return np.stack([b, a], axis=2)
+
+
+    def print_regions(self, regions_params, **kwargs):
+        """Generates g-code for many regions at once (e.g. all regions of a layer).
+        Points of rectangular perimeters and of 0/90 deg zig-zag infills are computed
+        for all regions in stacked numpy operations. The g_code (and nozzle history) is
+        equal to print_region called for each region in order.
+        Polygons and surfaces with other infill angles are printed with print_region.
+
+        Args:
+            regions_params (list or dict): region params dicts (see print_region)
+            **kwargs: overide of the the region params with kwargs
+
+        Returns:
+            string: g_code of all regions
+        """
+        if isinstance(regions_params, dict):
+            regions_params = list(regions_params.values())
+        regions_params = [dict(reg, **kwargs) for reg in regions_params]
+
+        starts_known = [('x0', 'y0'), ('x0', 'y1'), ('x1', 'y0'), ('x1', 'y1')]
+        batched = []
+        for i, reg in enumerate(regions_params):
+            if reg['region_type'] == 'polygon' or tuple(reg['start_pos']) not in starts_known:
+                continue
+            if reg['region_type'] == 'surface' and reg['infill_angle'] not in (0, 90):
+                continue
+            if reg['region_type'] in ('surface', 'perimeter'):
+                batched.append(i)
+
+        perimeter_lines = {}
+        infill_lines = {}
+        if batched:
+            w = self.trace_width
+            regs = [regions_params[i] for i in batched]
+            pos = np.array([reg['position'] for reg in regs], dtype=float)
+            dims = np.array([reg['dimensions'] for reg in regs], dtype=float)
+            starts = np.array([[reg['start_pos'][0] == 'x1', reg['start_pos'][1] == 'y1'] for reg in regs])
+            is_surface = np.array([reg['region_type'] == 'surface' for reg in regs])
+            has_perimeter = np.array([reg['region_type'] == 'perimeter' or bool(reg['perimeter']) for reg in regs])
+            s0 = pos
+            s1 = pos + dims
+
+            # perimeters (counter-clockwise from start corner, see print_rectangular_perimeter)
+            p0 = s0 + w/2
+            p1 = s1 - w/2
+            patterns = np.array([[[0, 1, 1, 0, 0], [0, 0, 1, 1, 0]],  # x0, y0
+                                 [[0, 0, 1, 1, 0], [1, 0, 0, 1, 1]],  # x0, y1
+                                 [[1, 1, 0, 0, 1], [0, 1, 1, 0, 0]],  # x1, y0
+                                 [[1, 0, 0, 1, 1], [1, 1, 0, 0, 1]]], # x1, y1
+                                dtype=bool)[2 * starts[:,0] + starts[:,1]]
+            x_use_1, y_use_1 = patterns[:,0], patterns[:,1]
+            points = np.stack([np.where(x_use_1, p1[:,0,None], p0[:,0,None]),
+                               np.where(y_use_1, p1[:,1,None], p0[:,1,None])], axis=2)
+            lines = np.stack([points[:,:-1], points[:,1:]], axis=2)
+            for k in np.nonzero(has_perimeter)[0]:
+                perimeter_lines[batched[k]] = lines[k]
+
+            # infills - stacked for regions with the same angle and number of lines
+            inset = np.array([w * (1 - reg['overlap_factor']) if reg['region_type'] == 'surface' and reg['perimeter']
+                              else 0. for reg in regs])
+            i0 = s0 + inset[:,None]
+            i1 = s1 + (-inset)[:,None]
+            angles = np.array([reg['infill_angle'] if reg['region_type'] == 'surface' else -1 for reg in regs])
+            b_axis = np.where(angles == 0, 1, 0)
+            a0 = i0[np.arange(len(regs)), 1 - b_axis]
+            a1 = i1[np.arange(len(regs)), 1 - b_axis]
+            b0 = i0[np.arange(len(regs)), b_axis]
+            b1 = i1[np.arange(len(regs)), b_axis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                n_a = np.ceil((a1 - (a0 + w/2)) / ((a1 - a0) - w))
+                n_b = np.ceil((b1 - (b0 + w/2)) / self.trace_spacing)
+            # other surfaces (e.g. too small for infill) are left to print_region
+            valid = is_surface & ((a1 - a0) - w > 0) & (n_a >= 2) & (n_b >= 1)
+            groups = {}
+            for k in np.nonzero(valid)[0]:
+                groups.setdefault((angles[k], n_b[k]), []).append(k)
+            for (angle, _), ks in groups.items():
+                ks = np.asarray(ks)
+                points = self._zigzag_points(i0[ks,0], i0[ks,1], i1[ks,0], i1[ks,1], angle, starts[ks])
+                lines = np.stack([points[:,:-1], points[:,1:]], axis=2)
+                for k, region_lines in zip(ks, lines):
+                    infill_lines[batched[k]] = region_lines
+
+        g_code = []
+        for i, reg in enumerate(regions_params):
+            z = self.region_z(reg)
+            speed_factor = reg['speed_factor']
+            extrude_factor = reg['extrude_factor']
+            comment = reg['heading']
+            if reg['region_type'] == 'perimeter' and i in perimeter_lines:
+                g_code.append(self.print_connected_lines(
+                    perimeter_lines[i], z, speed_factor=speed_factor, extrude_factor=extrude_factor,
+                    comment=comment if comment is not None else 'unnamed perimeter'))
+            elif reg['region_type'] == 'surface' and i in infill_lines:
+                if comment is None:
+                    comment = 'unnamed surface'
+                if reg['perimeter']:
+                    g_code.append(self.print_connected_lines(
+                        perimeter_lines[i], z, speed_factor=speed_factor, extrude_factor=extrude_factor,
+                        comment=f'{comment} - perimeter'))
+                g_code.append(self.print_connected_lines(
+                    infill_lines[i], z, speed_factor, extrude_factor, comment=f'{comment} - infill'))
+            else:
+                g_code.append(self.print_region(reg))
+
+        return ''.join(g_code)
+
+
     def print_cuboid(self, surface, z_start, height, skirts=None, perimeter=False,
-                      speed_factor=1, extrude_factor=1, comment=None):
+                      speed_factor=1, extrude_factor=1, comment=None,
+                      infill_density=1.0, solid_layers=3, return_report=False):
         """Generates g_code for a cuboid.
 
         Args:
@@ -600,21 +1213,93 @@ class G_code_generator:
             speed_factor (int, optional): Defaults to 1.
             extrude_factor (int, optional): Defaults to 1.
             heading (string, optional): Defaults to None.
+            infill_density (float, optional): infill density (0 - 1] of interior layers. Defaults to 1.0.
+            solid_layers (int, optional): number of solid bottom and top layers. Defaults to 3.
+            return_report (bool, optional): returns also report of savings of sparse infill
+                                            compared to a solid cuboid. Defaults to False.
             
         Returns:
             g_code_dict (dict): g_code strings for each layer height.
+            z_last (float): z height of the last layer.
+            report (dict): only with return_report, includes keys:
+                                'print_time_sec', 'extrusion_mm',
+                                'solid_print_time_sec', 'solid_extrusion_mm',
+                                'time_saved_sec', 'filament_saved_mm'
+        """
+        g_code_dict = {} # empty dict for g_code strings for each layer
+        
+        for z, g_code in self.iter_cuboid(surface, z_start, height, skirts=skirts, perimeter=perimeter,
+                                          speed_factor=speed_factor, extrude_factor=extrude_factor,
+                                          comment=comment, infill_density=infill_density,
+                                          solid_layers=solid_layers):
+            g_code_dict[z] = g_code
+            
+        z_last = z
+        
+        if not return_report:
+            return g_code_dict, z_last
+
+        from gcode_functions import process_g_code_lines
+        with self.stream(): # solid cuboid does not change the path state
+            solid_g_code = ''.join(g_code for _, g_code in self.iter_cuboid(
+                surface, z_start, height, skirts=skirts, perimeter=perimeter,
+                speed_factor=speed_factor, extrude_factor=extrude_factor, comment=comment))
+        sparse = process_g_code_lines(''.join(g_code_dict.values()).split('\n'), from_first_point=True)
+        solid = process_g_code_lines(solid_g_code.split('\n'), from_first_point=True)
+        report = {
+            'print_time_sec': float(sparse['print_time_sec']),
+            'extrusion_mm': float(sparse['all_extrusions_mm']),
+            'solid_print_time_sec': float(solid['print_time_sec']),
+            'solid_extrusion_mm': float(solid['all_extrusions_mm']),
+            'time_saved_sec': round(float(solid['print_time_sec'] - sparse['print_time_sec']), 2),
+            'filament_saved_mm': round(float(solid['all_extrusions_mm'] - sparse['all_extrusions_mm']), 2),
+        }
+        return g_code_dict, z_last, report
+    
+    
+    def iter_cuboid(self, surface, z_start, height, skirts=None, perimeter=False,
+                    speed_factor=1, extrude_factor=1, comment=None,
+                    infill_density=1.0, solid_layers=3):
+        """Generates g_code for a cuboid layer by layer (lazy, see print_cuboid).
+        With infill_density < 1 interior layers are printed with sparse infill
+        (trace_spacing / infill_density), the first and last solid_layers stay solid.
+        Infill lines of sparse layers are centered on the surface, so they are aligned
+        in all sparse layers of the same infill angle.
+
+        Args:
+            surface (list): list specifing surface vertices (bottom left, top right)
+            z_start (float): start z height (nozzle location) in mm.
+            height (float): height of cuboid in mm.
+            skirts (list, optional): list of lists for skirts to be printed with cuboid. Defaults to None.
+            perimeter (bool, optional): Defaults to False.
+            speed_factor (int, optional): Defaults to 1.
+            extrude_factor (int, optional): Defaults to 1.
+            heading (string, optional): Defaults to None.
+            infill_density (float, optional): infill density (0 - 1] of interior layers. Defaults to 1.0.
+            solid_layers (int, optional): number of solid bottom and top layers. Defaults to 3.
+            
+        Yields:
+            z (float): layer height rounded to 0.01 mm
+            g_code (string): g_code of the layer
         """
         if comment == None:
             comment = 'unnamed cuboid'
+        if not 0 < infill_density <= 1:
+            raise Exception(f'{infill_density} is not a valid infill density (0 - 1].')
             
         num_of_layers = round(height / self.layer_height)
         start_positions = [['x0', 'y0'], ['x1', 'y1']]
-        
-        g_code_dict = {} # empty dict for g_code strings for each layer
+        sparse_spacing = self.trace_spacing / infill_density
         
         for i in range(num_of_layers): # iteration over layers
             z = z_start + i * self.layer_height # current layer height
             
+            # interior layers with sparse infill
+            if infill_density < 1 and solid_layers <= i < num_of_layers - solid_layers:
+                infill_spacing = sparse_spacing
+            else:
+                infill_spacing = None
+            
             g_code = ''
             if i == 0: # first layer - printed slower and thicker (higher extrude rate)
                 if skirts != None: # printing skirts
@@ -634,7 +1319,8 @@ class G_code_generator:
                                              perimeter=perimeter, 
                                              speed_factor=speed_factor*0.7, 
                                              extrude_factor=extrude_factor*1.05, 
-                                             comment=comment)
+                                             comment=comment,
+                                             infill_spacing=infill_spacing)
                  
             else: # other layers
                 if skirts != None: # printing skirts
@@ -651,13 +1337,56 @@ class G_code_generator:
                                              infill_angle, 
                                              start=start_pos, 
                                              perimeter=perimeter, 
-                                             comment=comment)
+                                             comment=comment,
+                                             infill_spacing=infill_spacing)
             
-            g_code_dict[round(z, 2)] = g_code
-            
-        z_last = round(z, 2)
-        
-        return g_code_dict, z_last
+            yield round(z, 2), g_code
+
+
+    def print_pressure_advance_pattern(self, k_values, tool_num, origin=(20, 20), row_pitch=5,
+                                       slow_length=20, fast_length=40, slow_factor=0.25,
+                                       fast_factor=1.0, z=None):
+        """Generates a pressure advance (K-factor) calibration pattern on a single plate.
+        Each row is a slow - fast - slow line printed with its own K value (M572 before the row),
+        the best K gives uniform line width at the speed changes. Pressure advance of the
+        material (0 if not defined) is restored after the pattern.
+
+        Args:
+            k_values (array): K values in sec, one row each
+            tool_num (int): tool (extruder drive) number for M572 D
+            origin (tuple, optional): start of the first row [x, y] in mm. Defaults to (20, 20).
+            row_pitch (float, optional): distance of rows in y in mm. Defaults to 5.
+            slow_length (float, optional): length of slow segments in mm. Defaults to 20.
+            fast_length (float, optional): length of the fast segment in mm. Defaults to 40.
+            slow_factor (float, optional): speed factor of slow segments. Defaults to 0.25.
+            fast_factor (float, optional): speed factor of the fast segment. Defaults to 1.0.
+            z (float, optional): print height in mm. Defaults to layer height.
+
+        Returns:
+            layers (dict): {z: g_code} (see print_cuboid)
+            rows (list): list of dicts with keys 'k', 'y' (row position for reading the result)
+        """
+        if z is None:
+            z = self.layer_height
+        x0, y0 = origin
+        xs = x0 + np.cumsum([0, slow_length, fast_length, slow_length])
+        speed_factor = np.array([slow_factor, fast_factor, slow_factor])
+
+        g_code = ''
+        rows = []
+        for i, k in enumerate(k_values):
+            y = y0 + i * row_pitch
+            points = np.column_stack([xs, np.full(len(xs), y)])
+            lines = np.stack([points[:-1], points[1:]], axis=1)
+            k = round(float(k), 4)
+            g_code += f'M572 D{tool_num} S{k:.4f} ; set pressure advance\n'
+            g_code += self.print_connected_lines(lines, z, speed_factor=speed_factor,
+                                                 comment=f'pressure advance K={k:.4f}')
+            rows.append({'k': k, 'y': float(y)})
+        k = self.pressure_advance if self.pressure_advance is not None else 0
+        g_code += f'M572 D{tool_num} S{k:.4f} ; set pressure advance\n'
+
+        return {round(z, 2): g_code}, rows
     
        
     def calc_line_length(self, point0, point1):
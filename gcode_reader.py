@@ -0,0 +1,292 @@
+import os
+import re
+import mmap
+import numpy as np
+from gcode_functions import process_g_code_lines
+
+_Z_WORD = re.compile(rb'Z(-?\d*\.?\d+)')
+_E_WORD = re.compile(rb'^G1 [^;\n]*?E(-?\d*\.?\d+)', re.MULTILINE)
+
+
+class G_code_reader:
+    """
+    Memory-mapped reader of a g_code file with a layer index for random access analytics.
+    The index (layer z and byte ranges, tool changes, section comments) is built once
+    and saved next to the file (filepath + '.idx.npz'), queries only read the byte
+    ranges of the requested layers.
+
+    Layers are separated at the print heights of generated g_code (local minima of Z words,
+    relative moves between G91 and G90 are skipped). Tool changes and travels before the first
+    path of a layer belong to that layer.
+    """
+
+    def __init__(self, filepath, index_filepath=None, rebuild=False,
+                 tool_unload_time=3, tool_load_time=20):
+        """
+        Params:
+        filepath            ... path to g_code file
+        index_filepath      ... path to index file, defaults to filepath + '.idx.npz'
+        rebuild             ... bool: rebuilds index even if a valid index exists
+        tool_unload_time    ... time for tool unload in sec (see process_g_code)
+        tool_load_time      ... time for tool load in sec (see process_g_code)
+        """
+        self.filepath = filepath
+        self.index_filepath = index_filepath if index_filepath is not None else filepath + '.idx.npz'
+        self.tool_unload_time = tool_unload_time
+        self.tool_load_time = tool_load_time
+
+        self.file = open(filepath, 'rb')
+        stat = os.stat(filepath)
+        if stat.st_size > 0:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else: # empty files can not be mapped
+            self.mm = b''
+
+        self.file_id = np.array([stat.st_size, stat.st_mtime_ns])
+
+        self.index = None
+        if not rebuild and os.path.exists(self.index_filepath):
+            index = dict(np.load(self.index_filepath))
+            if np.array_equal(index['file_id'], self.file_id): # index matches the file
+                self.index = index
+        if self.index is None:
+            self.index = self.build_index()
+            np.savez(self.index_filepath, **self.index)
+
+        self._layer_stats = {} # cache of layer statistics
+
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def build_index(self):
+        """Builds the index of the file (single pass, vectorized over bytes).
+
+        Returns:
+            index (dict): numpy arrays 'file_id', 'layer_z', 'layer_start', 'layer_end',
+                          'tool_offset', 'tool_name', 'section_name', 'section_start',
+                          'section_end'
+        """
+        buf = np.frombuffer(self.mm, dtype=np.uint8)
+        size = len(buf)
+
+        # line boundaries
+        newlines = np.flatnonzero(buf == ord('\n'))
+        line_starts = np.concatenate([[0], newlines + 1])
+        line_ends = np.concatenate([newlines, [size]])
+        if line_starts[-1] >= size: # file ends with \n
+            line_starts = line_starts[:-1]
+            line_ends = line_ends[:-1]
+        first_bytes = buf[np.minimum(line_starts, size - 1)]
+
+        # code part of lines (before comment)
+        semicolons = np.flatnonzero(buf == ord(';'))
+        semicolon_lines = np.searchsorted(line_ends, semicolons)
+        code_ends = line_ends.copy()
+        lines_with_comment, first_semicolon = np.unique(semicolon_lines, return_index=True)
+        code_ends[lines_with_comment] = semicolons[first_semicolon]
+
+        # Z words of G0/G1 lines
+        is_move = (first_bytes == ord('G')) \
+            & np.isin(buf[np.minimum(line_starts + 1, size - 1)], [ord('0'), ord('1')]) \
+            & (buf[np.minimum(line_starts + 2, size - 1)] == ord(' '))
+        z_positions = np.flatnonzero(buf == ord('Z'))
+        z_positions = z_positions[buf[z_positions - 1] == ord(' ')]
+        z_lines = np.searchsorted(line_ends, z_positions)
+        valid = is_move[z_lines] & (z_positions < code_ends[z_lines])
+
+        # positioning mode of Z words - relative moves (G91) are not print heights
+        is_mode = (first_bytes == ord('G')) \
+            & (buf[np.minimum(line_starts + 1, size - 1)] == ord('9')) \
+            & np.isin(buf[np.minimum(line_starts + 2, size - 1)], [ord('0'), ord('1')]) \
+            & ((line_ends - line_starts == 3)
+               | ~np.isin(buf[np.minimum(line_starts + 3, size - 1)], np.arange(ord('0'), ord('9') + 1)))
+        mode_lines = np.flatnonzero(is_mode)
+        if len(mode_lines) > 0:
+            mode_relative = buf[line_starts[mode_lines] + 2] == ord('1')
+            mode = np.searchsorted(mode_lines, z_lines, side='right') - 1
+            valid &= ~((mode >= 0) & mode_relative[np.maximum(mode, 0)])
+        z_positions = z_positions[valid]
+        z_lines = z_lines[valid]
+        z_values = np.array([float(_Z_WORD.match(self.mm, p).group(1)) for p in z_positions])
+
+        # print heights - local minima of z words
+        if len(z_values) > 0:
+            prev = np.concatenate([[np.inf], z_values[:-1]])
+            nxt = np.concatenate([z_values[1:], [np.inf]])
+            is_min = (z_values <= prev) & (z_values <= nxt)
+            min_index = np.flatnonzero(is_min)
+            min_z = z_values[min_index]
+            new_layer = np.concatenate([[True], np.round(min_z[1:], 5) != np.round(min_z[:-1], 5)])
+            first_min = min_index[new_layer]
+            layer_z = min_z[new_layer]
+            # layer starts after the last z word of the previous path (lift)
+            before = np.where(is_min[np.maximum(first_min - 1, 0)], first_min - 1, first_min - 2)
+            layer_start = np.where(before >= 0, line_ends[z_lines[np.maximum(before, 0)]] + 1, 0)
+            layer_start[0] = 0
+            layer_end = np.concatenate([layer_start[1:], [size]])
+        else:
+            layer_z = np.zeros(0)
+            layer_start = np.zeros(0, dtype=int)
+            layer_end = np.zeros(0, dtype=int)
+
+        # tool changes (T lines)
+        tool_lines = np.flatnonzero(first_bytes == ord('T'))
+        tool_names = [bytes(self.mm[line_starts[i]:code_ends[i]]).split()[0].decode() for i in tool_lines]
+
+        # sections ('; name - start' ... '; name - end')
+        section_name = []
+        section_start = []
+        section_end = []
+        open_sections = {}
+        for i in np.flatnonzero(first_bytes == ord(';')):
+            line = bytes(self.mm[line_starts[i]:line_ends[i]]).decode().strip()
+            if line.endswith(' - start'):
+                name = line[1:-len(' - start')].strip()
+                open_sections.setdefault(name, []).append(len(section_name))
+                section_name.append(name)
+                section_start.append(line_starts[i])
+                section_end.append(size)
+            elif line.endswith(' - end'):
+                name = line[1:-len(' - end')].strip()
+                # tool load/unload end comments have shorter names than start comments
+                for key in reversed(list(open_sections.keys())):
+                    if (key == name or key.startswith(name + ' :')) and open_sections[key]:
+                        section_end[open_sections[key].pop()] = line_ends[i] + 1
+                        break
+
+        index = {
+            'file_id': self.file_id,
+            'layer_z': np.asarray(layer_z, dtype=float),
+            'layer_start': np.asarray(layer_start, dtype=np.int64),
+            'layer_end': np.asarray(layer_end, dtype=np.int64),
+            'tool_offset': np.asarray(line_starts[tool_lines], dtype=np.int64),
+            'tool_name': np.asarray(tool_names, dtype=str),
+            'section_name': np.asarray(section_name, dtype=str),
+            'section_start': np.asarray(section_start, dtype=np.int64),
+            'section_end': np.minimum(np.asarray(section_end, dtype=np.int64), size),
+        }
+        return index
+
+
+    @property
+    def layers_z(self):
+        return self.index['layer_z']
+
+
+    def get_layer(self, z):
+        """Returns index of the layer at z height (nearest)."""
+        return int(np.argmin(np.abs(self.index['layer_z'] - z)))
+
+
+    def read_bytes(self, start, end):
+        """Returns g_code between byte offsets as string."""
+        return self.mm[int(start):int(end)].decode()
+
+
+    def read_layer(self, layer):
+        """Returns g_code of the layer (layer index) as string."""
+        return self.read_bytes(self.index['layer_start'][layer], self.index['layer_end'][layer])
+
+
+    def get_tool_at(self, offset):
+        """Returns tool active at the byte offset (None if no tool is loaded)."""
+        i = np.searchsorted(self.index['tool_offset'], offset, side='right') - 1
+        if i < 0 or self.index['tool_name'][i] == 'T-1':
+            return None
+        return str(self.index['tool_name'][i])
+
+
+    def range_extrusions(self, start, end):
+        """Returns extruded filament length in mm for each tool between byte offsets
+        (only G1 E words are read, no time estimation).
+
+        Returns:
+            dict: {tool: extrusion in mm}
+        """
+        offsets = self.index['tool_offset']
+        inside = (offsets > start) & (offsets < end)
+        bounds = np.concatenate([[start], offsets[inside], [end]])
+        extrusions = {}
+        for b0, b1 in zip(bounds[:-1], bounds[1:]):
+            tool = self.get_tool_at(b0)
+            e = sum(float(v) for v in _E_WORD.findall(self.mm[int(b0):int(b1)]))
+            if e != 0:
+                extrusions[tool] = extrusions.get(tool, 0) + e
+        return extrusions
+
+
+    def layer_stats(self, layer):
+        """Returns statistics of a layer (cached).
+
+        Returns:
+            dict: process_g_code keys and 'z', 'extrusions_mm_per_tool'
+        """
+        if layer not in self._layer_stats:
+            start = self.index['layer_start'][layer]
+            end = self.index['layer_end'][layer]
+            stats = process_g_code_lines(self.read_bytes(start, end).split('\n'),
+                                         tool_unload_time=self.tool_unload_time,
+                                         tool_load_time=self.tool_load_time,
+                                         from_first_point=True)
+            stats['z'] = float(self.index['layer_z'][layer])
+            stats['extrusions_mm_per_tool'] = self.range_extrusions(start, end)
+            self._layer_stats[layer] = stats
+        return self._layer_stats[layer]
+
+
+    def range_stats(self, layer_first, layer_last):
+        """Returns summed statistics of layers from layer_first to layer_last (included).
+
+        Returns:
+            dict: 'print_time_sec', 'all_extrusions_mm', 'extrusions_mm_per_tool', 'layers'
+        """
+        result = {
+            'print_time_sec': 0,
+            'all_extrusions_mm': 0,
+            'extrusions_mm_per_tool': {},
+            'layers': layer_last - layer_first + 1,
+        }
+        for layer in range(layer_first, layer_last + 1):
+            stats = self.layer_stats(layer)
+            result['print_time_sec'] += stats['print_time_sec']
+            result['all_extrusions_mm'] += stats['all_extrusions_mm']
+            for tool, e in stats['extrusions_mm_per_tool'].items():
+                per_tool = result['extrusions_mm_per_tool']
+                per_tool[tool] = per_tool.get(tool, 0) + e
+        return result
+
+
+    def get_sections(self, name=None):
+        """Returns sections of the file as list of (name, start, end) byte ranges.
+
+        Params:
+        name    ... only sections with name containing this string (e.g. 'Tool change')
+        """
+        sections = []
+        for n, s, e in zip(self.index['section_name'], self.index['section_start'], self.index['section_end']):
+            if name is None or name in n:
+                sections.append((str(n), int(s), int(e)))
+        return sections
+
+
+    def section_stats(self, name):
+        """Returns statistics of all sections with name containing the string."""
+        lines = []
+        for _, start, end in self.get_sections(name):
+            lines += self.read_bytes(start, end).split('\n')
+        return process_g_code_lines(lines,
+                                    tool_unload_time=self.tool_unload_time,
+                                    tool_load_time=self.tool_load_time,
+                                    from_first_point=True)
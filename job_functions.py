@@ -0,0 +1,946 @@
+import contextlib
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from gcode_generator import generator_multi
+from gcode_functions import process_g_code_lines
+from tool_changer_functions import (
+    printer_start,
+    load_tool,
+    unload_tool,
+    tool_change,
+    take_photo,
+    printer_stop,
+    set_pressure_advance,
+    set_firmware_retraction,
+    get_mesh_bed)
+
+_FIRMWARE_RETRACTION = re.compile(r'^G1[01] *(;|$)', re.MULTILINE) # G10/G11 without params
+_MOVE_Z = re.compile(r'^(G[01] [^;\n]*?Z)(-?\d*\.?\d+)', re.MULTILINE)
+
+
+def get_generators_dict(generators):
+    """Returns dict of G_code_generator objects for each material.
+
+    Args:
+        generators (dict or generator_multi): G_code_generator for each material
+
+    Returns:
+        dict: keys = materials, values = G_code_generator
+    """
+    if isinstance(generators, generator_multi):
+        generators = dict(generators.__dict__)
+    return generators
+
+
+def get_exact_key(value):
+    """Returns hashable key with exact values of region specs (numpy arrays as bytes,
+    repr of large arrays is abbreviated)."""
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.shape, value.dtype.str, value.tobytes())
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((k, get_exact_key(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(get_exact_key(v) for v in value))
+    return value
+
+
+def iter_layers(regions, generators, z_decimals=2, cache=None):
+    """Generates g_code for all regions layer by layer (lazy, see generate_layers).
+    Only region params are sorted upfront, g_code of a layer is generated when requested.
+
+    Yields:
+        z (float): layer height
+        layer (dict): {material: g_code}
+    """
+    generators = get_generators_dict(generators)
+    if cache is not None: # g_code of regions depends on the compiled profile of the generator
+        profile_keys = {material: get_exact_key(dict(gen.profile.printing_params))
+                        for material, gen in generators.items()}
+
+    # regions grouped by z (in order of definition)
+    regions_by_z = {}
+    for reg_specs in regions.values():
+        z = round(generators[reg_specs['material']].region_z(reg_specs), z_decimals)
+        regions_by_z.setdefault(z, []).append(reg_specs)
+
+    for z in sorted(regions_by_z.keys()):
+        layer = {}
+        for reg_specs in regions_by_z[z]:
+            material = reg_specs['material']
+            gen = generators[material]
+
+            if cache is None:
+                region_g_code = gen.print_region(reg_specs)
+            else:
+                key = (material, profile_keys[material], get_exact_key(reg_specs))
+                if key not in cache:
+                    cache[key] = gen.print_region(reg_specs)
+                region_g_code = cache[key]
+
+            g_code = f'; print region - {reg_specs["heading"]} - start\n'
+            g_code += region_g_code
+            g_code += f'; print region - {reg_specs["heading"]} - end\n\n'
+
+            layer[material] = layer.get(material, '') + g_code
+        yield z, layer
+
+
+def generate_layers(regions, generators, z_decimals=2, cache=None):
+    """Generates g_code for all regions and groups it by z height and material.
+    Regions of the same layer and material are kept in order of definition.
+
+    Args:
+        regions (dict): dict of regions with region specs (see Regions.add_region)
+        generators (dict or generator_multi): G_code_generator for each material,
+                                              keys must match region 'material'
+        z_decimals (int, optional): rounding of z keys. Defaults to 2 (as in print_cuboid).
+        cache (dict, optional): g_code of regions reused between calls, e.g. across jobs,
+                                keyed by region specs and printing params of the generator.
+                                Defaults to None (no cache).
+
+    Returns:
+        layers (dict): {z: {material: g_code}} sorted by z
+    """
+    return dict(iter_layers(regions, generators, z_decimals=z_decimals, cache=cache))
+
+
+def _render_job(regions, generators, z_decimals):
+    """Generates layers of one job in new path contexts of the generators."""
+    with contextlib.ExitStack() as stack:
+        for gen in get_generators_dict(generators).values():
+            stack.enter_context(gen.stream())
+        return generate_layers(regions, generators, z_decimals=z_decimals)
+
+
+def render_jobs(jobs, generators, max_workers=None, z_decimals=2):
+    """Generates layers of several jobs concurrently in a thread pool with shared generators
+    (each job is rendered in its own path context, see G_code_generator.stream).
+
+    Args:
+        jobs (dict): {job name: regions} (see generate_layers)
+        generators (dict or generator_multi): G_code_generator for each material
+        max_workers (int, optional): number of threads. Defaults to None (ThreadPoolExecutor default).
+        z_decimals (int, optional): rounding of z keys. Defaults to 2.
+
+    Returns:
+        dict: {job name: layers} (see generate_layers)
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_render_job, regions, generators, z_decimals)
+                   for name, regions in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def merge_layers(*layers_dicts):
+    """Merges layer dicts ({z: {material: g_code}}) by z height.
+    G_code of the same z and material is concatenated in order of input.
+
+    Returns:
+        layers (dict): {z: {material: g_code}} sorted by z
+    """
+    merged = {}
+    for layers in layers_dicts:
+        for z, layer in layers.items():
+            merged_layer = merged.setdefault(z, {})
+            for material, g_code in layer.items():
+                merged_layer[material] = merged_layer.get(material, '') + g_code
+    return dict(sorted(merged.items()))
+
+
+def order_layer_materials(layer, current_material):
+    """Returns materials of a layer with the currently loaded material first
+    (saves one tool change per layer).
+
+    Args:
+        layer (dict): {material: g_code}
+        current_material (string): currently loaded material or None
+
+    Returns:
+        list: materials in printing order
+    """
+    materials = list(layer.keys())
+    if current_material in materials:
+        materials.remove(current_material)
+        materials.insert(0, current_material)
+    return materials
+
+
+def get_job_printing_params(printing_params):
+    """Returns printing params of materials.
+
+    Args:
+        printing_params (dict or generator_multi): {material: printing params, Material_profile
+                                                   or G_code_generator} or generator_multi
+
+    Returns:
+        dict: {material: printing params}
+    """
+    if isinstance(printing_params, generator_multi):
+        printing_params = printing_params.__dict__
+    return {mat: getattr(params, 'printing_params', params) for mat, params in printing_params.items()}
+
+
+def get_job_printer_settings(printer_settings, printing_params=None):
+    """Returns printer settings with tool settings of materials from their printing params
+    (pressure advance and firmware retraction, see set_pressure_advance and
+    set_firmware_retraction).
+
+    Args:
+        printer_settings (dict): printer settings
+        printing_params (dict or generator_multi, optional): see get_job_printing_params.
+                                                             Defaults to None (printer settings).
+    """
+    if printing_params is None:
+        return printer_settings
+    printing_params = get_job_printing_params(printing_params)
+    printer_settings = set_pressure_advance(printer_settings, printing_params)
+    return set_firmware_retraction(printer_settings, printing_params)
+
+
+def iter_job_chunks(layers, printer_settings, tool_fans=None, beep=True,
+                    start=True, stop=True, printing_params=None):
+    """Assembles a complete print job chunk by chunk with chunk types (see iter_job).
+
+    Yields:
+        kind (string): 'start', 'load', 'change', 'layer', 'unload' or 'stop'
+        z (float): layer height of the chunk (None for start, unload and stop)
+        material (string): material of the chunk (None for start and stop)
+        previous_material (string): material loaded before the chunk
+        g_code (string): g_code of the chunk
+    """
+    printer_settings = get_job_printer_settings(printer_settings, printing_params)
+    if start:
+        start_function = start if callable(start) else printer_start
+        yield 'start', None, None, None, start_function(printer_settings)
+
+    if isinstance(layers, dict):
+        layers = sorted(layers.items())
+
+    current_material = None
+    for z, layer in layers:
+        for material in order_layer_materials(layer, current_material):
+            if current_material is None:
+                yield 'load', z, material, None, load_tool(material, printer_settings, tool_fans=tool_fans)
+            elif material != current_material:
+                yield 'change', z, material, current_material, \
+                    tool_change(current_material, material, printer_settings,
+                                tool_fans=tool_fans, beep=beep)
+            current_material = material
+            if material not in printer_settings.get('firmware_retraction', {}) \
+                    and _FIRMWARE_RETRACTION.search(layer[material]):
+                raise Exception(f'Layer g_code of {material} uses firmware retraction (G10/G11), '
+                                'but its retraction params are not defined - pass printing_params '
+                                'to job assembly (see get_job_printer_settings).')
+            yield 'layer', z, material, material, layer[material]
+
+    if current_material is not None:
+        yield 'unload', None, current_material, current_material, \
+            unload_tool(current_material, printer_settings, tool_fans=tool_fans)
+    if stop:
+        yield 'stop', None, None, current_material, printer_stop()
+
+
+def iter_job(layers, printer_settings, tool_fans=None, beep=True,
+             start=True, stop=True, printing_params=None):
+    """Assembles a complete print job chunk by chunk (lazy, see assemble_job).
+    Layers can be an iterator (e.g. iter_layers or iter_cuboid), so the job can be
+    written or sent while it is generated.
+
+    Yields:
+        g_code (string): printer start, tool load/change/unload, layer g_code
+                         and printer stop chunks
+    """
+    for _, _, _, _, g_code in iter_job_chunks(layers, printer_settings, tool_fans=tool_fans,
+                                              beep=beep, start=start, stop=stop,
+                                              printing_params=printing_params):
+        yield g_code
+
+
+def assemble_job(layers, printer_settings, tool_fans=None, beep=True,
+                 start=True, stop=True, printing_params=None):
+    """Assembles a complete print job from layers: printer start,
+    tool loads/changes, layers in z order, tool unload and printer stop.
+
+    Args:
+        layers (dict or list): {z: {material: g_code}} (see generate_layers) printed in z order
+                               or list of (z, {material: g_code}) printed in list order
+        printer_settings (dict): printer settings (tools, temps, cooling, prime_macro, mesh_bed)
+        tool_fans (dict, optional): cooling fan pin for each tool. Defaults to None.
+        beep (bool, optional): beep at tool changes. Defaults to True.
+        start (bool or function, optional): include printer start g_code, or function generating
+                                            it from printer_settings (e.g. printer_start_overlapped).
+                                            Defaults to True (printer_start).
+        stop (bool, optional): include printer stop g_code. Defaults to True.
+        printing_params (dict or generator_multi, optional): printing params of materials for
+                                                             tool settings at tool loads/changes
+                                                             (see get_job_printer_settings).
+                                                             Defaults to None.
+
+    Returns:
+        g_code (string): g_code of the job
+    """
+    return ''.join(iter_job(layers, printer_settings, tool_fans=tool_fans, beep=beep,
+                            start=start, stop=stop, printing_params=printing_params))
+
+
+def cuboid_layers(layers, material):
+    """Converts (z, g_code) pairs of one material (print_cuboid, iter_cuboid)
+    to (z, {material: g_code}) pairs for iter_job (lazy).
+    """
+    for z, g_code in layers:
+        yield z, {material: g_code}
+
+
+def write_g_code(chunks, filepath, compression=None, tee_filepath=None, **writer_kwargs):
+    """Writes g_code chunks to a file as they are generated.
+    Compressed files (and the optional uncompressed tee) are written by G_code_writer
+    in a background thread while the next chunks are generated.
+
+    Args:
+        chunks (iterable): g_code strings (e.g. iter_job)
+        filepath (string): path to g_code file
+        compression (string, optional): see G_code_writer. Defaults to None (by file extension).
+        tee_filepath (string, optional): path to uncompressed copy. Defaults to None.
+        writer_kwargs: buffer_size, queue_size, level (see G_code_writer)
+
+    Returns:
+        int: number of written characters
+    """
+    if compression is None and tee_filepath is None and get_compression(filepath) is None:
+        n = 0
+        with open(filepath, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                n += len(chunk)
+        return n
+
+    with G_code_writer(filepath, compression=compression, tee_filepath=tee_filepath,
+                       **writer_kwargs) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.n_chars
+
+
+def _import_zstd():
+    """Returns zstandard module or None if it is not installed."""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def get_compression(filepath):
+    """Returns compression by file extension: 'gzip' (.gz), 'zstd' (.zst) or None."""
+    if filepath.endswith('.gz'):
+        return 'gzip'
+    if filepath.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def resolve_compression(filepath, compression=None):
+    """Returns output filepath and compression ('none', 'gzip' or 'zstd').
+
+    Args:
+        filepath (string): path to output file
+        compression (string, optional): None (by file extension), 'none', 'gzip', 'zstd'
+                                        or 'auto' (zstd if zstandard is installed, else gzip).
+                                        Extension (.gz, .zst) is appended to filepath if missing.
+                                        Defaults to None.
+    """
+    if compression is None:
+        compression = get_compression(filepath) or 'none'
+    if compression == 'auto':
+        compression = 'zstd' if _import_zstd() is not None else 'gzip'
+    if compression not in ['none', 'gzip', 'zstd']:
+        raise Exception(f'Unknown compression "{compression}".')
+    extension = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}[compression]
+    if not filepath.endswith(extension):
+        filepath += extension
+    return filepath, compression
+
+
+class G_code_writer:
+    """
+    Background writer of g_code chunks with double buffering. Chunks are collected into
+    a buffer in the generating thread, full buffers are passed over a bounded queue to
+    a writer thread which compresses and writes them (zlib and zstd release the GIL, so
+    compression overlaps with generation of the next layers). write blocks when the queue
+    is full - at most (queue_size + 2) * buffer_size of g_code is held in memory.
+
+        with G_code_writer('job.gcode.gz', tee_filepath='job.gcode') as writer:
+            for chunk in iter_job(layers, printer_settings):
+                writer.write(chunk)
+
+    Errors of the writer thread are raised in write or close.
+    """
+
+    def __init__(self, filepath, compression=None, tee_filepath=None, buffer_size=2**18,
+                 queue_size=2, level=None):
+        """
+        Params:
+        filepath        ... path to output file
+        compression     ... None (by file extension), 'none', 'gzip', 'zstd' or 'auto'
+                            (see resolve_compression)
+        tee_filepath    ... optional path to uncompressed copy
+        buffer_size     ... size of buffers passed to the writer thread in characters
+        queue_size      ... number of full buffers waiting for the writer thread
+        level           ... compression level, defaults to 6 (gzip) and 3 (zstd)
+        """
+        filepath, compression = resolve_compression(filepath, compression)
+        self.filepath = filepath
+        self.compression = compression
+        self.tee_filepath = tee_filepath
+        self.buffer_size = buffer_size
+        self.n_chars = 0 # written characters (uncompressed)
+        self.n_bytes = 0 # written bytes (uncompressed)
+
+        self._buffer = []
+        self._buffered = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._files = self._open_files(level)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def _open_files(self, level):
+        """Returns list of (write function, file objects to close in order)."""
+        files = []
+        if self.compression == 'gzip':
+            f = gzip.open(self.filepath, 'wb', compresslevel=6 if level is None else level)
+            files.append((f.write, [f]))
+        elif self.compression == 'zstd':
+            zstandard = _import_zstd()
+            if zstandard is None:
+                raise Exception('zstd compression requires zstandard package.')
+            raw = open(self.filepath, 'wb')
+            f = zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(raw)
+            files.append((f.write, [f, raw]))
+        else:
+            f = open(self.filepath, 'wb')
+            files.append((f.write, [f]))
+        if self.tee_filepath is not None:
+            f = open(self.tee_filepath, 'wb')
+            files.append((f.write, [f]))
+        return files
+
+
+    def _run(self):
+        """Writer thread - writes buffers until None is received."""
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is not None: # buffers are drained after an error
+                continue
+            try:
+                for write, _ in self._files:
+                    write(data)
+            except Exception as error:
+                self._error = error
+
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+    def write(self, chunk):
+        """Adds g_code chunk (string), full buffer is passed to the writer thread."""
+        self._raise_error()
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        self.n_chars += len(chunk)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+
+    def flush(self):
+        """Passes the buffer to the writer thread (blocks while the queue is full)."""
+        if self._buffer:
+            data = ''.join(self._buffer).encode()
+            self.n_bytes += len(data)
+            self._buffer = []
+            self._buffered = 0
+            self._queue.put(data)
+
+
+    def close(self):
+        """Writes remaining g_code, waits for the writer thread and closes files."""
+        if self._thread is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            for _, files in self._files:
+                for f in files:
+                    f.close()
+        self._raise_error()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def preheat_job(layers, printer_settings, preheat_time=30, heating_rate=2.0,
+                deep_standby_time=300, deep_standby_drop=50,
+                tool_fans=None, beep=True, start=True, stop=True,
+                tool_unload_time=3, tool_load_time=20, printing_params=None):
+    """Assembles a complete print job (see assemble_job) with predictive tool pre-heating.
+    Parked tools wait at their standby temp and tool_change waits (M116) until the next tool
+    reaches its active temp. The standby temp of the next tool is raised to its active temp
+    (G10 R) preheat_time before each tool change (estimated from the g_code of preceding
+    chunks - heating starts at the nearest chunk boundary before), and restored after the change.
+    Tools idle for longer than deep_standby_time are dropped to a deeper standby
+    (standby - deep_standby_drop) while parked and pre-heated earlier accordingly.
+
+    Args:
+        layers (dict or list): see assemble_job
+        printer_settings (dict): printer settings (tools, temps: {material: [active, standby]}, ...)
+        preheat_time (float, optional): heat-up lead before a tool change in sec. Defaults to 30.
+        heating_rate (float, optional): heating rate of tools in deg C/sec. Defaults to 2.0.
+        deep_standby_time (float, optional): min idle time for deep standby in sec,
+                                             None for no deep standby. Defaults to 300.
+        deep_standby_drop (float, optional): deep standby temp below standby temp. Defaults to 50.
+        tool_fans, beep, start, stop, printing_params: see assemble_job
+        tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
+        tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+
+    Returns:
+        g_code (string): g_code of the job
+        report (dict): includes keys:
+                            'tool_changes'
+                            'deep_standbys'
+                            'wait_before_sec' (estimated M116 wait at tool changes without pre-heating)
+                            'wait_after_sec' (estimated M116 wait with pre-heating)
+                            'wait_removed_sec'
+    """
+    chunks = list(iter_job_chunks(layers, printer_settings, tool_fans=tool_fans,
+                                  beep=beep, start=start, stop=stop,
+                                  printing_params=printing_params))
+    times = np.zeros(len(chunks)) # printer start and stop are not timed
+    for i, (kind, _, _, _, g_code) in enumerate(chunks):
+        if kind not in ('start', 'stop'):
+            times[i] = process_g_code_lines(g_code.split('\n'),
+                                            tool_unload_time=tool_unload_time,
+                                            tool_load_time=tool_load_time,
+                                            from_first_point=True)['print_time_sec']
+    t_start = np.concatenate([[0], np.cumsum(times)[:-1]])
+
+    inserts = {} # {chunk index: g_code inserted before the chunk}
+    parked = {} # {material: index of the chunk after parking}
+    report = {
+        'tool_changes': 0,
+        'deep_standbys': 0,
+        'wait_before_sec': 0,
+        'wait_after_sec': 0,
+    }
+    first = 1 if start else 0
+    for i, (kind, _, material, previous_material, _) in enumerate(chunks):
+        if kind == 'change':
+            parked[previous_material] = i + 1
+        if kind != 'change':
+            continue
+
+        tool_num = int(printer_settings['tools'][material][-1])
+        active, standby = printer_settings['temps'][material]
+        idle_from = parked.get(material, first)
+        idle_time = t_start[i] - t_start[idle_from]
+        deep = deep_standby_time is not None and idle_time > deep_standby_time
+
+        lead = preheat_time
+        heat_from = standby
+        if deep:
+            heat_from = standby - deep_standby_drop
+            lead += deep_standby_drop / heating_rate
+
+        # latest chunk boundary with enough lead (not before parking of the tool)
+        j = i
+        while j > idle_from and t_start[i] - t_start[j] < lead:
+            j -= 1
+        if deep and j == idle_from: # no time for cooling down
+            deep = False
+            heat_from = standby
+        if deep:
+            inserts[idle_from] = inserts.get(idle_from, '') \
+                + f'G10 P{tool_num} R{heat_from} ; deep standby tool {tool_num}\n'
+            report['deep_standbys'] += 1
+        inserts[j] = inserts.get(j, '') \
+            + f'G10 P{tool_num} R{active} ; preheat tool {tool_num}\n'
+        inserts[i + 1] = inserts.get(i + 1, '') \
+            + f'G10 P{tool_num} R{standby} ; restore tool {tool_num} idle temp\n'
+
+        heating_time = (active - heat_from) / heating_rate
+        report['tool_changes'] += 1
+        report['wait_before_sec'] += (active - standby) / heating_rate
+        report['wait_after_sec'] += max(heating_time - float(t_start[i] - t_start[j]), 0)
+
+    g_code = ''
+    for i, (_, _, _, _, chunk) in enumerate(chunks):
+        g_code += inserts.get(i, '') + chunk
+    g_code += inserts.get(len(chunks), '')
+
+    report['wait_before_sec'] = round(report['wait_before_sec'], 2)
+    report['wait_after_sec'] = round(report['wait_after_sec'], 2)
+    report['wait_removed_sec'] = round(report['wait_before_sec'] - report['wait_after_sec'], 2)
+    return g_code, report
+
+
+def photo_job(layers, printer_settings, every_n_layers=1, materials=None,
+              tool_fans=None, beep=True, start=True, stop=True,
+              tool_unload_time=3, tool_load_time=20, printing_params=None):
+    """Assembles a complete print job (see assemble_job) with layer cam photos.
+    Photos are taken while the tool is unloaded at a following tool change (or tool unload
+    at the end of the job), a separate unload - photo - load cycle (take_photo) is used
+    only where the same tool continues printing.
+
+    Args:
+        layers (dict or list): see assemble_job
+        printer_settings (dict): printer settings (see assemble_job)
+        every_n_layers (int, optional): photo after every n-th layer. Defaults to 1.
+        materials (list, optional): photo after each of these materials is printed in a layer,
+                                    None for photos after the whole layer. Defaults to None.
+        tool_fans, beep, start, stop, printing_params: see assemble_job
+        tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
+        tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+
+    Returns:
+        g_code (string): g_code of the job
+        report (dict): includes keys:
+                            'photos'
+                            'photos_at_tool_changes'
+                            'load_unload_cycles_saved' (compared to take_photo for every photo)
+                            'time_saved_sec'
+    """
+    chunks = list(iter_job_chunks(layers, printer_settings, tool_fans=tool_fans,
+                                  beep=beep, start=start, stop=stop,
+                                  printing_params=printing_params))
+
+    layer_index = {}
+    for kind, z, _, _, _ in chunks:
+        if kind == 'layer' and z not in layer_index:
+            layer_index[z] = len(layer_index)
+
+    report = {
+        'photos': 0,
+        'photos_at_tool_changes': 0,
+    }
+    g_code = ''
+    photo_pending = False
+    for i, (kind, z, material, previous_material, chunk) in enumerate(chunks):
+        if photo_pending and kind == 'change': # photo while the tool is unloaded
+            chunk = tool_change(previous_material, material, printer_settings,
+                                tool_fans=tool_fans, beep=beep, photo=True)
+            report['photos_at_tool_changes'] += 1
+        g_code += chunk
+        if photo_pending and kind == 'unload':
+            g_code += take_photo(None, None, printer_settings, tool_fans=tool_fans, beep=beep)
+            report['photos_at_tool_changes'] += 1
+        photo_pending = False
+
+        if kind != 'layer' or layer_index[z] % every_n_layers != every_n_layers - 1:
+            continue
+        if materials is None:
+            next_kind, next_z = chunks[i+1][:2] if i + 1 < len(chunks) else (None, None)
+            layer_done = next_kind not in ('change', 'layer') or next_z != z
+        else:
+            layer_done = material in materials
+        if not layer_done:
+            continue
+        report['photos'] += 1
+        next_kind = chunks[i+1][0] if i + 1 < len(chunks) else None
+        if next_kind in ('change', 'unload'):
+            photo_pending = True
+        else:
+            g_code += take_photo(material, material, printer_settings, tool_fans=tool_fans, beep=beep)
+
+    report['load_unload_cycles_saved'] = report['photos_at_tool_changes']
+    report['time_saved_sec'] = report['photos_at_tool_changes'] * (tool_unload_time + tool_load_time)
+    return g_code, report
+
+
+def get_layers_footprint(layers, n_layers=1):
+    """Returns xy limits of extrusion moves of the first layers of a job.
+
+    Args:
+        layers (dict or list): {z: {material: g_code}} or list of (z, {material: g_code})
+        n_layers (int, optional): number of first layers. Defaults to 1.
+
+    Returns:
+        dict: dict of x_min, x_max, y_min, y_max
+    """
+    from toolpath_functions import parse_moves, get_moves_limits
+
+    if isinstance(layers, dict):
+        layers = sorted(layers.items())
+    first_layers = sorted(layers, key=lambda item: item[0])[:n_layers]
+    g_code = ''.join(g_code for _, layer in first_layers for g_code in layer.values())
+    limits = get_moves_limits(parse_moves(g_code))
+    return {key: float(value) for key, value in limits.items()}
+
+
+def get_adaptive_mesh_bed(layers, printer_settings, spacing=10, margin=5, n_layers=1,
+                          min_points=2, max_points=21, bed_limits=None,
+                          mesh_record=None, max_age_hours=24, probe_point_time=3.0, now=None):
+    """Returns printer settings with a mesh bed (see printer_start) sized to the footprint of
+    the first layers of a job: probed area is the footprint with margin, number of points
+    follows from the spacing.
+    With mesh_record (.json file of probed height maps), a stored height map is loaded
+    instead of probing if a map probed within max_age_hours covers the area with the same
+    or denser spacing. Otherwise the probed map is saved on the printer, it is added to
+    the record only after the probing is confirmed (see confirm_probed) - until then
+    jobs probe the bed again.
+
+    Args:
+        layers (dict or list): {z: {material: g_code}} or list of (z, {material: g_code})
+        printer_settings (dict): printer settings, area of 'mesh_bed' (None - printer_start default)
+                                 or bed_limits is the reference full-bed mesh for the report
+        spacing (float, optional): max distance between probe points in mm. Defaults to 10.
+        margin (float, optional): margin around the footprint in mm. Defaults to 5.
+        n_layers (int, optional): number of first layers for the footprint. Defaults to 1.
+        min_points (int, optional): min points in each direction. Defaults to 2.
+        max_points (int, optional): max points in each direction. Defaults to 21.
+        bed_limits (dict, optional): x_min, x_max, y_min, y_max of the probed area. Defaults to None.
+        mesh_record (string, optional): path to .json record of height maps. Defaults to None.
+        max_age_hours (float, optional): max age of reused height maps. Defaults to 24.
+        probe_point_time (float, optional): time of probing one point in sec. Defaults to 3.0.
+        now (float, optional): current time (time.time()). Defaults to None.
+
+    Returns:
+        printer_settings (dict): copy of printer settings with adaptive 'mesh_bed'
+        report (dict): includes keys:
+                            'probe_points' (0 if a stored map is loaded)
+                            'reference_probe_points' (full-bed mesh with the same spacing)
+                            'probing_time_sec'
+                            'reference_probing_time_sec'
+                            'probing_time_saved_sec'
+                            'reused_height_map' (name of loaded map or None)
+                            'height_map_entry' (record entry of the saved map for confirm_probed
+                                                or None)
+    """
+    if now is None:
+        now = time.time()
+    footprint = get_layers_footprint(layers, n_layers=n_layers)
+    x_mesh = [footprint['x_min'] - margin, footprint['x_max'] + margin]
+    y_mesh = [footprint['y_min'] - margin, footprint['y_max'] + margin]
+    if bed_limits is not None:
+        x_mesh = [max(x_mesh[0], bed_limits['x_min']), min(x_mesh[1], bed_limits['x_max'])]
+        y_mesh = [max(y_mesh[0], bed_limits['y_min']), min(y_mesh[1], bed_limits['y_max'])]
+    x_mesh = [round(x_mesh[0], 1), round(x_mesh[1], 1)]
+    y_mesh = [round(y_mesh[0], 1), round(y_mesh[1], 1)]
+
+    def n_points(length):
+        return int(min(max(np.ceil(length / spacing) + 1, min_points), max_points))
+    p_mesh = [n_points(x_mesh[1] - x_mesh[0]), n_points(y_mesh[1] - y_mesh[0])]
+    mesh_bed = {'X': x_mesh, 'Y': y_mesh, 'P': p_mesh}
+
+    # stored height map covering the area
+    record = []
+    if mesh_record is not None and os.path.exists(mesh_record):
+        with open(mesh_record) as f:
+            record = json.load(f)
+    reused = None
+    for entry in sorted(record, key=lambda entry: -entry['time']):
+        entry_spacing = max((entry['X'][1] - entry['X'][0]) / max(entry['P'][0] - 1, 1),
+                            (entry['Y'][1] - entry['Y'][0]) / max(entry['P'][1] - 1, 1))
+        if now - entry['time'] <= max_age_hours * 3600 \
+                and entry['X'][0] <= x_mesh[0] and entry['X'][1] >= x_mesh[1] \
+                and entry['Y'][0] <= y_mesh[0] and entry['Y'][1] >= y_mesh[1] \
+                and entry_spacing <= spacing + 1e-9:
+            reused = entry
+            break
+
+    entry = None
+    if reused is not None: # mesh of the stored map (M557 must match the loaded map)
+        mesh_bed = {'X': reused['X'], 'Y': reused['Y'], 'P': reused['P'], 'load': reused['filename']}
+        probe_points = 0
+    else:
+        probe_points = p_mesh[0] * p_mesh[1]
+        if mesh_record is not None: # recorded after the probing is confirmed
+            mesh_bed['save'] = f'heightmap_{int(now)}.csv'
+            entry = {'X': x_mesh, 'Y': y_mesh, 'P': p_mesh, 'filename': mesh_bed['save']}
+
+    # full-bed mesh with the same spacing
+    if bed_limits is not None:
+        x_bed = [bed_limits['x_min'], bed_limits['x_max']]
+        y_bed = [bed_limits['y_min'], bed_limits['y_max']]
+    else:
+        bed_mesh = get_mesh_bed(printer_settings)
+        x_bed, y_bed = bed_mesh['X'], bed_mesh['Y']
+    x_bed = [min(x_bed[0], x_mesh[0]), max(x_bed[1], x_mesh[1])]
+    y_bed = [min(y_bed[0], y_mesh[0]), max(y_bed[1], y_mesh[1])]
+    reference_points = n_points(x_bed[1] - x_bed[0]) * n_points(y_bed[1] - y_bed[0])
+
+    printer_settings = dict(printer_settings)
+    printer_settings['mesh_bed'] = mesh_bed
+    report = {
+        'probe_points': probe_points,
+        'reference_probe_points': reference_points,
+        'probing_time_sec': round(probe_points * probe_point_time, 2),
+        'reference_probing_time_sec': round(reference_points * probe_point_time, 2),
+        'probing_time_saved_sec': round((reference_points - probe_points) * probe_point_time, 2),
+        'reused_height_map': None if reused is None else reused['filename'],
+        'height_map_entry': entry,
+    }
+    return printer_settings, report
+
+
+def confirm_probed(mesh_record, entry, probed_time=None):
+    """Adds a probed and saved height map to the record of height maps (see get_adaptive_mesh_bed),
+    to be called when the printer has probed the bed of the job (e.g. after the job is started
+    or reported done by the printer).
+
+    Args:
+        mesh_record (string): path to .json record of height maps
+        entry (dict): report['height_map_entry'] of get_adaptive_mesh_bed
+        probed_time (float, optional): time of probing (time.time()). Defaults to None (now).
+    """
+    record = []
+    if os.path.exists(mesh_record):
+        with open(mesh_record) as f:
+            record = json.load(f)
+    record.append({**entry, 'time': time.time() if probed_time is None else probed_time})
+    with open(mesh_record, 'w') as f:
+        json.dump(record, f, indent=True)
+
+
+def get_layer_macro_body(g_code):
+    """Returns layer g_code with Z words relative to the print height of the layer
+    (lowest Z word) as RRF expressions of macro parameter Z, e.g. Z{param.Z+0.500},
+    and the print height.
+
+    Returns:
+        body (string): g_code of the layer for a macro called with M98 P"file" Z<print height>
+        z (float): print height of the layer (None if the layer has no Z words)
+    """
+    z_words = [float(value) for _, value in _MOVE_Z.findall(g_code)]
+    if not z_words:
+        return g_code, None
+    z = min(z_words)
+
+    def relative_z(match):
+        dz = round(float(match.group(2)) - z, 3)
+        if dz == 0:
+            return match.group(1) + '{param.Z}'
+        return match.group(1) + f'{{param.Z+{dz:.3f}}}'
+
+    return _MOVE_Z.sub(relative_z, g_code), z
+
+
+def macro_job(layers, printer_settings, filepath, tool_fans=None, beep=True,
+              start=True, stop=True, min_repeats=2, macro_dir=None,
+              upload_rate=500e3, upload_file_time=0.5, printing_params=None):
+    """Assembles a print job (see assemble_job) with repeated layer bodies as firmware macros.
+    Layer g_code of a material is made relative to its print height (see get_layer_macro_body),
+    bodies repeated at least min_repeats times (e.g. alternating layers of print_cuboid)
+    are written once as macro files and called from the main g_code:
+        M98 P"0:/gcodes/<name>/<name>_PLA_0.g" Z0.600
+    Other layers stay in the main g_code. Macros use RRF meta commands (param.Z, RRF 3.5+).
+
+    The job is packaged as a directory (filepath without extension) or a zip archive
+    (filepath ending with .zip) with the main g_code <name>.gcode and macro files,
+    to be uploaded to the printer as 0:/gcodes/<name>/ (or macro_dir).
+
+    Args:
+        layers (dict or list): {z: {material: g_code}} or list of (z, {material: g_code})
+        printer_settings (dict): printer settings (see assemble_job)
+        filepath (string): path to job directory or .zip archive
+        tool_fans, beep, start, stop, printing_params: see assemble_job
+        min_repeats (int, optional): min number of layers with the same body for a macro.
+                                     Defaults to 2.
+        macro_dir (string, optional): directory of macros on the printer.
+                                      Defaults to '0:/gcodes/<name>/'.
+        upload_rate (float, optional): upload rate in bytes/s for the report. Defaults to 500e3.
+        upload_file_time (float, optional): overhead of one file upload in sec for the report.
+                                            Defaults to 0.5.
+
+    Returns:
+        report (dict): includes keys 'filepath', 'layers', 'macro_layers', 'macros',
+                       'size_bytes_before', 'size_bytes_after', 'size_reduction',
+                       'upload_time_sec_before', 'upload_time_sec_after'
+    """
+    name = os.path.splitext(os.path.basename(os.path.normpath(filepath)))[0]
+    if macro_dir is None:
+        macro_dir = f'0:/gcodes/{name}/'
+    if isinstance(layers, dict):
+        layers = sorted(layers.items())
+    layers = list(layers)
+
+    # macro bodies of layers
+    bodies = {} # {(material, body): number of layers}
+    layer_bodies = {} # {(layer index, material): (body, z)}
+    for i, (_, layer) in enumerate(layers):
+        for material, g_code in layer.items():
+            body, z = get_layer_macro_body(g_code)
+            if z is not None:
+                layer_bodies[(i, material)] = (body, z)
+                bodies[(material, body)] = bodies.get((material, body), 0) + 1
+
+    macros = {} # {filename: body}
+    macro_names = {} # {(material, body): filename}
+    macro_layers = 0
+    macro_calls = []
+    for i, (z_layer, layer) in enumerate(layers):
+        macro_layer = {}
+        for material, g_code in layer.items():
+            if (i, material) in layer_bodies:
+                body, z = layer_bodies[(i, material)]
+                if bodies[(material, body)] >= min_repeats:
+                    if (material, body) not in macro_names:
+                        filename = f'{name}_{material}_{len(macros)}.g'
+                        macro_names[(material, body)] = filename
+                        macros[filename] = body
+                    g_code = f'M98 P"{macro_dir}{macro_names[(material, body)]}" Z{z:.3f} ; layer macro\n'
+                    macro_layers += 1
+            macro_layer[material] = g_code
+        macro_calls.append((z_layer, macro_layer))
+
+    g_code = assemble_job(macro_calls, printer_settings, tool_fans=tool_fans, beep=beep,
+                          start=start, stop=stop, printing_params=printing_params)
+    size_before = len(assemble_job(layers, printer_settings, tool_fans=tool_fans, beep=beep,
+                                   start=start, stop=stop, printing_params=printing_params).encode())
+    files = {f'{name}.gcode': g_code, **macros}
+
+    # packaging
+    if filepath.endswith('.zip'):
+        with zipfile.ZipFile(filepath, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for filename, content in files.items():
+                archive.writestr(f'{name}/{filename}', content)
+    else:
+        os.makedirs(filepath, exist_ok=True)
+        for filename, content in files.items():
+            with open(os.path.join(filepath, filename), 'w') as f:
+                f.write(content)
+
+    size_after = sum(len(content.encode()) for content in files.values())
+    report = {
+        'filepath': filepath,
+        'layers': len(layers),
+        'macro_layers': macro_layers,
+        'macros': len(macros),
+        'size_bytes_before': size_before,
+        'size_bytes_after': size_after,
+        'size_reduction': round(1 - size_after / size_before, 4),
+        'upload_time_sec_before': round(size_before / upload_rate + upload_file_time, 2),
+        'upload_time_sec_after': round(size_after / upload_rate + len(files) * upload_file_time, 2),
+    }
+    return report
@@ -108,10 +108,16 @@ def plot_defined_regions(fig, ax, regions, layer, trace_width=0.42, colors=None,
             pos (list): 2-list
             dims (list): 2-list
             start_pos (list): 2-list of strings, (x0, y0) or (x1, y0) ...
-            infill_angle (int): 0° or 90°
+            infill_angle (int): 0° or 90° (other angles are plotted from the region center)
         """
         x, y = get_start_position(pos, dims, start_pos)
-        if infill_angle == 0:
+        if infill_angle not in (0, 90):
+            x, y = np.asarray(pos) + np.asarray(dims) / 2
+            a = np.deg2rad(infill_angle)
+            sign = 1 if start_pos[0] == 'x0' else -1
+            dx = sign * 0.25 * np.max(dims) * np.cos(a)
+            dy = sign * 0.25 * np.max(dims) * np.sin(a)
+        elif infill_angle == 0:
             if start_pos[0] == 'x0':
                 dx = 0.5 * dims[0]
             elif start_pos[0] == 'x1':
@@ -161,6 +167,10 @@ def plot_defined_regions(fig, ax, regions, layer, trace_width=0.42, colors=None,
                     plot_surface(pos2, dims2, label=label, color=c, **kwargs)
                 else:
                     plot_surface(pos, dims, label=label, color=c, **kwargs)
+            # plotting polygon
+            elif reg_specs['region_type'] == 'polygon':
+                polygon = Polygon(reg_specs['vertices'], label=label, color=c, **kwargs)
+                ax.add_patch(polygon)
             # plotting perimeter
             elif reg_specs['region_type'] == 'perimeter':
                 plot_perimeter(pos, dims, label=label, color=c, **kwargs)
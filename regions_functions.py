@@ -25,13 +25,13 @@ class Regions():
         z_height : float
             Z height of the region (nozzle position). If z_height==None, the z_height is calculated from the layer number and layer_height from print_params.
         reg_type : str
-            Type of the region. Can be 'infill', 'perimeter'.
+            Type of the region. Can be 'infill', 'perimeter' (for polygons see add_polygon_region).
         mat : str
             Material of the region.
         start_pos : str
             Starting position of the region. Can be ['x0', 'y0'], ['x0', 'y1'], ['x1', 'y0'], ['x1', 'y1'].
         infill_angle : float
-            Angle of the infill. Can be 0, 90.
+            Angle of the infill. Can be 0, 90 (other angles are printed as a polygon).
         perimeter : int
             Number of perimeters.
         overlap_factor : float, optional
@@ -112,3 +112,58 @@ class Regions():
             'extrude_factor':extrude_factor,
             'heading': name
         }
+    
+    def add_polygon_region(self, name, vertices, layer, z_height, mat, infill_angle, perimeter, 
+                           start_pos=['x0', 'y0'], overlap_factor=0.25, speed_factor=1.0, extrude_factor=1.0):
+        """Adds polygon region to the regions dictionary. Position and dimensions 
+        of the region are the bounding box of the vertices.
+
+        Parameters
+        ----------
+        name : str
+            Name of the region.
+        vertices : list
+            Vertices of the polygon [[x, y], ...] relative to ref_pos (not closed).
+        layer : int
+            Layer number of the region.
+        z_height : float
+            Z height of the region (nozzle position). If z_height==None, the z_height is calculated from the layer number and layer_height from print_params.
+        mat : str
+            Material of the region.
+        infill_angle : float
+            Angle of the infill in deg, arbitrary.
+        perimeter : bool
+            Polygon perimeter is printed.
+        start_pos : list, optional
+            Starting position of the infill in coordinates rotated for infill_angle. The default is ['x0', 'y0'].
+        overlap_factor : float, optional
+            Overlap factor of the infill/perimeter. The default is 0.25.
+        speed_factor : float, optional
+            Printing speed factor of the region. The default is 1.0.
+        extrude_factor : float, optional
+            Extrusion factor of the region. The default is 1.0.
+
+        Returns
+        -------
+        None.
+        """
+        vertices = self.ref_pos + np.asarray(vertices, dtype=float)
+        pos = vertices.min(axis=0)
+        dim = vertices.max(axis=0) - pos
+        
+        self.regions[name] = {
+            'position': pos,
+            'dimensions': dim,
+            'vertices': vertices,
+            'layer':layer, 
+            'z_height': z_height,
+            'region_type':'polygon', 
+            'material':mat, 
+            'start_pos':start_pos, 
+            'infill_angle':infill_angle, 
+            'perimeter':perimeter,  
+            'overlap_factor':overlap_factor, 
+            'speed_factor':speed_factor, 
+            'extrude_factor':extrude_factor,
+            'heading': name
+        }
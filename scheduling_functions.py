@@ -0,0 +1,197 @@
+import numpy as np
+from gcode_functions import process_g_code_lines
+from travel_functions import get_line_words
+
+
+def get_object_layers(obj):
+    """Returns layers of an object as {z: {material: g_code}}.
+
+    Args:
+        obj (dict): object with keys 'material' and 'layers' ({z: g_code} from print_cuboid)
+                    or only 'layers' ({z: {material: g_code}} from generate_layers)
+
+    Returns:
+        dict: {z: {material: g_code}}
+    """
+    layers = {}
+    for z, layer in obj['layers'].items():
+        if isinstance(layer, str):
+            layer = {obj['material']: layer}
+        layers[z] = layer
+    return layers
+
+
+def estimate_layer_times(layers):
+    """Estimates print time of each layer of an object (without tool changes).
+
+    Args:
+        layers (dict): {z: {material: g_code}}
+
+    Returns:
+        dict: {z: time in sec}
+    """
+    times = {}
+    for z, layer in layers.items():
+        times[z] = 0
+        for g_code in layer.values():
+            estimate = process_g_code_lines(g_code.split('\n'), from_first_point=True)
+            times[z] += estimate['print_time_sec']
+    return times
+
+
+def _group_time(group, objects_times, objects_materials, z_all,
+                min_layer_time, tool_change_time):
+    """Estimates print time of a group of interleaved objects.
+    Layers faster than min_layer_time are slowed down to min_layer_time.
+    Each additional material in a layer adds a tool change.
+
+    Returns:
+        float: time in sec
+    """
+    times = np.zeros(len(z_all))
+    present = np.zeros(len(z_all), dtype=bool)
+    materials = [set() for _ in z_all]
+    for i in group:
+        times += objects_times[i]
+        present |= objects_times[i] > 0
+        for k in np.nonzero(objects_times[i] > 0)[0]:
+            materials[k] |= objects_materials[i]
+    n_changes = np.array([max(len(m) - 1, 0) for m in materials])
+    times = times + n_changes * tool_change_time
+    return np.sum(np.maximum(times[present], min_layer_time))
+
+
+def get_first_point(g_code):
+    """Returns [x, y] and F of the first G0/G1 move with X and Y words ((None, None) if there is none)."""
+    for line in g_code.split('\n'):
+        if line[:3] in ['G0 ', 'G1 ']:
+            words = get_line_words(line)
+            if 'X' in words and 'Y' in words:
+                return [words['X'], words['Y']], words.get('F')
+    return None, None
+
+
+def schedule_objects(objects, min_layer_time=10, allow_sequential=True,
+                     tool_unload_time=3, tool_load_time=20,
+                     clearance=2.0, clearance_feedrate=600):
+    """Merges layers of several objects (cuboids, regions) into one program.
+    Objects are grouped: objects of a group are interleaved layer by layer (all objects
+    at one z are printed before next z), groups are printed sequentially one after another.
+    Groups are formed by merging objects while the estimated print time decreases, i.e.
+    objects are interleaved only where the summed layer time helps to reach min_layer_time
+    without slowing down and the added tool changes do not cost more than that.
+
+    Sequential groups require gantry clearance over already printed objects -
+    use allow_sequential=False for interleaving of all objects. Before the next group
+    the nozzle is lifted over the printed objects, travels at clearance height over
+    the first point of the group and only then lowers.
+
+    Args:
+        objects (list): list of dicts with keys 'name', 'layers' (and 'material')
+                        - see get_object_layers
+        min_layer_time (float, optional): min layer time in sec. Defaults to 10.
+        allow_sequential (bool, optional): allow sequential groups. Defaults to True.
+        tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
+        tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+        clearance (float, optional): nozzle lift over the tallest printed object between
+                                     sequential groups in mm. Defaults to 2.0.
+        clearance_feedrate (float, optional): feedrate of the lift in mm/min. Defaults to 600.
+                                              The travel at clearance height uses the feedrate
+                                              of the first move of the group.
+
+    Returns:
+        schedule (list): list of (z, {material: g_code}) in printing order (see assemble_job)
+        report (dict): includes keys:
+                            'groups' (list of lists of object names)
+                            'total_time_sec'
+                            'one_by_one_time_sec'
+                            'time_saved_sec'
+    """
+    objects_layers = [get_object_layers(obj) for obj in objects]
+    z_all = sorted(set(z for layers in objects_layers for z in layers.keys()))
+    z_index = {z: k for k, z in enumerate(z_all)}
+    tool_change_time = tool_unload_time + tool_load_time
+
+    # layer times of objects on a common z grid
+    objects_times = []
+    objects_materials = []
+    for layers in objects_layers:
+        times = np.zeros(len(z_all))
+        for z, t in estimate_layer_times(layers).items():
+            times[z_index[z]] = max(t, 1e-6) # present layer
+        objects_times.append(times)
+        objects_materials.append(set(m for layer in layers.values() for m in layer.keys()))
+
+    def group_time(group):
+        return _group_time(group, objects_times, objects_materials, z_all,
+                           min_layer_time, tool_change_time)
+
+    # greedy merging of groups (starting with all objects sequential)
+    groups = [[i] for i in range(len(objects))]
+    if not allow_sequential:
+        groups = [list(range(len(objects)))]
+    group_times = [group_time(g) for g in groups]
+    while len(groups) > 1:
+        best = None
+        for a in range(len(groups)):
+            for b in range(a + 1, len(groups)):
+                merged_time = group_time(groups[a] + groups[b])
+                gain = group_times[a] + group_times[b] - merged_time
+                if gain > 0 and (best is None or gain > best[0]):
+                    best = (gain, a, b, merged_time)
+        if best is None:
+            break
+        gain, a, b, merged_time = best
+        groups[a] = groups[a] + groups[b]
+        group_times[a] = merged_time
+        del groups[b]
+        del group_times[b]
+
+    # schedule: groups one after another, layers of a group interleaved
+    schedule = []
+    z_max = None
+    for group in groups:
+        group_layers = {}
+        for i in group:
+            for z, layer in objects_layers[i].items():
+                merged_layer = group_layers.setdefault(z, {})
+                for material, g_code in layer.items():
+                    merged_layer[material] = merged_layer.get(material, '') + g_code
+        group_layers = sorted(group_layers.items())
+
+        if z_max is not None: # lift over already printed groups
+            z0, first_layer = group_layers[0]
+            first_material = list(first_layer.keys())[0]
+            z_clear = z_max + clearance
+            lift = f'G0 Z{z_clear:.3f} F{clearance_feedrate:.0f} ; lift over printed objects\n'
+            point, feedrate = get_first_point(first_layer[first_material])
+            if point is not None: # travel at clearance height, the group starts with lowering Z
+                feedrate = clearance_feedrate if feedrate is None else feedrate
+                lift += f'G0 X{point[0]:.3f} Y{point[1]:.3f} Z{z_clear:.3f} F{feedrate:.0f} ' \
+                        '; travel over printed objects\n'
+            first_layer = dict(first_layer)
+            first_layer[first_material] = lift + first_layer[first_material]
+            group_layers[0] = (z0, first_layer)
+        z_max = max(z_max if z_max is not None else -np.inf, # tallest of all printed groups
+                    max(z_all[k] for i in group for k in np.nonzero(objects_times[i])[0]))
+
+        schedule += group_layers
+
+    # one by one: every object printed alone, slowed down to min_layer_time
+    one_by_one_time = sum(group_time([i]) for i in range(len(objects)))
+    materials_order = [m for i in range(len(objects)) for m in objects_materials[i]]
+    one_by_one_time += sum(m0 != m1 for m0, m1 in zip(materials_order[:-1], materials_order[1:])) \
+        * tool_change_time
+    total_time = sum(group_times)
+    materials_order = [m for g in groups for i in g for m in objects_materials[i]]
+    total_time += sum(m0 != m1 for m0, m1 in zip(materials_order[:-1], materials_order[1:])) \
+        * tool_change_time
+
+    report = {
+        'groups': [[objects[i].get('name', str(i)) for i in g] for g in groups],
+        'total_time_sec': round(total_time, 2),
+        'one_by_one_time_sec': round(one_by_one_time, 2),
+        'time_saved_sec': round(one_by_one_time - total_time, 2),
+    }
+
+    return schedule, report
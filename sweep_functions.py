@@ -0,0 +1,215 @@
+import os
+import copy
+import json
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from gcode_generator import G_code_generator
+from gcode_functions import get_print_limits, process_g_code_lines
+from job_functions import generate_layers, merge_layers, assemble_job
+
+
+def get_sweep_points(grid, materials):
+    """Returns all points of a parameter grid (cartesian product).
+
+    Args:
+        grid (dict): keys = printing param names ('print_feedrate') applied to all
+                     swept materials or 'material.param' ('TPU.print_feedrate')
+                     applied to a single material, values = list of param values
+        materials (list): materials to which non-prefixed params are applied
+
+    Returns:
+        list: list of dicts {material: {param: value}} for each grid point
+    """
+    keys = list(grid.keys())
+    points = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        point = {}
+        for key, value in zip(keys, values):
+            if '.' in key:
+                material, param = key.split('.', 1)
+                point.setdefault(material, {})[param] = value
+            else:
+                for material in materials:
+                    point.setdefault(material, {})[key] = value
+        points.append(point)
+    return points
+
+
+def get_tile_offsets(n_variants, pitch, n_columns=None):
+    """Returns xy offsets of tiles on a plate (row by row, from bottom left).
+
+    Args:
+        n_variants (int): number of tiles
+        pitch (list): [dx, dy] distance between tiles in mm
+        n_columns (int, optional): Defaults to ceil(sqrt(n_variants)).
+
+    Returns:
+        numpy array: shape (n_variants, 2)
+    """
+    if n_columns is None:
+        n_columns = int(np.ceil(np.sqrt(n_variants)))
+    i = np.arange(n_variants)
+    offsets = np.zeros((n_variants, 2))
+    offsets[:,0] = (i % n_columns) * pitch[0]
+    offsets[:,1] = (i // n_columns) * pitch[1]
+    return offsets
+
+
+def offset_regions(regions, offset):
+    """Returns a copy of regions moved by offset [dx, dy] in mm (with vertices of polygon regions)."""
+    moved = copy.deepcopy(regions)
+    for reg_specs in moved.values():
+        reg_specs['position'] = np.asarray(reg_specs['position']) + np.asarray(offset)
+        if 'vertices' in reg_specs:
+            reg_specs['vertices'] = np.asarray(reg_specs['vertices']) + np.asarray(offset)
+    return moved
+
+
+def _variant_printer_settings(printer_settings, variant_params, point):
+    """Updates temps and cooling in printer settings if they are swept."""
+    printer_settings = copy.deepcopy(printer_settings)
+    for material, params in point.items():
+        if material not in printer_settings['tools']:
+            continue
+        if 'T_nozzle' in params or 'T_nozzle_standby' in params:
+            printer_settings['temps'][material] = [variant_params[material]['T_nozzle'],
+                                                   variant_params[material]['T_nozzle_standby']]
+        if 'cooling' in params:
+            printer_settings['cooling'][material] = variant_params[material]['cooling']
+    return printer_settings
+
+
+def _generate_variant(task):
+    """Generates one variant of a sweep (runs in a worker process).
+
+    Args:
+        task (dict): see parameter_sweep
+
+    Returns:
+        entry (dict): manifest entry, with 'layers' if the variant is a plate tile
+    """
+    variant_params = copy.deepcopy(task['print_params'])
+    for material, params in task['point'].items():
+        variant_params[material].update(params)
+    printer_settings = _variant_printer_settings(task['printer_settings'],
+                                                 variant_params, task['point'])
+
+    generators = {mat: G_code_generator(params) for mat, params in variant_params.items()}
+    layers = generate_layers(task['regions'], generators)
+    g_code = assemble_job(layers, printer_settings, printing_params=variant_params)
+
+    entry = {
+        'name': task['name'],
+        'params': task['point'],
+        'filepath': task['filepath'],
+    }
+    if task['filepath'] is not None: # standalone variant
+        with open(task['filepath'], 'w') as f:
+            f.write(g_code)
+    else: # plate tile - layers are merged in the main process
+        entry['layers'] = layers
+
+    estimate = process_g_code_lines(g_code.split('\n'),
+                                    tool_unload_time=task['tool_unload_time'],
+                                    tool_load_time=task['tool_load_time'])
+    entry['print_time_sec'] = estimate['print_time_sec']
+    entry['all_extrusions_mm'] = estimate['all_extrusions_mm']
+    entry['size_bytes'] = len(g_code)
+    return entry
+
+
+def parameter_sweep(regions, print_params, printer_settings, grid, materials=None,
+                    output_dir='generated_gcodes/sweep', name='variant',
+                    tiled=False, tile_pitch=None, tile_gap=5, n_columns=None,
+                    processes=None, tool_unload_time=3, tool_load_time=20):
+    """Generates a design-of-experiments parameter sweep of the same regions layout.
+    One G_code_generator is built for each material of each grid point and
+    all variants are generated in a process pool.
+
+    Args:
+        regions (dict): dict of regions with region specs (see Regions.add_region)
+        print_params (dict): keys = materials, values = dict of printing params
+        printer_settings (dict): printer settings (tools, temps, cooling, prime_macro, mesh_bed)
+        grid (dict): {param: [values]} or {'material.param': [values]} (see get_sweep_points)
+        materials (list, optional): materials swept by non-prefixed params. Defaults to all.
+        output_dir (string, optional): directory for g_code files and manifest.json.
+        name (string, optional): name prefix of the variants. Defaults to 'variant'.
+        tiled (bool, optional): combines all variants into one tiled plate, layer by layer. 
+                                Temps and cooling of the plate are taken from printer_settings. 
+                                Defaults to False.
+        tile_pitch (list, optional): [dx, dy] tile pitch in mm. Defaults to print limits + tile_gap.
+        tile_gap (float, optional): gap between tiles in mm. Defaults to 5.
+        n_columns (int, optional): number of tile columns. Defaults to ceil(sqrt(N)).
+        processes (int, optional): number of worker processes. Defaults to os.cpu_count().
+        tool_unload_time (int, optional): time for tool unload in sec. Defaults to 3.
+        tool_load_time (int, optional): time for tool load in sec. Defaults to 20.
+
+    Returns:
+        manifest (list): list of dicts for each variant with keys:
+                            'name', 'params', 'filepath', 'print_time_sec',
+                            'all_extrusions_mm', 'size_bytes' (and 'offset' if tiled)
+    """
+    if materials is None:
+        materials = list(print_params.keys())
+    points = get_sweep_points(grid, materials)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if tiled:
+        if tile_pitch is None:
+            limits = get_print_limits(regions)
+            tile_pitch = [limits['x_max'] - limits['x_min'] + tile_gap,
+                          limits['y_max'] - limits['y_min'] + tile_gap]
+        offsets = get_tile_offsets(len(points), tile_pitch, n_columns=n_columns)
+
+    tasks = []
+    for i, point in enumerate(points):
+        variant_name = f'{name}_{i:03d}'
+        task = {
+            'name': variant_name,
+            'point': point,
+            'print_params': print_params,
+            'printer_settings': printer_settings,
+            'regions': regions,
+            'filepath': os.path.join(output_dir, variant_name + '.gcode'),
+            'tool_unload_time': tool_unload_time,
+            'tool_load_time': tool_load_time,
+        }
+        if tiled:
+            task['regions'] = offset_regions(regions, offsets[i])
+            task['filepath'] = None
+        tasks.append(task)
+
+    # generating variants
+    if processes == 1:
+        manifest = [_generate_variant(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            manifest = list(executor.map(_generate_variant, tasks))
+
+    if tiled: # combining all variants into one plate
+        plate_regions = {}
+        for i, task in enumerate(tasks):
+            for reg_key, reg_specs in task['regions'].items():
+                plate_regions[f'{task["name"]}_{reg_key}'] = reg_specs
+        plate_settings = copy.deepcopy(printer_settings)
+        if plate_settings.get('mesh_bed') is not None: # mesh bed over the whole plate
+            limits = get_print_limits(plate_regions)
+            plate_settings['mesh_bed']['X'] = [limits['x_min'], limits['x_max']]
+            plate_settings['mesh_bed']['Y'] = [limits['y_min'], limits['y_max']]
+
+        layers = merge_layers(*[entry.pop('layers') for entry in manifest])
+        g_code = assemble_job(layers, plate_settings, printing_params=print_params)
+        plate_filepath = os.path.join(output_dir, name + '_plate.gcode')
+        with open(plate_filepath, 'w') as f:
+            f.write(g_code)
+        for i, entry in enumerate(manifest):
+            entry['filepath'] = plate_filepath
+            entry['offset'] = [float(offsets[i,0]), float(offsets[i,1])]
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        f.write(json.dumps(manifest, indent=True))
+
+    return manifest
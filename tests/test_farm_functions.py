@@ -0,0 +1,94 @@
+import asyncio
+from gcode_generator import G_code_generator
+from farm_functions import Print_farm, stand_in_printer
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+PRINTER_SETTINGS = {
+    'temps': {'PLA': [215, 170], 'bed': 60},
+    'cooling': {'PLA': 1},
+    'prime_macro': {'PLA': 'prime'},
+    'mesh_bed': None,
+}
+TOOLS = {'PLA': 'T0'}
+
+
+async def bad_reply_printer(host='127.0.0.1'):
+    """Endpoint which reads the job and replies with bytes that are not a valid reply."""
+    async def handle(reader, writer):
+        header = (await reader.readline()).decode().split()
+        await reader.readexactly(int(header[2]))
+        writer.write(b'\xff\xfe\n')
+        await writer.drain()
+        writer.close()
+    return await asyncio.start_server(handle, host, 0)
+
+
+async def run_farm():
+    good = await stand_in_printer(TOOLS)
+    bad = await bad_reply_printer()
+    offline = await stand_in_printer(TOOLS)
+    offline_port = offline.sockets[0].getsockname()[1]
+    offline.close()
+    await offline.wait_closed()
+
+    farm = Print_farm([
+        {'name': 'good', 'host': '127.0.0.1', 'port': good.sockets[0].getsockname()[1], 'tools': TOOLS},
+        {'name': 'offline', 'host': '127.0.0.1', 'port': offline_port, 'tools': TOOLS},
+        {'name': 'bad', 'host': '127.0.0.1', 'port': bad.sockets[0].getsockname()[1], 'tools': TOOLS},
+    ])
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = {z: {'PLA': g_code} for z, g_code in gen.print_cuboid([[0, 0], [10, 10]], 0.2, 0.6)[0].items()}
+    for i in range(3):
+        farm.submit(f'job_{i}', layers, PRINTER_SETTINGS)
+    assigned = {name: job['printer'] for name, job in farm.jobs.items()}
+
+    report = await asyncio.wait_for(farm.run(), timeout=30)
+    good.close()
+    bad.close()
+    return farm, assigned, report, good.received
+
+
+def test_print_farm_with_offline_printer_and_bad_reply():
+    farm, assigned, report, received = asyncio.run(run_farm())
+    assert sorted(assigned.values()) == ['bad', 'good', 'offline'] # load balanced
+
+    bad_job = [name for name, printer in assigned.items() if printer == 'bad'][0]
+    offline_job = [name for name, printer in assigned.items() if printer == 'offline'][0]
+    assert report['offline'] == ['offline']
+    assert report['jobs'][bad_job] == 'failed'
+    assert 'UnicodeDecodeError' in farm.jobs[bad_job]['error']
+    assert report['jobs'][offline_job] == 'done' # reassigned to the earliest finish
+    assert farm.jobs[offline_job]['printer'] == 'good'
+    assert sum(state == 'done' for state in report['jobs'].values()) == 2
+    assert report['load_sec']['offline'] == 0
+    assert report['load_sec']['bad'] == 0
+    assert len(received) == 2
+
+
+def test_submit_to_printer_with_extra_tools(monkeypatch):
+    import farm_functions
+    assemble_job = farm_functions.assemble_job
+    calls = []
+    def counting_assemble_job(*args, **kwargs):
+        calls.append(args)
+        return assemble_job(*args, **kwargs)
+    monkeypatch.setattr(farm_functions, 'assemble_job', counting_assemble_job)
+
+    farm = Print_farm([
+        {'name': 'single', 'host': '127.0.0.1', 'port': 1, 'tools': TOOLS},
+        {'name': 'multi', 'host': '127.0.0.1', 'port': 1, 'tools': {'TPU': 'T1', 'PLA': 'T2'}},
+    ])
+    farm.load['single'] = 1000 # multi tool printer finishes first
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = {z: {'PLA': g_code} for z, g_code in gen.print_cuboid([[0, 0], [10, 10]], 0.2, 0.6)[0].items()}
+    job = farm.submit('job', layers, PRINTER_SETTINGS) # no temps for TPU
+
+    assert job['printer'] == 'multi'
+    assert len(calls) == 1 # assembled only for the chosen printer
+    assert 'T2 P0' in job['g_code']
+    assert 'T1' not in job['g_code']
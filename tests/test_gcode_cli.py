@@ -0,0 +1,50 @@
+import os
+import gzip
+import json
+import gcode_cli
+from gcode_generator import generator_multi
+from tool_changer_functions import load_params
+from job_functions import generate_layers, assemble_job
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0', 'TPU': 'T1'},
+    'temps': {'PLA': [215, 170], 'TPU': [230, 180], 'bed': 60},
+    'cooling': {'PLA': 1, 'TPU': 0.3},
+    'prime_macro': {'PLA': 'prime', 'TPU': 'prime'},
+    'mesh_bed': None,
+}
+REGIONS = {
+    'base': {'layer': 1, 'z_height': None, 'region_type': 'surface', 'material': 'PLA',
+             'position': [100, 100], 'dimensions': [20, 20], 'start_pos': ['x0', 'y0'],
+             'infill_angle': 0, 'perimeter': True, 'overlap_factor': 0.25,
+             'speed_factor': 1.0, 'extrude_factor': 1.0, 'heading': 'base'},
+    'pad': {'layer': 2, 'z_height': None, 'region_type': 'surface', 'material': 'TPU',
+            'position': [105, 105], 'dimensions': [10, 10], 'start_pos': ['x1', 'y1'],
+            'infill_angle': 90, 'perimeter': False, 'overlap_factor': 0.25,
+            'speed_factor': 1.0, 'extrude_factor': 1.0, 'heading': 'pad'},
+}
+
+
+def test_batch_generation_from_job_files(tmp_path, capsys):
+    with open(tmp_path / 'settings.json', 'w') as f:
+        json.dump(PRINTER_SETTINGS, f)
+    jobs = [
+        {'name': 'plain', 'printing_params': {'PLA': 'PLA_default', 'TPU': 'TPU_default'},
+         'printer_settings': 'settings.json', 'regions': REGIONS},
+        {'name': 'packed', 'printing_params': {'PLA': 'PLA_default', 'TPU': 'TPU_default'},
+         'printer_settings': 'settings.json', 'regions': REGIONS, 'output': 'out/packed.gcode.gz'},
+    ]
+    with open(tmp_path / 'jobs.json', 'w') as f:
+        json.dump(jobs, f)
+
+    gcode_cli.main([str(tmp_path / 'jobs.json'), '-o', str(tmp_path / 'generated')])
+    assert '2 jobs' in capsys.readouterr().out
+
+    generators = generator_multi({mat: load_params(os.path.join(ROOT, 'printing_params', f'{mat}_default.json'))
+                                  for mat in ['PLA', 'TPU']})
+    expected = assemble_job(generate_layers(REGIONS, generators), PRINTER_SETTINGS, printing_params=generators)
+    with open(tmp_path / 'generated' / 'plain.gcode') as f:
+        assert f.read() == expected
+    with gzip.open(tmp_path / 'out' / 'packed.gcode.gz', 'rt') as f:
+        assert f.read() == expected
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from gcode_generator import G_code_generator
+from regions_functions import Regions
+from job_functions import generate_layers, assemble_job
+from gcode_functions import get_layers_z, process_g_code, process_g_code_parallel, get_file_chunks
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0', 'TPU': 'T1'},
+    'temps': {'PLA': [215, 170], 'TPU': [230, 180], 'bed': 60},
+    'cooling': {'PLA': 1, 'TPU': 0.3},
+    'prime_macro': {'PLA': 'prime', 'TPU': 'prime'},
+    'mesh_bed': None,
+}
+
+
+def test_parallel_parsing_of_job(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = {}
+    for material, surface in [('PLA', [[0, 0], [20, 20]]), ('TPU', [[30, 0], [50, 20]])]:
+        for z, g_code in gen.print_cuboid(surface, 0.2, 3)[0].items():
+            layers.setdefault(z, {})[material] = g_code
+    filepath = tmp_path / 'job.gcode'
+    filepath.write_text(assemble_job(layers, PRINTER_SETTINGS))
+
+    serial = process_g_code(str(filepath))
+    parallel = process_g_code_parallel(str(filepath), processes=2, chunks_per_process=8)
+    assert parallel == serial
+    assert serial['tool_loads_duration'] > 0
+
+
+def test_parallel_parsing_with_partial_m207_in_later_chunk(tmp_path):
+    lines = ['M207 S0.8 F1800 ; firmware retraction']
+    for i in range(400):
+        if i == 300:
+            lines.append('M207 S1.5 ; only retraction length')
+        lines += [f'G1 X{i % 50} Y{i % 7} Z0.2 E0.5 F1200', 'G10', f'G0 X{i % 13} Y{i % 3} F6000', 'G11']
+    filepath = tmp_path / 'retraction.gcode'
+    filepath.write_text('\n'.join(lines) + '\n')
+
+    serial = process_g_code(str(filepath))
+    parallel = process_g_code_parallel(str(filepath), processes=2, chunks_per_process=8)
+    assert parallel == serial
+
+
+def test_breakdown_sums_to_totals(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    regions = Regions(ref_pos=(100, 100))
+    regions.add_region('base', [0, 0], [20, 20], layer=1, z_height=None, reg_type='surface', mat='PLA',
+                       start_pos=['x0', 'y0'], infill_angle=0, perimeter=True)
+    regions.add_region('pad', [5, 5], [10, 10], layer=2, z_height=None, reg_type='surface', mat='TPU',
+                       start_pos=['x0', 'y0'], infill_angle=90, perimeter=False)
+    layers = generate_layers(regions.regions, {'PLA': gen, 'TPU': gen})
+    filepath = tmp_path / 'job.gcode'
+    filepath.write_text(assemble_job(layers, PRINTER_SETTINGS))
+
+    totals, table = process_g_code(str(filepath), breakdown=True)
+    assert totals == process_g_code(str(filepath))
+    assert abs(sum(row['time_sec'] for row in table) - totals['print_time_sec']) < 0.1
+    assert abs(sum(row['extrusion_mm'] for row in table) - totals['all_extrusions_mm']) < 0.01
+    assert {row['category'] for row in table} >= {'extrusion', 'travel', 'retract_wipe', 'tool_change'}
+
+    by_region = {}
+    for row in table:
+        if row['category'] == 'extrusion':
+            by_region.setdefault((row['region'], row['material'], row['layer_z']), 0)
+            by_region[row['region'], row['material'], row['layer_z']] += row['extrusion_mm']
+    assert set(by_region.keys()) == {('print region - base', 'PLA', 0.2), ('print region - pad', 'TPU', 0.4)}
+
+    with pytest.raises(Exception):
+        process_g_code(str(filepath), breakdown=True, processes=2)
+
+
+def test_layers_z():
+    z = np.array([0.2, 0.2, 0.4, 0.2, 0.2, 0.6, 0.4, 0.4])
+    assert get_layers_z(z).tolist() == [0.2, 0.2, 0.2, 0.2, 0.2, 0.4, 0.4, 0.4]
+
+
+def test_file_chunks_are_newline_aligned(tmp_path):
+    filepath = tmp_path / 'lines.gcode'
+    text = ''.join(f'G1 X{i} Y{i % 7} Z0.2 E0.1 F1200\n' for i in range(1000))
+    filepath.write_text(text)
+
+    chunks = get_file_chunks(str(filepath), 7)
+    assert len(chunks) == 7
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(text)
+    assert all(end == start for (_, end), (start, _) in zip(chunks[:-1], chunks[1:]))
+    assert all(text[end - 1] == '\n' for _, end in chunks)
+    assert get_file_chunks(str(tmp_path / 'lines.gcode'), 2000)[-1][1] == len(text)
+
+    assert process_g_code(str(filepath), processes=2) == process_g_code(str(filepath))
@@ -0,0 +1,180 @@
+import gc
+import re
+import pickle
+import weakref
+import numpy as np
+import pytest
+from gcode_generator import G_code_generator, compile_profile
+from gcode_functions import process_g_code_lines
+from travel_functions import get_line_words
+from regions_functions import Regions
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+
+
+def test_pressure_advance_pattern_k_values():
+    gen = G_code_generator(dict(PRINTING_PARAMS, pressure_advance=0.05))
+    layers, rows = gen.print_pressure_advance_pattern(np.linspace(0, 0.1, 11), tool_num=2)
+    g_code = layers[0.2]
+
+    k_values = re.findall(r'^M572 D2 S(\S+) ;', g_code, re.MULTILINE)
+    assert k_values[3] == '0.0300' # 0.030000000000000002 in linspace
+    assert all(re.fullmatch(r'\d\.\d{4}', k) for k in k_values)
+    assert k_values[-1] == '0.0500' # pressure advance of the material restored
+    assert [row['k'] for row in rows] == [float(k) for k in k_values[:-1]]
+    assert 'K=0.0300' in g_code
+
+
+def test_offset_polygon():
+    gen = G_code_generator(PRINTING_PARAMS)
+    clockwise_square = [[0, 0], [0, 10], [10, 10], [10, 0]]
+    offset = gen.offset_polygon(clockwise_square, 1)
+    assert np.allclose(sorted(offset.tolist()), [[1, 1], [1, 9], [9, 1], [9, 9]])
+    x, y = offset[:,0], offset[:,1]
+    assert np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) > 0 # counter-clockwise
+
+
+def test_polygon_infill_covers_polygon():
+    gen = G_code_generator(PRINTING_PARAMS)
+    diamond = np.array([[10, 0], [20, 10], [10, 20], [0, 10]]) # convex, area 200
+    chains = gen.get_polygon_infill_points(diamond, infill_angle=30)
+
+    points = np.vstack(chains)
+    edges = np.roll(diamond, -1, axis=0) - diamond
+    cross = edges[:,0] * (points[:,None,1] - diamond[:,1]) - edges[:,1] * (points[:,None,0] - diamond[:,0])
+    assert np.all(cross > -1e-9) # all points inside (counter-clockwise polygon)
+
+    traces = np.concatenate([np.linalg.norm(chain[1::2] - chain[0::2], axis=1) for chain in chains])
+    assert abs(np.sum(traces) * gen.trace_spacing - 200) < 200 * 0.05
+
+
+def test_polygon_matches_rectangular_surface():
+    gen = G_code_generator(PRINTING_PARAMS)
+    rectangle = [[0, 0], [20, 0], [20, 10], [0, 10]]
+    polygon = gen.print_polygon(rectangle, 0.2, infill_angle=0, perimeter=True)
+    surface = gen.print_surface([[0, 0], [20, 10]], 0.2, infill_angle=0, perimeter=True)
+
+    e_polygon = process_g_code_lines(polygon.split('\n'))['all_extrusions_mm']
+    e_surface = process_g_code_lines(surface.split('\n'))['all_extrusions_mm']
+    assert abs(e_polygon - e_surface) < e_surface * 0.05
+
+
+def test_plan_feedrates_caps_volumetric_flow():
+    gen = G_code_generator(dict(PRINTING_PARAMS, max_volumetric_flow=5, max_print_feedrate=100))
+    lengths = np.array([10, 10, 10, 1e-3])
+    extrusions = gen.calculate_extrusion_length(lengths) * np.array([1, 2, 0.1, 1])
+    feedrates = gen.plan_feedrates(lengths, extrusions)
+
+    flows = extrusions * gen.profile.filament_area / (lengths / (feedrates / 60))
+    assert np.allclose(flows[:2], 5) # at max volumetric flow
+    assert feedrates[0] == 2 * feedrates[1] # double extrusion - half feedrate
+    assert feedrates[2] == 100 * 60 # limited by max print feedrate
+    assert np.allclose(gen.plan_feedrates(lengths, extrusions, speed_factor=0.5)[2], 50 * 60)
+
+    plain = G_code_generator(PRINTING_PARAMS)
+    assert np.all(plain.plan_feedrates(lengths, extrusions, speed_factor=2) == 30 * 60 * 2)
+
+
+def test_print_line_with_volumetric_flow():
+    gen = G_code_generator(dict(PRINTING_PARAMS, max_volumetric_flow=5, max_print_feedrate=100))
+    g_code = gen.print_line([0, 0], [20, 0], 0.2)
+    line = [line for line in g_code.split('\n') if line.endswith('; single line')][0]
+    words = get_line_words(line)
+    assert abs(words['E'] * gen.profile.filament_area / (20 / (words['F'] / 60)) - 5) < 0.05
+
+
+def test_print_regions_matches_print_region_loop():
+    regions = Regions(ref_pos=(50, 50))
+    starts = [['x0', 'y0'], ['x0', 'y1'], ['x1', 'y0'], ['x1', 'y1']]
+    for i, start in enumerate(starts):
+        for angle in [0, 90]:
+            regions.add_region(f's{i}{angle}', [12 * i, angle / 6], [10 + i, 7.3], layer=1, z_height=None,
+                               reg_type='surface', mat='PLA', start_pos=start, infill_angle=angle,
+                               perimeter=i % 2 == 0, overlap_factor=0.3, speed_factor=1 + i / 10)
+        regions.add_region(f'p{i}', [12 * i, 40], [6, 4], layer=1, z_height=None, reg_type='perimeter',
+                           mat='PLA', start_pos=start, infill_angle=0, perimeter=True)
+    regions.add_region('angled', [0, 50], [10, 10], layer=1, z_height=None, reg_type='surface', mat='PLA',
+                       start_pos=['x0', 'y0'], infill_angle=45, perimeter=True)
+    regions.add_region('tiny', [20, 50], [0.5, 0.5], layer=1, z_height=None, reg_type='surface', mat='PLA',
+                       start_pos=['x0', 'y0'], infill_angle=0, perimeter=False)
+    regions.add_polygon_region('triangle', [[30, 50], [40, 50], [35, 58]], layer=1, z_height=None,
+                               mat='PLA', infill_angle=30, perimeter=True)
+
+    batch_gen = G_code_generator(PRINTING_PARAMS)
+    loop_gen = G_code_generator(PRINTING_PARAMS)
+    batch = batch_gen.print_regions(regions.regions)
+    loop = ''.join(loop_gen.print_region(reg) for reg in regions.regions.values())
+    assert batch == loop
+    assert batch_gen.nozzle_locations == loop_gen.nozzle_locations
+    assert batch_gen.print_regions(regions.regions, speed_factor=2) == \
+        ''.join(loop_gen.print_region(reg, speed_factor=2) for reg in regions.regions.values())
+
+
+def test_compiled_profile():
+    profile = compile_profile(PRINTING_PARAMS)
+    assert profile.print_feedrate == 30 * 60 # mm/min
+    assert np.isclose(profile.filament_area, np.pi * 1.75**2 / 4)
+    assert np.isclose(profile.extrusion_area_ratio, profile.trace_area / profile.filament_area)
+    assert compile_profile(profile) is profile
+    with pytest.raises(Exception):
+        profile.print_feedrate = 10
+
+    gen = G_code_generator(profile)
+    gen.print_line([0, 0], [10, 0], 0.2)
+    copied = pickle.loads(pickle.dumps(gen)) # printing params only, without path state
+    assert copied.printing_params == gen.printing_params
+    assert copied.nozzle_locations == []
+
+
+def test_streams_keep_separate_path_state():
+    gen = G_code_generator(PRINTING_PARAMS)
+    gen.print_line([0, 0], [10, 0], 0.2)
+    before = list(gen.nozzle_locations)
+    with gen.stream() as context:
+        assert gen.nozzle_locations == []
+        g_code = gen.print_line([0, 0], [10, 0], 0.4)
+        assert gen.context is context
+    assert gen.nozzle_locations == before
+    assert g_code == G_code_generator(PRINTING_PARAMS).print_line([0, 0], [10, 0], 0.4)
+
+
+def test_path_contexts_are_freed_with_generators():
+    gen = G_code_generator(PRINTING_PARAMS)
+    gen.print_line([0, 0], [10, 0], 0.2)
+    with gen.stream():
+        gen.print_line([0, 0], [10, 0], 0.2)
+    reference = weakref.ref(gen)
+    del gen
+    gc.collect()
+    assert reference() is None
+
+
+def test_sparse_infill_of_cuboid_interior():
+    gen = G_code_generator(PRINTING_PARAMS)
+    solid, _ = gen.print_cuboid([[0, 0], [20, 20]], 0.2, 2, perimeter=True)
+    sparse, _, report = gen.print_cuboid([[0, 0], [20, 20]], 0.2, 2, perimeter=True,
+                                         infill_density=0.25, solid_layers=2, return_report=True)
+    extrusions = {z: process_g_code_lines(g_code.split('\n'))['all_extrusions_mm']
+                  for z, g_code in sparse.items()}
+    solid_extrusions = {z: process_g_code_lines(g_code.split('\n'))['all_extrusions_mm']
+                        for z, g_code in solid.items()}
+    z_values = sorted(sparse.keys())
+    for z in z_values[:2] + z_values[-2:]: # solid bottom and top layers
+        assert extrusions[z] == solid_extrusions[z]
+    for z in z_values[2:-2]:
+        assert extrusions[z] < 0.5 * solid_extrusions[z]
+    assert report['filament_saved_mm'] > 0
+    assert report['time_saved_sec'] > 0
+
+    # sparse lines are aligned in all layers of the same angle
+    xy = [[line.split(' Z')[0].split(' E')[0] for line in sparse[z].split('\n') if line.startswith('G1 X')]
+          for z in [z_values[2], z_values[4]]]
+    assert xy[0] == xy[1]
+
+    with pytest.raises(Exception):
+        gen.print_cuboid([[0, 0], [20, 20]], 0.2, 2, infill_density=0)
@@ -0,0 +1,72 @@
+import numpy as np
+from gcode_generator import G_code_generator
+from job_functions import assemble_job
+from gcode_functions import process_g_code
+from gcode_reader import G_code_reader
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0'},
+    'temps': {'PLA': [215, 170], 'bed': 60},
+    'cooling': {'PLA': 1},
+    'prime_macro': {'PLA': 'prime'},
+    'mesh_bed': None,
+}
+
+
+def test_layer_index_of_job_taller_than_stop_lift(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    cuboid, _ = gen.print_cuboid([[0, 0], [5, 5]], 0.2, 12)
+    g_code = assemble_job({z: {'PLA': layer} for z, layer in cuboid.items()}, PRINTER_SETTINGS)
+    assert 'G91' in g_code # printer stop lifts Z relative
+    filepath = tmp_path / 'job.gcode'
+    filepath.write_text(g_code)
+
+    with G_code_reader(str(filepath)) as reader:
+        assert np.allclose(reader.layers_z, sorted(cuboid.keys()))
+        stats = reader.range_stats(0, len(reader.layers_z) - 1)
+    assert stats['layers'] == len(cuboid)
+
+
+def test_empty_file(tmp_path):
+    filepath = tmp_path / 'empty.gcode'
+    filepath.write_text('')
+
+    with G_code_reader(str(filepath)) as reader:
+        assert len(reader.layers_z) == 0
+        assert reader.get_sections() == []
+
+
+def test_layer_queries_match_whole_file(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = {}
+    for material, surface in [('PLA', [[0, 0], [10, 10]]), ('TPU', [[20, 0], [30, 10]])]:
+        for z, g_code in gen.print_cuboid(surface, 0.2, 1)[0].items():
+            layers.setdefault(z, {})[material] = g_code
+    settings = dict(PRINTER_SETTINGS, tools={'PLA': 'T0', 'TPU': 'T1'},
+                    temps={'PLA': [215, 170], 'TPU': [230, 180], 'bed': 60},
+                    cooling={'PLA': 1, 'TPU': 0.3}, prime_macro={'PLA': 'prime', 'TPU': 'prime'})
+    g_code = assemble_job(layers, settings)
+    filepath = tmp_path / 'job.gcode'
+    filepath.write_text(g_code)
+
+    with G_code_reader(str(filepath)) as reader:
+        assert reader.get_layer(0.41) == 1
+        assert reader.read_layer(1) == g_code[reader.index['layer_start'][1]:reader.index['layer_end'][1]]
+        stats = reader.range_stats(0, len(reader.layers_z) - 1)
+        whole = process_g_code(str(filepath))
+        assert np.isclose(stats['all_extrusions_mm'], whole['all_extrusions_mm'], atol=0.05)
+        assert set(stats['extrusions_mm_per_tool'].keys()) == {'T0', 'T1'}
+        start = reader.index['layer_start'][1]
+        assert reader.get_tool_at(start) in ['T0', 'T1']
+        assert reader.get_tool_at(0) is None
+        assert len(reader.get_sections('Tool change')) > 0
+        index = reader.index
+
+    with G_code_reader(str(filepath)) as reader: # saved index is reused
+        assert all(np.array_equal(reader.index[key], index[key]) for key in index)
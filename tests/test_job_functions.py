@@ -0,0 +1,277 @@
+import copy
+import gzip
+import re
+import zipfile
+import numpy as np
+import pytest
+from gcode_generator import G_code_generator, generator_multi
+from regions_functions import Regions
+from tool_changer_functions import take_photo
+from job_functions import (
+    iter_layers,
+    generate_layers,
+    render_jobs,
+    merge_layers,
+    order_layer_materials,
+    iter_job,
+    assemble_job,
+    cuboid_layers,
+    write_g_code,
+    resolve_compression,
+    G_code_writer,
+    preheat_job,
+    photo_job,
+    get_adaptive_mesh_bed,
+    macro_job,
+    confirm_probed)
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0', 'TPU': 'T1'},
+    'temps': {'PLA': [215, 170], 'TPU': [230, 180], 'bed': 60},
+    'cooling': {'PLA': 1, 'TPU': 0.3},
+    'prime_macro': {'PLA': 'prime', 'TPU': 'prime'},
+    'mesh_bed': None,
+}
+
+
+def get_circle_regions(radius, n_vertices=600):
+    angles = np.linspace(0, 2*np.pi, n_vertices, endpoint=False)
+    vertices = radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    regions = Regions(ref_pos=(100, 100))
+    regions.add_polygon_region('circle', vertices, layer=1, z_height=None, mat='PLA',
+                               infill_angle=45, perimeter=True)
+    return regions.regions
+
+
+def test_region_cache_with_large_vertex_arrays():
+    gen = G_code_generator(PRINTING_PARAMS)
+    regions = get_circle_regions(10)
+    moved = copy.deepcopy(regions) # repr of the vertices array is abbreviated
+    moved['circle']['vertices'][300] += [0, 0.5]
+
+    cache = {}
+    layers = generate_layers(regions, {'PLA': gen}, cache=cache)
+    moved_layers = generate_layers(moved, {'PLA': gen}, cache=cache)
+    assert len(cache) == 2
+    assert moved_layers == generate_layers(moved, {'PLA': G_code_generator(PRINTING_PARAMS)})
+    assert moved_layers != layers
+
+
+def test_region_cache_shared_by_different_generators():
+    regions = get_circle_regions(5, n_vertices=8)
+    slow_gen = G_code_generator(PRINTING_PARAMS)
+    fast_gen = G_code_generator(dict(PRINTING_PARAMS, print_feedrate=60))
+
+    cache = {}
+    slow_layers = generate_layers(regions, {'PLA': slow_gen}, cache=cache)
+    fast_layers = generate_layers(regions, {'PLA': fast_gen}, cache=cache)
+    assert len(cache) == 2
+    assert fast_layers == generate_layers(regions, {'PLA': G_code_generator(fast_gen.printing_params)})
+    assert fast_layers != slow_layers
+    assert generate_layers(regions, {'PLA': slow_gen}, cache=cache) == slow_layers
+
+
+def test_adaptive_mesh_bed_report_and_confirmed_record(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    cuboid, _ = gen.print_cuboid([[120, 70], [170, 120]], 0.2, 0.6)
+    layers = {z: {'PLA': g_code} for z, g_code in cuboid.items()}
+    printer_settings = {'mesh_bed': None} # default mesh X100:200 Y50:150 P3
+    mesh_record = str(tmp_path / 'mesh_record.json')
+
+    settings, report = get_adaptive_mesh_bed(layers, printer_settings, spacing=10,
+                                             mesh_record=mesh_record, now=1000)
+    assert settings['mesh_bed']['P'] == [7, 7] # 60 x 60 mm with margins
+    assert report['probe_points'] == 49
+    assert report['reference_probe_points'] == 121 # full bed with the same spacing
+    assert report['probing_time_sec'] == 147
+    assert report['probing_time_saved_sec'] == 216
+    assert 'save' in settings['mesh_bed']
+
+    # not reused until the probing is confirmed
+    settings, report = get_adaptive_mesh_bed(layers, printer_settings, mesh_record=mesh_record, now=1100)
+    assert report['reused_height_map'] is None
+    confirm_probed(mesh_record, report['height_map_entry'], probed_time=1100)
+    settings, report = get_adaptive_mesh_bed(layers, printer_settings, mesh_record=mesh_record, now=1200)
+    assert settings['mesh_bed']['load'] == report['reused_height_map']
+    assert report['probing_time_sec'] == 0
+    assert report['probing_time_saved_sec'] == 363
+
+
+def test_generate_and_merge_layers():
+    gen = G_code_generator(PRINTING_PARAMS)
+    regions = Regions(ref_pos=(100, 100))
+    regions.add_region('a', [0, 0], [10, 10], layer=1, z_height=None, reg_type='surface', mat='PLA',
+                       start_pos=['x0', 'y0'], infill_angle=0, perimeter=True)
+    regions.add_region('b', [0, 0], [10, 10], layer=2, z_height=None, reg_type='surface', mat='TPU',
+                       start_pos=['x0', 'y0'], infill_angle=90, perimeter=False)
+    regions.add_region('c', [20, 0], [5, 5], layer=1, z_height=None, reg_type='perimeter', mat='PLA',
+                       start_pos=['x0', 'y0'], infill_angle=0, perimeter=True)
+    layers = generate_layers(regions.regions, {'PLA': gen, 'TPU': gen})
+
+    assert list(layers.keys()) == [0.2, 0.4]
+    assert list(layers[0.2].keys()) == ['PLA']
+    pla = layers[0.2]['PLA']
+    assert pla.index('print region - a - start') < pla.index('print region - c - start')
+
+    merged = merge_layers({0.4: {'PLA': 'x\n'}}, layers, {0.2: {'PLA': 'y\n'}})
+    assert list(merged.keys()) == [0.2, 0.4]
+    assert merged[0.2]['PLA'] == pla + 'y\n'
+    assert merged[0.4] == {'PLA': 'x\n', 'TPU': layers[0.4]['TPU']}
+
+
+def test_assemble_job_keeps_loaded_material_first():
+    assert order_layer_materials({'PLA': '', 'TPU': ''}, 'TPU') == ['TPU', 'PLA']
+    layers = {0.2: {'PLA': '; pla 1\n', 'TPU': '; tpu 1\n'},
+              0.4: {'PLA': '; pla 2\n', 'TPU': '; tpu 2\n'}}
+    g_code = assemble_job(layers, PRINTER_SETTINGS)
+
+    order = [line for line in g_code.split('\n') if line in ['; pla 1', '; tpu 1', '; tpu 2', '; pla 2']]
+    assert order == ['; pla 1', '; tpu 1', '; tpu 2', '; pla 2'] # one tool change per layer
+    assert g_code.startswith(assemble_job({}, PRINTER_SETTINGS, stop=False))
+
+
+def test_lazy_layers_and_job(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    cuboid, _ = gen.print_cuboid([[0, 0], [10, 10]], 0.2, 1)
+    lazy = gen.iter_cuboid([[0, 0], [10, 10]], 0.2, 1)
+    assert not isinstance(lazy, dict)
+    assert dict(lazy) == cuboid
+
+    regions = get_circle_regions(5, n_vertices=8)
+    layers = iter_layers(regions, {'PLA': gen})
+    assert next(layers)[0] == 0.2
+    assert dict(iter_layers(regions, {'PLA': gen})) == generate_layers(regions, {'PLA': gen})
+
+    job = assemble_job({z: {'PLA': g_code} for z, g_code in cuboid.items()}, PRINTER_SETTINGS)
+    chunks = iter_job(cuboid_layers(gen.iter_cuboid([[0, 0], [10, 10]], 0.2, 1), 'PLA'), PRINTER_SETTINGS)
+    filepath = tmp_path / 'job.gcode'
+    assert write_g_code(chunks, str(filepath)) == len(job)
+    assert filepath.read_text() == job
+
+
+def test_compressed_writer_with_tee(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = cuboid_layers(gen.iter_cuboid([[0, 0], [20, 20]], 0.2, 2), 'PLA')
+    job = assemble_job(list(layers), PRINTER_SETTINGS)
+
+    # small buffers and queue - writer thread blocks the generation
+    chunks = iter_job(cuboid_layers(gen.iter_cuboid([[0, 0], [20, 20]], 0.2, 2), 'PLA'), PRINTER_SETTINGS)
+    n = write_g_code(chunks, str(tmp_path / 'job.gcode'), compression='gzip',
+                     tee_filepath=str(tmp_path / 'tee.gcode'), buffer_size=1000, queue_size=1)
+    assert n == len(job)
+    with gzip.open(tmp_path / 'job.gcode.gz', 'rt') as f:
+        assert f.read() == job
+    assert (tmp_path / 'tee.gcode').read_text() == job
+
+    with G_code_writer(str(tmp_path / 'plain.gcode'), compression='none') as writer:
+        writer.write(job)
+    assert writer.n_chars == writer.n_bytes == len(job)
+    assert (tmp_path / 'plain.gcode').read_text() == job
+
+
+def test_resolve_compression():
+    assert resolve_compression('job.gcode') == ('job.gcode', 'none')
+    assert resolve_compression('job.gcode.gz') == ('job.gcode.gz', 'gzip')
+    assert resolve_compression('job.gcode.zst') == ('job.gcode.zst', 'zstd')
+    assert resolve_compression('job.gcode', 'gzip') == ('job.gcode.gz', 'gzip')
+    assert resolve_compression('job.gcode', 'auto')[1] in ['gzip', 'zstd']
+    with pytest.raises(Exception):
+        resolve_compression('job.gcode', 'bz2')
+
+
+def get_two_material_layers(gen, height=1):
+    layers = {}
+    for material, surface in [('PLA', [[0, 0], [30, 30]]), ('TPU', [[40, 0], [70, 30]])]:
+        for z, g_code in gen.print_cuboid(surface, 0.2, height)[0].items():
+            layers.setdefault(z, {})[material] = g_code
+    return layers
+
+
+def test_preheat_job():
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = get_two_material_layers(gen)
+    g_code, report = preheat_job(layers, PRINTER_SETTINGS, preheat_time=30, deep_standby_time=None)
+
+    plain = [line for line in g_code.split('\n') if 'preheat tool' not in line and 'restore tool' not in line]
+    assert '\n'.join(plain) == assemble_job(layers, PRINTER_SETTINGS)
+    assert report['tool_changes'] == 5 # one in each layer
+    assert report['deep_standbys'] == 0
+    assert report['wait_before_sec'] == 3 * (230 - 180) / 2 + 2 * (215 - 170) / 2
+    assert 0 <= report['wait_after_sec'] < report['wait_before_sec']
+
+    lines = g_code.split('\n')
+    for i, line in enumerate(lines): # next tool is heated to its active temp before the change
+        if line.startswith('T') and ' ' not in line and line != 'T-1':
+            heated = [l for l in lines[:i] if l.startswith(f'G10 P{line[1]} R')]
+            assert heated and heated[-1].startswith(f'G10 P{line[1]} R{"215" if line == "T0" else "230"}'), line
+
+    g_code, report = preheat_job(layers, PRINTER_SETTINGS, preheat_time=5, deep_standby_time=10,
+                                 deep_standby_drop=20)
+    assert report['deep_standbys'] > 0
+    assert g_code.count('; deep standby tool') == report['deep_standbys']
+
+
+def test_photo_job_takes_photos_at_tool_changes():
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = get_two_material_layers(gen)
+    plain = assemble_job(layers, PRINTER_SETTINGS)
+    photo_cycle = take_photo('PLA', 'PLA', PRINTER_SETTINGS, beep=False)
+
+    # photo after each material - PLA is followed by a tool change to TPU in odd layers
+    g_code, report = photo_job(layers, PRINTER_SETTINGS, materials=['PLA'], beep=False)
+    assert report['photos'] == len(layers) == g_code.count('M42 P102 S1')
+    assert report['photos_at_tool_changes'] == 3
+    assert report['time_saved_sec'] == 3 * (3 + 20)
+    assert g_code.count('T-1 ;') - plain.count('T-1 ;') == 2 * photo_cycle.count('T-1 ;') # 2 cycles
+
+    # photo after whole layers - the last material continues in the next layer
+    g_code, report = photo_job(layers, PRINTER_SETTINGS, every_n_layers=2)
+    assert report['photos'] == 2 == g_code.count('M42 P102 S1')
+    assert report['photos_at_tool_changes'] == 0
+
+
+def test_render_jobs_with_shared_generators():
+    jobs = {f'job_{i}': get_circle_regions(3 + i, n_vertices=6 + i) for i in range(6)}
+    shared = generator_multi({'PLA': PRINTING_PARAMS})
+    rendered = render_jobs(jobs, shared, max_workers=3)
+
+    assert list(rendered.keys()) == list(jobs.keys())
+    for name, regions in jobs.items():
+        assert rendered[name] == generate_layers(regions, {'PLA': G_code_generator(PRINTING_PARAMS)})
+    assert shared.PLA.nozzle_locations == [] # streams do not change the path state of the thread
+
+
+def expand_macros(g_code, macros):
+    """Replaces macro calls with macro bodies at the print height of the call."""
+    def expand(match):
+        z = float(match.group(2))
+        body = macros[match.group(1)]
+        body = body.replace('{param.Z}', f'{z:.3f}')
+        return re.sub(r'\{param\.Z\+(\d*\.?\d+)\}', lambda dz: f'{z + float(dz.group(1)):.3f}', body)
+    return re.sub(r'M98 P"0:/gcodes/job/(\S+)" Z(\d*\.?\d+) ; layer macro\n', expand, g_code)
+
+
+def test_expanded_macro_job_equals_assembled_job(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = get_two_material_layers(gen, height=1.6)
+    job = assemble_job(layers, PRINTER_SETTINGS)
+
+    report = macro_job(layers, PRINTER_SETTINGS, str(tmp_path / 'job'))
+    files = {path.name: path.read_text() for path in (tmp_path / 'job').iterdir()}
+    main = files.pop('job.gcode')
+    assert report['macros'] == len(files) == 4 # alternating infill angles of 2 materials
+    assert report['macro_layers'] == main.count('; layer macro') > len(layers)
+    assert report['size_bytes_after'] < report['size_bytes_before'] == len(job.encode())
+    assert expand_macros(main, files) == job
+
+    # zip archive with the same files
+    macro_job(layers, PRINTER_SETTINGS, str(tmp_path / 'job.zip'))
+    with zipfile.ZipFile(tmp_path / 'job.zip') as archive:
+        archived = {name.split('/')[-1]: archive.read(name).decode() for name in archive.namelist()}
+    assert archived == {'job.gcode': main, **files}
@@ -0,0 +1,110 @@
+import numpy as np
+from gcode_generator import G_code_generator
+from travel_functions import get_line_words
+from scheduling_functions import get_object_layers, estimate_layer_times, schedule_objects
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+
+
+def get_footprint(layers):
+    """Returns [x_min, y_min, x_max, y_max] of extrusion moves of {z: g_code}."""
+    points = []
+    for g_code in layers.values():
+        for line in g_code.split('\n'):
+            words = get_line_words(line)
+            if line.startswith('G1 ') and words.get('E', 0) > 0 and 'X' in words:
+                points.append([words['X'], words['Y']])
+    points = np.array(points)
+    return [*points.min(axis=0), *points.max(axis=0)]
+
+
+def crosses(p0, p1, footprint, margin=0.5):
+    """True if segment p0 - p1 passes over the footprint (sampled)."""
+    x_min, y_min, x_max, y_max = footprint
+    samples = np.asarray(p0) + np.linspace(0, 1, 200)[:, None] * (np.asarray(p1) - np.asarray(p0))
+    inside = (samples[:, 0] > x_min - margin) & (samples[:, 0] < x_max + margin) \
+        & (samples[:, 1] > y_min - margin) & (samples[:, 1] < y_max + margin)
+    return np.any(inside)
+
+
+def test_sequential_groups_do_not_lower_over_printed_objects():
+    gen = G_code_generator(PRINTING_PARAMS)
+    surfaces = [[[0, 0], [10, 10]], [[70, 0], [80, 10]], [[35, 50], [45, 60]]]
+    objects = []
+    for i, surface in enumerate(surfaces):
+        layers, _ = gen.print_cuboid(surface, 0.2, 10)
+        objects.append({'name': f'cuboid_{i}', 'material': 'PLA', 'layers': layers})
+    footprints = {obj['name']: get_footprint(obj['layers']) for obj in objects}
+
+    schedule, report = schedule_objects(objects, min_layer_time=0)
+    groups = report['groups']
+    assert len(groups) == 3 # printed one after another
+
+    group = 0
+    x = y = z = None
+    for _, layer in schedule:
+        for line in layer['PLA'].split('\n'):
+            if 'lift over printed objects' in line:
+                group += 1
+            if line[:3] not in ['G0 ', 'G1 ']:
+                continue
+            words = get_line_words(line)
+            x_new, y_new, z_new = words.get('X', x), words.get('Y', y), words.get('Z', z)
+            if z is not None and x is not None and z_new < z and (x_new, y_new) != (x, y):
+                finished = [footprints[name] for g in groups[:group] for name in g]
+                assert not any(crosses([x, y], [x_new, y_new], f) for f in finished), line
+            x, y, z = x_new, y_new, z_new
+    assert group == 2
+
+
+def test_clearance_travel_is_above_all_printed_groups():
+    gen = G_code_generator(PRINTING_PARAMS)
+    cuboids = [([[0, 0], [10, 10]], 10, 'PLA'), ([[70, 0], [80, 10]], 2, 'TPU'),
+               ([[35, 50], [45, 60]], 2, 'PETG')] # tool changes keep groups sequential
+    objects = []
+    for i, (surface, height, material) in enumerate(cuboids):
+        layers, _ = gen.print_cuboid(surface, 0.2, height)
+        objects.append({'name': f'cuboid_{i}', 'material': material, 'layers': layers})
+    heights = {obj['name']: max(obj['layers'].keys()) for obj in objects}
+
+    schedule, report = schedule_objects(objects, min_layer_time=0)
+    groups = report['groups']
+    assert groups == [['cuboid_0'], ['cuboid_1'], ['cuboid_2']] # tall group first
+
+    group = 0
+    clearance_moves = 0
+    for _, layer in schedule:
+        for line in ''.join(layer.values()).split('\n'):
+            if 'lift over printed objects' in line:
+                group += 1
+            if 'over printed objects' in line:
+                finished = max(heights[name] for g in groups[:group] for name in g)
+                assert get_line_words(line)['Z'] > finished, line
+                clearance_moves += 1
+    assert clearance_moves == 4 # lift and travel before each of 2 groups
+
+
+def test_small_objects_are_interleaved_to_reach_min_layer_time():
+    gen = G_code_generator(PRINTING_PARAMS)
+    objects = []
+    for i in range(3):
+        layers, _ = gen.print_cuboid([[20 * i, 0], [20 * i + 3, 3]], 0.2, 1)
+        objects.append({'name': f'cuboid_{i}', 'material': 'PLA', 'layers': layers})
+    layer_times = estimate_layer_times(get_object_layers(objects[0]))
+    assert max(layer_times.values()) < 10 # layers are slowed down when printed alone
+
+    schedule, report = schedule_objects(objects, min_layer_time=10)
+    assert report['groups'] == [['cuboid_0', 'cuboid_1', 'cuboid_2']]
+    assert report['time_saved_sec'] > 0
+    assert abs(report['total_time_sec'] + report['time_saved_sec'] - report['one_by_one_time_sec']) < 0.02
+    assert [z for z, _ in schedule] == sorted(layer_times.keys())
+    for z, layer in schedule: # all objects printed at each z
+        assert layer['PLA'] == ''.join(obj['layers'][z] for obj in objects)
+
+    schedule, report = schedule_objects(objects, min_layer_time=10, allow_sequential=False)
+    assert len(report['groups']) == 1
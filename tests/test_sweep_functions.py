@@ -0,0 +1,86 @@
+import os
+import numpy as np
+from regions_functions import Regions
+from tool_changer_functions import load_params
+from travel_functions import get_line_words
+from gcode_functions import process_g_code
+from sweep_functions import get_sweep_points, get_tile_offsets, parameter_sweep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0'},
+    'temps': {'PLA': [215, 170], 'bed': 60},
+    'cooling': {'PLA': 1},
+    'prime_macro': {'PLA': 'prime'},
+    'mesh_bed': None,
+}
+
+
+def get_extrusion_points(g_code):
+    """Returns xy points of extrusion moves."""
+    points = []
+    for line in g_code.split('\n'):
+        words = get_line_words(line)
+        if line.startswith('G1 ') and words.get('E', 0) > 0 and 'X' in words and 'Y' in words:
+            points.append([words['X'], words['Y']])
+    return np.array(points)
+
+
+def get_regions():
+    regions = Regions(ref_pos=(100, 100))
+    regions.add_region('square', [0, 0], [10, 10], layer=1, z_height=None, reg_type='surface',
+                       mat='PLA', start_pos=['x0', 'y0'], infill_angle=0, perimeter=True)
+    regions.add_region('top', [2, 2], [6, 6], layer=2, z_height=None, reg_type='surface',
+                       mat='PLA', start_pos=['x0', 'y0'], infill_angle=90, perimeter=False)
+    return regions.regions
+
+
+def test_sweep_points():
+    points = get_sweep_points({'print_feedrate': [20, 30], 'TPU.cooling': [0.5]}, ['PLA', 'TPU'])
+    assert points == [
+        {'PLA': {'print_feedrate': 20}, 'TPU': {'print_feedrate': 20, 'cooling': 0.5}},
+        {'PLA': {'print_feedrate': 30}, 'TPU': {'print_feedrate': 30, 'cooling': 0.5}},
+    ]
+
+
+def test_tile_offsets():
+    offsets = get_tile_offsets(5, [30, 20])
+    assert offsets.tolist() == [[0, 0], [30, 0], [60, 0], [0, 20], [30, 20]]
+
+
+def test_parallel_sweep_of_standalone_variants(tmp_path):
+    print_params = {'PLA': load_params(os.path.join(ROOT, 'printing_params', 'PLA_default.json'))}
+    manifest = parameter_sweep(get_regions(), print_params, PRINTER_SETTINGS,
+                               {'print_feedrate': [20, 40], 'T_nozzle': [210]},
+                               output_dir=str(tmp_path), processes=2)
+
+    assert [entry['name'] for entry in manifest] == ['variant_000', 'variant_001']
+    assert manifest[0]['params'] == {'PLA': {'print_feedrate': 20, 'T_nozzle': 210}}
+    assert os.path.exists(tmp_path / 'manifest.json')
+    slow, fast = [process_g_code(entry['filepath']) for entry in manifest]
+    assert slow['print_duration_sec'] > fast['print_duration_sec'] # same paths, other feedrate
+    assert slow['all_extrusions_mm'] == fast['all_extrusions_mm']
+    assert manifest[0]['print_time_sec'] == slow['print_time_sec']
+    with open(manifest[0]['filepath']) as f:
+        assert 'G10 P0 S210' in f.read() # swept nozzle temp
+
+
+def test_tiled_sweep_of_polygon_regions(tmp_path):
+    print_params = {'PLA': load_params(os.path.join(ROOT, 'printing_params', 'PLA_default.json'))}
+    regions = Regions(ref_pos=(100, 100))
+    regions.add_polygon_region('triangle', [[0, 0], [20, 0], [10, 15]], layer=1, z_height=None,
+                               mat='PLA', infill_angle=30, perimeter=True)
+
+    manifest = parameter_sweep(regions.regions, print_params, PRINTER_SETTINGS,
+                               {'print_feedrate': [20, 30]}, output_dir=str(tmp_path),
+                               tiled=True, tile_pitch=[30, 30], processes=1)
+    with open(manifest[0]['filepath']) as f:
+        points = get_extrusion_points(f.read())
+
+    for entry in manifest: # every tile is printed at its offset
+        x0, y0 = np.array([100, 100]) + entry['offset']
+        inside = (points[:,0] > x0 - 1) & (points[:,0] < x0 + 21) \
+            & (points[:,1] > y0 - 1) & (points[:,1] < y0 + 16)
+        assert np.sum(inside) > 0, entry['offset']
+    assert manifest[1]['offset'] == [30.0, 0.0]
+    assert np.any(points[:,0] > 125) # second tile is not printed over the first
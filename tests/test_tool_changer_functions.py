@@ -0,0 +1,121 @@
+import pytest
+from gcode_generator import generator_multi
+from job_functions import assemble_job, get_job_printing_params
+from tool_changer_functions import (
+    printer_start,
+    printer_start_overlapped,
+    estimate_start_time,
+    mesh_bed_g_code,
+    pressure_advance_g_code,
+    set_pressure_advance,
+    set_firmware_retraction)
+
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0', 'TPU': 'T1'},
+    'temps': {'PLA': [215, 170], 'TPU': [230, 180], 'bed': 60},
+    'cooling': {'PLA': 1, 'TPU': 0.3},
+    'prime_macro': {'PLA': 'prime', 'TPU': 'prime'},
+    'mesh_bed': None,
+}
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+LAYERS = {
+    0.2: {'PLA': 'G1 X10 Y10 E1 ; PLA line\n', 'TPU': 'G1 X20 Y10 E1 ; TPU line\n'},
+    0.4: {'PLA': 'G1 X10 Y10 E1 ; PLA line\n', 'TPU': 'G1 X20 Y10 E1 ; TPU line\n'},
+}
+
+
+def get_line_index(g_code, prefix):
+    lines = g_code.split('\n')
+    return [i for i, line in enumerate(lines) if line.startswith(prefix)]
+
+
+def test_overlapped_start_heats_while_homing():
+    g_code = printer_start_overlapped(PRINTER_SETTINGS)
+    # same commands as printer_start, only reordered
+    assert sorted(g_code.split('\n')) == sorted(printer_start(PRINTER_SETTINGS).split('\n'))
+    bed_set, = get_line_index(g_code, 'M140')
+    bed_wait, = get_line_index(g_code, 'M190')
+    home, = get_line_index(g_code, 'G28')
+    probe, = get_line_index(g_code, 'G29')
+    assert bed_set < home < bed_wait < probe
+
+    # bed temp is awaited at the end without hot probing
+    g_code = printer_start_overlapped(PRINTER_SETTINGS, probe_hot=False)
+    bed_wait, = get_line_index(g_code, 'M190')
+    probe, = get_line_index(g_code, 'G29')
+    assert probe < bed_wait
+
+
+def test_stored_height_map_is_loaded_instead_of_probing():
+    printer_settings = dict(PRINTER_SETTINGS, mesh_bed={'X': [10, 90], 'Y': [20, 80], 'P': [4, 3],
+                                                       'load': 'heightmap.csv'})
+    g_code = mesh_bed_g_code(printer_settings)
+    assert 'M557 X10:90 Y20:80 P4:3' in g_code
+    assert 'G29 S1 P"heightmap.csv"' in g_code
+    assert 'G29 ;' not in g_code
+    g_code = printer_start_overlapped(printer_settings)
+    # nothing to probe, bed temp awaited at the end
+    assert get_line_index(g_code, 'M190')[0] > get_line_index(g_code, 'G29')[0]
+    assert estimate_start_time(printer_settings)['probing_sec'] == 0
+
+
+def test_start_time_estimate():
+    serial = estimate_start_time(PRINTER_SETTINGS, overlapped=False)
+    overlapped = estimate_start_time(PRINTER_SETTINGS)
+    assert serial['bed_heating_sec'] == (60 - 25) / 0.5
+    assert serial['tool_heating_sec'] == (230 - 25) / 2.0
+    assert serial['probing_sec'] == 9 * 3.0
+    assert serial['start_time_sec'] == 70 + 20 + 27 # tools heat while waiting for bed
+    assert overlapped['start_time_sec'] == 102.5 # first tool is the slowest
+    assert overlapped['start_time_sec'] < serial['start_time_sec']
+    cold_probe = estimate_start_time(PRINTER_SETTINGS, probe_hot=False, tool_heating_rate=10)
+    assert cold_probe['start_time_sec'] == 70 # homing and probing while heating the bed
+
+
+def test_pressure_advance_of_materials_in_job():
+    printing_params = {'PLA': {'pressure_advance': 0.05}, 'TPU': {}}
+    printer_settings = set_pressure_advance(PRINTER_SETTINGS, printing_params)
+    assert printer_settings['pressure_advance'] == {'PLA': 0.05}
+    assert 'pressure_advance' not in PRINTER_SETTINGS
+    assert pressure_advance_g_code('PLA', printer_settings) == 'M572 D0 S0.0500 ; set pressure advance\n'
+    assert pressure_advance_g_code('TPU', printer_settings) == ''
+
+    g_code = assemble_job(LAYERS, PRINTER_SETTINGS, printing_params=printing_params)
+    # set at the load of PLA and again at every change back to PLA
+    pla_lines = get_line_index(g_code, 'G1 X10 Y10 E1 ; PLA line')
+    advance_lines = get_line_index(g_code, 'M572')
+    assert len(advance_lines) == len(pla_lines) == 2
+    assert all(line == 'M572 D0 S0.0500 ; set pressure advance'
+               for line in g_code.split('\n') if line.startswith('M572'))
+    assert all(advance < pla for advance, pla in zip(advance_lines, pla_lines))
+    assert 'M572' not in assemble_job(LAYERS, PRINTER_SETTINGS)
+
+
+def test_firmware_retraction_in_job():
+    gen = generator_multi({'PLA': dict(PRINTING_PARAMS, firmware_retraction=True),
+                           'TPU': PRINTING_PARAMS})
+    printer_settings = set_firmware_retraction(PRINTER_SETTINGS, get_job_printing_params(gen))
+    assert printer_settings['firmware_retraction'] == {'PLA': [0.8, 20]}
+
+    layers = {}
+    for material, surface in [('PLA', [[0, 0], [10, 10]]), ('TPU', [[20, 0], [30, 10]])]:
+        g_code_dict, _ = getattr(gen, material).print_cuboid(surface, 0.2, 0.4, perimeter=True)
+        for z, g_code in g_code_dict.items():
+            layers.setdefault(z, {})[material] = g_code
+    pla_layer = layers[0.2]['PLA']
+    assert 'G10 ; retract' in pla_layer and 'G11 ; unretract' in pla_layer
+    assert '; retract' not in pla_layer.replace('G10 ; retract', '')
+    assert 'wipe' not in pla_layer
+    assert 'G10 ;' not in layers[0.2]['TPU'] and 'G11 ;' not in layers[0.2]['TPU']
+
+    g_code = assemble_job(layers, PRINTER_SETTINGS, printing_params=gen)
+    assert g_code.count('M207 S0.8 F1200 T1200 Z0 ; set firmware retraction') == 2 # load and change to PLA
+
+    # firmware retraction without its params would retract with the printer defaults
+    with pytest.raises(Exception):
+        assemble_job(layers, PRINTER_SETTINGS)
@@ -0,0 +1,169 @@
+from decimal import Decimal
+import numpy as np
+import pytest
+from gcode_generator import G_code_generator
+from gcode_functions import process_g_code_lines
+from gcode_reader import G_code_reader
+from job_functions import assemble_job
+from toolpath_functions import (
+    parse_moves,
+    get_moves_limits,
+    get_affine_matrix,
+    get_grid_transforms,
+    get_travel_order,
+    replicate_layers,
+    simplify_paths,
+    reparameterize_moves,
+    reparameterize_file)
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+PRINTER_SETTINGS = {
+    'tools': {'PLA': 'T0'},
+    'temps': {'PLA': [215, 170], 'bed': 60},
+    'cooling': {'PLA': 1},
+    'prime_macro': {'PLA': 'prime'},
+    'mesh_bed': None,
+}
+
+
+def get_layers(gen):
+    cuboid, _ = gen.print_cuboid([[10, 10], [20, 15]], 0.2, 0.6)
+    return {z: {'PLA': g_code} for z, g_code in cuboid.items()}
+
+
+def get_extrusion(g_code):
+    return process_g_code_lines(g_code.split('\n'))['all_extrusions_mm']
+
+
+def get_total_e(g_code):
+    """Returns exact sum of E words."""
+    return sum(Decimal(w[1:]) for line in g_code.split('\n') for w in line.split(';')[0].split() if w[0] == 'E')
+
+
+def test_affine_matrix():
+    rotate = get_affine_matrix(rotate=90, center=(5, 5))
+    assert np.allclose(rotate @ [10, 5, 1], [5, 10, 1])
+    mirror = get_affine_matrix(translate=(1, 0), mirror='x', center=(5, 5))
+    assert np.allclose(mirror @ [10, 7, 1], [1, 7, 1])
+    with pytest.raises(Exception):
+        get_affine_matrix(rotate=45)
+
+
+def test_travel_order_is_serpentine():
+    centers = [[0, 0], [10, 0], [20, 0], [0, 10], [10, 10], [20, 10]]
+    assert get_travel_order(centers).tolist() == [0, 1, 2, 5, 4, 3]
+
+
+def test_replicate_layers():
+    gen = G_code_generator(PRINTING_PARAMS)
+    layers = get_layers(gen)
+    transforms = get_grid_transforms(2, 2, [20, 10])
+    replicated = replicate_layers(layers, transforms)
+
+    assert list(replicated.keys()) == list(layers.keys())
+    for z in layers:
+        assert np.isclose(get_extrusion(replicated[z]['PLA']), 4 * get_extrusion(layers[z]['PLA']), rtol=1e-3)
+    limits = get_moves_limits(parse_moves(replicated[0.2]['PLA']))
+    original = get_moves_limits(parse_moves(layers[0.2]['PLA']))
+    assert np.isclose(limits['x_max'], original['x_max'] + 20)
+    assert np.isclose(limits['y_max'], original['y_max'] + 10)
+
+    rotated = replicate_layers(layers, [{'translate': (0, 0), 'rotate': 90, 'mirror': None}])
+    limits = get_moves_limits(parse_moves(rotated[0.2]['PLA']))
+    assert np.isclose(limits['x_max'] - limits['x_min'], original['y_max'] - original['y_min'])
+
+    with pytest.raises(Exception):
+        replicate_layers(layers, transforms, bed_limits={'x_min': 0, 'x_max': 30, 'y_min': 0, 'y_max': 30})
+
+
+def test_simplify_paths_keeps_extrusion_and_corners():
+    lines = ['G0 X0.000 Y0.000 Z0.200 F6000']
+    for i in range(1, 11): # collinear segments with the same extrusion per mm
+        lines.append(f'G1 X{i:.3f} Y0.000 E0.03326 F1800')
+    lines.append('G1 X10.020 Y0.010 E0.00066 F1800') # micro segment
+    for i in range(1, 6): # corner
+        lines.append(f'G1 X10.020 Y{i:.3f} E0.03326 F1800')
+    g_code = '\n'.join(lines)
+
+    simplified, report = simplify_paths(g_code)
+    assert simplified.split('\n') == [
+        'G0 X0.000 Y0.000 Z0.200 F6000',
+        'G1 X10.000 Y0.000 E0.33260 F1800', # collinear segments
+        'G1 X10.020 Y1.000 E0.03392 F1800', # micro segment merged into the next one
+        'G1 X10.020 Y5.000 E0.13304 F1800',
+    ]
+    assert report['removed_lines'] == 13
+    assert get_total_e(simplified) == get_total_e(g_code)
+
+
+def test_simplify_paths_of_generated_polygon():
+    gen = G_code_generator(PRINTING_PARAMS)
+    angles = np.linspace(0, 2*np.pi, 400, endpoint=False)
+    circle = 10 * np.column_stack([np.cos(angles), np.sin(angles)]) + 50
+    g_code = gen.print_polygon(circle, 0.2, perimeter=True)
+
+    simplified, report = simplify_paths(g_code, min_length=0.2)
+    assert report['merged_micro'] > 0
+    assert get_total_e(simplified) == get_total_e(g_code)
+    assert np.isclose(process_g_code_lines(simplified.split('\n'))['print_duration_sec'],
+                      process_g_code_lines(g_code.split('\n'))['print_duration_sec'], rtol=0.02)
+
+
+def test_reparameterize_moves():
+    gen = G_code_generator(PRINTING_PARAMS)
+    g_code = get_layers(gen)[0.2]['PLA']
+    new_g_code, report = reparameterize_moves(g_code, [{'extrude_factor': 1.1, 'speed_factor': 0.5}])
+    moves, new_moves = parse_moves(g_code), parse_moves(new_g_code)
+    printing = moves['is_move'] & (np.nan_to_num(moves['e']) > 0) & ~np.isnan(moves['x'])
+    assert report['rewritten_lines'] == np.sum(printing)
+    assert np.allclose(new_moves['e'][printing], 1.1 * moves['e'][printing], atol=1e-5)
+    assert np.allclose(new_moves['f'][printing], 0.5 * moves['f'][printing], atol=0.5)
+    # retracts, unretracts and travels are not changed
+    assert all(new == old for new, old, p in zip(new_g_code.split('\n'), g_code.split('\n'), printing) if not p)
+    assert np.isclose(report['extrusion_mm_after'] - report['extrusion_mm_before'],
+                      0.1 * np.sum(moves['e'][printing]))
+
+
+def get_print_e(g_code):
+    """Returns sum of E of extrusion moves (without unretracts)."""
+    moves = parse_moves(g_code)
+    return np.sum(moves['e'][(np.nan_to_num(moves['e']) > 0) & ~np.isnan(moves['x'])])
+
+
+def get_layer_bytes(reader):
+    return [bytes(reader.mm[start:end]) for start, end in zip(reader.index['layer_start'], reader.index['layer_end'])]
+
+
+def test_reparameterize_file_keeps_unselected_layers(tmp_path):
+    gen = G_code_generator(PRINTING_PARAMS)
+    cuboid, _ = gen.print_cuboid([[10, 10], [20, 15]], 0.2, 1.2)
+    filepath = tmp_path / 'job.gcode'
+    filepath.write_text(assemble_job({z: {'PLA': g_code} for z, g_code in cuboid.items()}, PRINTER_SETTINGS))
+
+    rules = [{'z_min': 0.6, 'z_max': 0.8, 'extrude_factor': 1.2}]
+    with G_code_reader(str(filepath)) as reader:
+        report = reparameterize_file(reader, str(tmp_path / 'new.gcode'), rules)
+        old_layers = get_layer_bytes(reader)
+        layers_z = reader.layers_z.copy()
+    assert report['rewritten_layers'] == 2
+    assert np.isclose(report['extrusion_mm_after'], 1.2 * report['extrusion_mm_before'], rtol=1e-4)
+
+    with G_code_reader(str(tmp_path / 'new.gcode')) as reader:
+        assert np.array_equal(reader.layers_z, layers_z)
+        new_layers = get_layer_bytes(reader)
+    for z, old, new in zip(layers_z, old_layers, new_layers):
+        if 0.6 - 1e-6 <= z <= 0.8 + 1e-6:
+            assert old != new
+            assert np.isclose(get_print_e(new.decode()), 1.2 * get_print_e(old.decode()), rtol=1e-4)
+        else:
+            assert old == new # copied as bytes
+
+    # without rules the file is copied
+    with G_code_reader(str(filepath)) as reader:
+        reparameterize_file(reader, str(tmp_path / 'copy.gcode'))
+    assert (tmp_path / 'copy.gcode').read_bytes() == filepath.read_bytes()
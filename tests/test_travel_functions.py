@@ -0,0 +1,49 @@
+import numpy as np
+from gcode_generator import G_code_generator
+from travel_functions import get_line_words, points_to_segments_distance, plan_travels
+
+PRINTING_PARAMS = {
+    'd_nozzle': 0.4, 'd_filament': 1.75, 'layer_height': 0.2,
+    'trace_width': 0.42, 'trace_spacing': 0.4, 'extrude_factor': 1,
+    'move_feedrate': 500, 'print_feedrate': 30, 'nozzle_lift': 0.2,
+    'retract_len': 0.8, 'retract_feedrate': 20, 'wipe_len': 2, 'wipe_feedrate': 30,
+}
+
+
+def get_extrusions(g_code):
+    """Returns net extrusion and extrusion of moves with xy motion."""
+    net, printed = 0, 0
+    x = y = None
+    for line in g_code.split('\n'):
+        if line[:3] not in ['G0 ', 'G1 ']:
+            continue
+        words = get_line_words(line)
+        e = words.get('E', 0)
+        net += e
+        if (words.get('X', x), words.get('Y', y)) != (x, y) and e > 0:
+            printed += e
+        x, y = words.get('X', x), words.get('Y', y)
+    return net, printed
+
+
+def test_points_to_segments_distance():
+    segments = np.array([[[0, 0], [10, 0]], [[0, 5], [0, 10]]])
+    points = np.array([[5, 2], [-3, 0], [1, 8], [0, 3]])
+    assert np.allclose(points_to_segments_distance(points, segments), [2, 3, 1, 2])
+
+
+def test_plan_travels_keeps_extrusion():
+    gen = G_code_generator(PRINTING_PARAMS)
+    g_code = gen.print_surface([[0, 0], [20, 20]], 0.2, perimeter=True)
+    g_code += gen.print_surface([[20.5, 0], [30, 20]], 0.2, infill_angle=90) # adjacent region
+
+    planned, report = plan_travels(g_code)
+    assert report['elided_travels'] >= 1 # perimeter to infill
+    assert report['time_saved_sec'] > 0
+    assert planned.count('; retract') == g_code.count('; retract') - report['elided_travels']
+    before, after = get_extrusions(g_code), get_extrusions(planned)
+    assert np.allclose(before, after)
+
+    far, report = plan_travels(g_code, max_travel=0.1)
+    assert report['elided_travels'] == 0
+    assert far == g_code
@@ -24,24 +24,44 @@ def load_params(filepath):
         params_dict = json.loads(f.read())
     return params_dict
 
-def printer_start(printer_settings):
-    """
-    Generates start g-code.
-    Params:
-    tools       ... list of needed tool names: ['T1', 'T2', ...]
-    temps       ... dict of temps for every tool and bed: {'T1': [nozzle_temp, idle_temp], 'bed': 60, ...}
-    mesh_bed    ... dict of locations and number of points {'X': [xmin, xmax], ..., 'P': 3}
-    """
-    
-    g_code = '; --- Printer start g-code - start\n'
-    
-    #g_code += 'M42 P7 S255 ; lights on\n'
-    #g_code += 'M42 P100 S1 ; stepper fans on\n\n'
-    
+def get_mesh_bed(printer_settings):
+    """Returns mesh bed of printer settings (default mesh if not defined)."""
+    if printer_settings['mesh_bed'] == None:
+        mesh_bed = {
+            'X': [100, 200],
+            'Y': [50, 150],
+            'P': 3
+        }
+    else:
+        mesh_bed = printer_settings['mesh_bed']
+    return mesh_bed
+
+
+def mesh_bed_g_code(printer_settings):
+    """Generates g-code for mesh bed definition and probing (or loading of a stored map)."""
+    mesh_bed = get_mesh_bed(printer_settings)
+    x_mesh = mesh_bed['X']
+    y_mesh = mesh_bed['Y']
+    p_mesh = mesh_bed['P']
+    if isinstance(p_mesh, (list, tuple)):
+        p_mesh = f'{p_mesh[0]}:{p_mesh[1]}'
+    g_code = f'M557 X{x_mesh[0]}:{x_mesh[1]} Y{y_mesh[0]}:{y_mesh[1]} P{p_mesh} ; mesh bed leveling\n'
+    if mesh_bed.get('load') is not None:
+        g_code += f'G29 S1 P"{mesh_bed["load"]}" ; load stored height map and activate bed compensation\n'
+    else:
+        g_code += 'G29 ; probe the bed, save the height map, and activate bed compensation\n'
+        if mesh_bed.get('save') is not None:
+            g_code += f'G29 S3 P"{mesh_bed["save"]}" ; save height map\n'
+    return g_code
+
+
+def tools_start_g_code(printer_settings):
+    """Generates g-code for activation of tools and setting of tool temps."""
     tools_dict = printer_settings['tools']
     temps_dict = printer_settings['temps']
     
     # activating tools
+    g_code = ''
     for tool_key in tools_dict.values():
         g_code += f'{tool_key} P0 ; activating tool {tool_key}\n'
     g_code += f'T-1 P0 ; clear tool selection\n'
@@ -55,6 +75,31 @@ def printer_start(printer_settings):
         g_code += f'G10 P{tool_num} R{temp2} ; set tool {tool_num} idle temp\n'
     #all_temps = [temp for tool_temps in temps.values() for temp in tool_temps]
     g_code += f'M302 S120 ; set cold extrusion limit\n'
+    return g_code
+
+
+def printer_start(printer_settings):
+    """
+    Generates start g-code.
+    Params:
+    tools       ... list of needed tool names: ['T1', 'T2', ...]
+    temps       ... dict of temps for every tool and bed: {'T1': [nozzle_temp, idle_temp], 'bed': 60, ...}
+    mesh_bed    ... dict of locations and number of points {'X': [xmin, xmax], ..., 'P': 3}
+                    ('P': [px, py] for number of points in each direction),
+                    optional 'load': name of stored height map to load instead of probing,
+                    optional 'save': name of file for the probed height map
+                    (see get_adaptive_mesh_bed)
+    """
+    
+    g_code = '; --- Printer start g-code - start\n'
+    
+    #g_code += 'M42 P7 S255 ; lights on\n'
+    #g_code += 'M42 P100 S1 ; stepper fans on\n\n'
+    
+    temps_dict = printer_settings['temps']
+    
+    # activating tools and setting temps
+    g_code += tools_start_g_code(printer_settings)
     
     # print bed temp
     bed_temp = temps_dict['bed']
@@ -62,35 +107,173 @@ def printer_start(printer_settings):
     g_code += f'M190 S{bed_temp} ; wait for bed temp\n'
     g_code += '\n'
     
-    if printer_settings['mesh_bed'] == None:
-        mesh_bed = {
-            'X': [100, 200],
-            'Y': [50, 150],
-            'P': 3
-        }
-    else:
-        mesh_bed = printer_settings['mesh_bed']
-    
     # homing and mesh bed leveling
     g_code += 'T-1 ; clear tool selection\n'
     g_code += f'G28 ; home all\n'
-    x_mesh = mesh_bed['X']
-    y_mesh = mesh_bed['Y']
-    p_mesh = mesh_bed['P']
-    g_code += f'M557 X{x_mesh[0]}:{x_mesh[1]} Y{y_mesh[0]}:{y_mesh[1]} P{p_mesh} ; mesh bed leveling\n'
-    g_code += 'G29 ; probe the bed, save the height map, and activate bed compensation\n'
+    g_code += mesh_bed_g_code(printer_settings)
+    
+    # other
+    g_code += 'G21 ; set units to millimeters\n'
+    g_code += 'G90 ; use absolute coordinates\n'
+    g_code += 'M83 ; use relative distances for extrusion\n'
+    g_code += 'T-1 ; clear tool selection\n'
+    
+    g_code += '; --- Printer start g-code - end\n\n'
+    
+    return g_code
+
+
+def printer_start_overlapped(printer_settings, probe_hot=True):
+    """
+    Generates start g-code with overlapped heating, homing and probing (see printer_start).
+    Tool and bed heaters are switched on first, the printer homes (and probes) while
+    heating. The bed temp is awaited only before probing (probe_hot, the bed is probed
+    at printing temp) or at the end of the start sequence. Tool temps are awaited
+    at the first tool load (M116 in load_tool).
+    Params:
+    printer_settings    ... see printer_start
+    probe_hot           ... bool: waits for bed temp before probing (not needed with stored height map)
+    """
+    g_code = '; --- Printer start g-code - start\n'
+    
+    # activating tools and setting temps
+    g_code += tools_start_g_code(printer_settings)
+    
+    # print bed temp
+    bed_temp = printer_settings['temps']['bed']
+    g_code += f'M140 S{bed_temp} ; set bed temp\n'
+    g_code += '\n'
+    
+    # homing and mesh bed leveling while heating
+    g_code += 'T-1 ; clear tool selection\n'
+    g_code += f'G28 ; home all\n'
+    wait_before_probing = probe_hot and get_mesh_bed(printer_settings).get('load') is None
+    if wait_before_probing:
+        g_code += f'M190 S{bed_temp} ; wait for bed temp\n'
+    g_code += mesh_bed_g_code(printer_settings)
     
     # other
     g_code += 'G21 ; set units to millimeters\n'
     g_code += 'G90 ; use absolute coordinates\n'
     g_code += 'M83 ; use relative distances for extrusion\n'
     g_code += 'T-1 ; clear tool selection\n'
+    if not wait_before_probing:
+        g_code += f'M190 S{bed_temp} ; wait for bed temp\n'
     
     g_code += '; --- Printer start g-code - end\n\n'
     
     return g_code
 
 
+def estimate_start_time(printer_settings, overlapped=True, probe_hot=True, ambient_temp=25,
+                        bed_heating_rate=0.5, tool_heating_rate=2.0, home_time=20, probe_point_time=3.0):
+    """Estimates time of the start sequence until the first extrusion (incl. first tool at
+    active temp) for printer_start (overlapped=False) or printer_start_overlapped.
+
+    Args:
+        printer_settings (dict): see printer_start
+        overlapped (bool, optional): printer_start_overlapped. Defaults to True.
+        probe_hot (bool, optional): see printer_start_overlapped. Defaults to True.
+        ambient_temp (float, optional): start temp of heaters in deg C. Defaults to 25.
+        bed_heating_rate (float, optional): bed heating rate in deg C/sec. Defaults to 0.5.
+        tool_heating_rate (float, optional): tool heating rate in deg C/sec. Defaults to 2.0.
+        home_time (float, optional): time of homing in sec. Defaults to 20.
+        probe_point_time (float, optional): time of probing one point in sec. Defaults to 3.0.
+
+    Returns:
+        dict: 'bed_heating_sec', 'tool_heating_sec', 'homing_sec', 'probing_sec', 'start_time_sec'
+    """
+    mesh_bed = get_mesh_bed(printer_settings)
+    p_mesh = mesh_bed['P'] if isinstance(mesh_bed['P'], (list, tuple)) else [mesh_bed['P']] * 2
+    probing = 0 if mesh_bed.get('load') is not None else p_mesh[0] * p_mesh[1] * probe_point_time
+    bed_heating = max(printer_settings['temps']['bed'] - ambient_temp, 0) / bed_heating_rate
+    tool_heating = max(max(temps[0] for material, temps in printer_settings['temps'].items()
+                           if material != 'bed') - ambient_temp, 0) / tool_heating_rate
+
+    if not overlapped: # tools heat while waiting for bed
+        start_time = max(bed_heating + home_time + probing, tool_heating)
+    elif probe_hot and probing > 0:
+        start_time = max(max(bed_heating, home_time) + probing, tool_heating)
+    else:
+        start_time = max(bed_heating, home_time + probing, tool_heating)
+
+    return {
+        'bed_heating_sec': round(bed_heating, 2),
+        'tool_heating_sec': round(tool_heating, 2),
+        'homing_sec': home_time,
+        'probing_sec': round(probing, 2),
+        'start_time_sec': round(start_time, 2),
+    }
+
+
+def pressure_advance_g_code(material, printer_settings):
+    """
+    Generates g-code for pressure advance (K-factor) of the material's tool
+    (extruder drive number = tool number). Empty if pressure advance of the material
+    is not defined in printer_settings['pressure_advance'].
+    """
+    k = printer_settings.get('pressure_advance', {}).get(material)
+    if k is None:
+        return ''
+    tool = printer_settings['tools'][material]
+    return f'M572 D{tool[-1]} S{k:.4f} ; set pressure advance\n'
+
+
+def set_pressure_advance(printer_settings, printing_params):
+    """Returns copy of printer settings with pressure advance of materials
+    from printing params ('pressure_advance' in sec), used in job assembly
+    (see assemble_job printing_params).
+
+    Args:
+        printer_settings (dict): printer settings
+        printing_params (dict): {material: printing params}
+
+    Returns:
+        dict: printer settings with 'pressure_advance': {material: K}
+    """
+    printer_settings = dict(printer_settings)
+    pressure_advance = dict(printer_settings.get('pressure_advance', {}))
+    for material, params in printing_params.items():
+        if params.get('pressure_advance') is not None:
+            pressure_advance[material] = params['pressure_advance']
+    printer_settings['pressure_advance'] = pressure_advance
+    return printer_settings
+
+
+def firmware_retraction_g_code(material, printer_settings):
+    """
+    Generates g-code for firmware retraction params (G10/G11) of the material's tool.
+    Z hop is disabled, nozzle lift is part of the generated paths.
+    Empty if firmware retraction of the material is not defined in
+    printer_settings['firmware_retraction'].
+    """
+    retraction = printer_settings.get('firmware_retraction', {}).get(material)
+    if retraction is None:
+        return ''
+    retract_len, retract_feedrate = retraction
+    return f'M207 S{retract_len} F{retract_feedrate * 60:.0f} T{retract_feedrate * 60:.0f} Z0 ; set firmware retraction\n'
+
+
+def set_firmware_retraction(printer_settings, printing_params):
+    """Returns copy of printer settings with firmware retraction params of materials
+    printed with firmware retraction (printing param 'firmware_retraction': True).
+
+    Args:
+        printer_settings (dict): printer settings
+        printing_params (dict): {material: printing params}
+
+    Returns:
+        dict: printer settings with 'firmware_retraction': {material: [retract_len, retract_feedrate]}
+    """
+    printer_settings = dict(printer_settings)
+    firmware_retraction = dict(printer_settings.get('firmware_retraction', {}))
+    for material, params in printing_params.items():
+        if params.get('firmware_retraction', False):
+            firmware_retraction[material] = [params['retract_len'], params['retract_feedrate']]
+    printer_settings['firmware_retraction'] = firmware_retraction
+    return printer_settings
+
+
 def load_tool(material, printer_settings, tool_fans=None):
     """
     Generates g-code for first tool load.
@@ -98,8 +281,8 @@ def load_tool(material, printer_settings, tool_fans=None):
     tool ... tool name: 'T0'
     cooling ... dict: {'T1': 0.0 ... 1.0, ...}
     prime_macro ... dict: {'T1': 'macro_name', ...}
-    
-    TODO: K_factor
+    pressure_advance ... optional dict: {material: K in sec} (see pressure_advance_g_code)
+    firmware_retraction ... optional dict: {material: [retract_len in mm, retract_feedrate in mm/s]}
     """
     
     if tool_fans == None:
@@ -120,6 +303,8 @@ def load_tool(material, printer_settings, tool_fans=None):
     g_code = f'; --- Tool load: {str(tool)} : {material} - start\n'
     g_code += 'T-1 ; clear tool selection\n'
     g_code += f'{tool} ; load tool\n'
+    g_code += pressure_advance_g_code(material, printer_settings)
+    g_code += firmware_retraction_g_code(material, printer_settings)
     g_code += f'M116 P{tool[-1]} ; wait for extruder to reach temp.\n'
     g_code += f'M106 {fan} S{cooling} ; turn on PCF for mounted tool\n'
     g_code += f'M98 P"{prime_macro}.g" ; prime extruder\n'
@@ -151,13 +336,17 @@ def unload_tool(material, printer_settings, tool_fans=None):
     return g_code
     
 
-def tool_change(current_material, next_material, printer_settings, tool_fans=None, beep=True):
+def tool_change(current_material, next_material, printer_settings, tool_fans=None, beep=True,
+                photo=False):
     """
     Generates g-code for first tool load.
     Params:
     tool ... tool name: 'T0'
     cooling ... dict: {'T1': 0.0 ... 1.0, ...}
     prime_macro ... dict: {'T1': 'macro_name', ...}
+    pressure_advance ... optional dict: {material: K in sec} (see pressure_advance_g_code)
+    firmware_retraction ... optional dict: {material: [retract_len in mm, retract_feedrate in mm/s]}
+    photo ... bool: takes layer cam photo while no tool is loaded (see take_photo)
     """
     
     if tool_fans == None:
@@ -185,7 +374,11 @@ def tool_change(current_material, next_material, printer_settings, tool_fans=Non
         g_code += play_sound(intensity=1)
     g_code += 'T-1 ; unload current tool\n'
     g_code += f'M106 {current_fan} S0 ; turn off fan for current tool\n'
+    if photo:
+        g_code += take_photo(None, None, printer_settings, tool_fans=tool_fans, beep=beep)
     g_code += f'{next_tool} ; load next tool\n'
+    g_code += pressure_advance_g_code(next_material, printer_settings)
+    g_code += firmware_retraction_g_code(next_material, printer_settings)
     g_code += f'M116 P{next_tool[-1]} ; wait for extruder to reach temp.\n'
     g_code += f'M106 {next_fan} S{cooling} ; turn on PCF for mounted tool\n'
     g_code += f'M98 P"{prime_macro}.g" ; prime extruder\n'
@@ -0,0 +1,634 @@
+import re
+from decimal import Decimal
+import numpy as np
+from gcode_functions import get_print_limits, get_section_name, get_layers_z
+
+_WORD = re.compile(r'(?<![^\s])([XYZEF])(-?\d*\.?\d+)')
+_TOOL_TEMP = r'^G10 P(\d+) ([SR])(-?\d*\.?\d+)'
+
+
+def parse_moves(lines):
+    """Parses g_code lines into move arrays (one element for each line).
+
+    Args:
+        lines (list): list of g_code lines (or g_code string with \n line split)
+
+    Returns:
+        moves (dict): includes keys:
+                        'lines' (list of lines without \n)
+                        'is_move' (bool array, True for G0/G1 lines)
+                        'x', 'y', 'z', 'e', 'f' (float arrays, NaN if word is not defined)
+    """
+    if isinstance(lines, str):
+        lines = lines.split('\n')
+    lines = [l.rstrip('\n') for l in lines]
+
+    n = len(lines)
+    is_move = np.zeros(n, dtype=bool)
+    values = np.full((n, 5), np.nan)
+    columns = {'X': 0, 'Y': 1, 'Z': 2, 'E': 3, 'F': 4}
+
+    for i, line in enumerate(lines):
+        if line[:3] not in ['G0 ', 'G1 ']: # only moving and printing lines
+            continue
+        is_move[i] = True
+        code = line.split(';', 1)[0]
+        for key, value in _WORD.findall(code):
+            values[i, columns[key]] = float(value)
+
+    moves = {
+        'lines': lines,
+        'is_move': is_move,
+        'x': values[:,0],
+        'y': values[:,1],
+        'z': values[:,2],
+        'e': values[:,3],
+        'f': values[:,4],
+    }
+    return moves
+
+
+def fill_modal(values):
+    """Fills NaN values with previous defined value (modal g_code words).
+
+    Args:
+        values (numpy array): 1D float array
+
+    Returns:
+        numpy array: filled values (NaN before first defined value)
+    """
+    index = np.where(np.isnan(values), 0, np.arange(len(values)))
+    index = np.maximum.accumulate(index)
+    return values[index]
+
+
+def get_moves_limits(moves):
+    """Returns the limiting xy coordinates of extrusion moves.
+
+    Args:
+        moves (dict): see parse_moves
+
+    Returns:
+        dict: dict of x_min, x_max, y_min, y_max
+    """
+    x = fill_modal(moves['x'])
+    y = fill_modal(moves['y'])
+    extruding = moves['is_move'] & (np.nan_to_num(moves['e']) > 0) & ~np.isnan(moves['x'] + moves['y'])
+    return {
+        'x_min': np.min(x[extruding]),
+        'x_max': np.max(x[extruding]),
+        'y_min': np.min(y[extruding]),
+        'y_max': np.max(y[extruding]),
+    }
+
+
+def get_affine_matrix(translate=(0, 0), rotate=0, mirror=None, center=(0, 0)):
+    """Returns 3x3 affine matrix for xy coordinates: mirror and rotation around center,
+    followed by translation.
+
+    Args:
+        translate (list, optional): [dx, dy] in mm. Defaults to (0, 0).
+        rotate (int, optional): rotation in deg, multiple of 90. Defaults to 0.
+        mirror (string, optional): None, 'x' (x -> -x) or 'y' (y -> -y). Defaults to None.
+        center (list, optional): center of rotation and mirroring. Defaults to (0, 0).
+
+    Returns:
+        numpy array: shape (3, 3)
+    """
+    if rotate % 90 != 0:
+        raise Exception(f'{rotate} deg rotation is not a multiple of 90 deg.')
+    k = (rotate // 90) % 4
+    cos = [1, 0, -1, 0][k] # exact values
+    sin = [0, 1, 0, -1][k]
+    R = np.array([[cos, -sin], [sin, cos]], dtype=float)
+    if mirror == 'x':
+        R = R @ np.diag([-1., 1.])
+    elif mirror == 'y':
+        R = R @ np.diag([1., -1.])
+    elif mirror is not None:
+        raise Exception(f'{mirror} is an unknown mirror axis.')
+
+    center = np.asarray(center, dtype=float)
+    matrix = np.eye(3)
+    matrix[:2,:2] = R
+    matrix[:2,2] = center - R @ center + np.asarray(translate, dtype=float)
+    return matrix
+
+
+def get_grid_transforms(n_x, n_y, pitch, rotate=0, mirror=None):
+    """Returns transforms for a grid of copies.
+
+    Args:
+        n_x (int): number of copies in x direction
+        n_y (int): number of copies in y direction
+        pitch (list): [dx, dy] distance between copies in mm
+        rotate (int, optional): rotation of all copies in deg. Defaults to 0.
+        mirror (string, optional): mirror of all copies. Defaults to None.
+
+    Returns:
+        list: list of dicts with keys 'translate', 'rotate', 'mirror'
+    """
+    transforms = []
+    for j in range(n_y):
+        for i in range(n_x):
+            transforms.append({
+                'translate': (i * pitch[0], j * pitch[1]),
+                'rotate': rotate,
+                'mirror': mirror,
+            })
+    return transforms
+
+
+def get_travel_order(centers):
+    """Orders copies in a serpentine path (row by row, alternating x direction).
+
+    Args:
+        centers (numpy array): shape (K, 2) centers of copies
+
+    Returns:
+        numpy array: indices of copies in printing order
+    """
+    centers = np.round(np.asarray(centers), 3)
+    rows = np.unique(centers[:,1], return_inverse=True)[1]
+    x_sorting = np.where(rows % 2 == 0, centers[:,0], -centers[:,0])
+    return np.lexsort((x_sorting, rows))
+
+
+def transform_moves(moves, matrices):
+    """Transforms xy coordinates of moves for all matrices at once (vectorized).
+    Lines with X or Y word get both X and Y words (needed for rotations).
+
+    Args:
+        moves (dict): see parse_moves
+        matrices (numpy array): shape (K, 3, 3)
+
+    Returns:
+        list: K lists of g_code lines
+    """
+    has_xy = moves['is_move'] & ~(np.isnan(moves['x']) & np.isnan(moves['y']))
+    x = fill_modal(moves['x'])
+    y = fill_modal(moves['y'])
+    xy = np.column_stack([x, y, np.ones(len(x))])
+    xy_new = np.einsum('kij,nj->kni', np.asarray(matrices)[:,:2,:], xy) # shape (K, N, 2)
+
+    # templates - xy words replaced with a placeholder
+    templates = []
+    for line, xy_line in zip(moves['lines'], has_xy):
+        if not xy_line:
+            templates.append(None)
+            continue
+        code, sep, comment = line.partition(';')
+        words = [w for w in code.split() if w[0] not in 'XY']
+        words.insert(1, '{}')
+        templates.append(' '.join(words) + (' ' + sep + comment if sep else ''))
+
+    copies = []
+    for k in range(len(matrices)):
+        copy_lines = []
+        for i, template in enumerate(templates):
+            if template is None:
+                copy_lines.append(moves['lines'][i])
+            else:
+                copy_lines.append(template.replace('{}', f'X{xy_new[k,i,0]:.3f} Y{xy_new[k,i,1]:.3f}', 1))
+        copies.append(copy_lines)
+    return copies
+
+
+def replicate_layers(layers, transforms, bed_limits=None, regions=None):
+    """Replicates a generated job (layers) with affine transforms (translate,
+    rotate by multiples of 90 deg, mirror) in one vectorized pass.
+    Rotation and mirroring are around the center of the job.
+    Copies of the same material are printed together in every layer (no additional
+    tool changes) in serpentine order, reversed in every other layer (short travels).
+
+    Args:
+        layers (dict): {z: {material: g_code}} (see generate_layers)
+        transforms (list): list of dicts with keys 'translate', 'rotate', 'mirror'
+                           (see get_grid_transforms)
+        bed_limits (dict, optional): x_min, x_max, y_min, y_max of the bed, checked for
+                                     all copies. Defaults to None (no check).
+        regions (dict, optional): regions of the job for get_print_limits.
+                                  Defaults to None (limits from extrusion moves).
+
+    Returns:
+        layers (dict): {z: {material: g_code}} of all copies
+    """
+    # all layer chunks parsed at once
+    keys = [(z, material) for z, layer in layers.items() for material in layer.keys()]
+    chunks = [layers[z][material].split('\n') for z, material in keys]
+    moves = parse_moves([line for chunk in chunks for line in chunk])
+
+    if regions is not None:
+        limits = get_print_limits(regions)
+    else:
+        limits = get_moves_limits(moves)
+    center = [(limits['x_min'] + limits['x_max']) / 2, (limits['y_min'] + limits['y_max']) / 2]
+    corners = np.array([[limits['x_min'], limits['y_min'], 1],
+                        [limits['x_max'], limits['y_min'], 1],
+                        [limits['x_max'], limits['y_max'], 1],
+                        [limits['x_min'], limits['y_max'], 1]])
+
+    matrices = np.array([get_affine_matrix(center=center, **t) for t in transforms])
+
+    # bed bounds
+    if bed_limits is not None:
+        corners_new = np.einsum('kij,nj->kni', matrices[:,:2,:], corners)
+        outside = (corners_new[:,:,0] < bed_limits['x_min']) | (corners_new[:,:,0] > bed_limits['x_max']) \
+                | (corners_new[:,:,1] < bed_limits['y_min']) | (corners_new[:,:,1] > bed_limits['y_max'])
+        if np.any(outside):
+            copies_outside = [int(k) for k in np.nonzero(np.any(outside, axis=1))[0]]
+            raise Exception(f'Copies {copies_outside} are outside of the bed limits.')
+
+    copies = transform_moves(moves, matrices)
+
+    # splitting copies back into layer chunks
+    bounds = np.cumsum([0] + [len(chunk) for chunk in chunks])
+    centers = (matrices[:,:2,:] @ np.array([center[0], center[1], 1]))
+    order = get_travel_order(centers)
+
+    replicated = {}
+    layer_index = {z: i for i, z in enumerate(sorted(layers.keys()))}
+    for c, (z, material) in enumerate(keys):
+        copies_order = order if layer_index[z] % 2 == 0 else order[::-1]
+        g_code = ''
+        for k in copies_order:
+            g_code += '\n'.join(copies[k][bounds[c]:bounds[c+1]])
+        replicated.setdefault(z, {})[material] = g_code
+
+    return dict(sorted(replicated.items()))
+
+
+def _merge_e_words(e_words):
+    """Returns sum of E words as string (exact, with the max number of decimals)."""
+    values = [Decimal(word) for word in e_words]
+    decimals = max(-v.as_tuple().exponent for v in values)
+    return f'{sum(values):.{max(decimals, 0)}f}'
+
+
+def simplify_paths(g_code, tolerance=0.005, min_length=0.05, rate_tolerance=0.01):
+    """Merges consecutive collinear extrusion segments (G1 with X/Y and E) and micro
+    segments shorter than min_length into one G1 line. E words of merged lines are
+    summed exactly, total extrusion is unchanged.
+    Segments are merged only with the same F word and Z height. Collinear segments are
+    merged only with the same extrusion per mm (within rate_tolerance), all removed
+    points stay within tolerance (min_length for micro segments) of the merged segment.
+
+    Args:
+        g_code (string): g_code
+        tolerance (float, optional): max distance of removed points from the merged
+                                     segment in mm. Defaults to 0.005.
+        min_length (float, optional): length of micro segments in mm. Defaults to 0.05.
+        rate_tolerance (float, optional): relative difference of extrusion per mm of
+                                          collinear segments. Defaults to 0.01.
+
+    Returns:
+        g_code (string): simplified g_code
+        report (dict): includes keys:
+                            'lines_before'
+                            'lines_after'
+                            'removed_lines'
+                            'merged_collinear' (removed points on collinear segments)
+                            'merged_micro' (removed points of micro segments)
+                            'extrusion_mm' (total extrusion, before and after)
+    """
+    moves = parse_moves(g_code)
+    lines = moves['lines']
+    x = fill_modal(moves['x'])
+    y = fill_modal(moves['y'])
+    e = np.nan_to_num(moves['e'])
+    f = moves['f']
+
+    # extrusion segments (vectorized): G1 with X/Y and E > 0, without Z word
+    is_g1 = np.array([line[:3] == 'G1 ' for line in lines], dtype=bool)
+    mergeable = is_g1 & moves['is_move'] & (e > 0) & np.isnan(moves['z']) \
+        & ~(np.isnan(moves['x']) & np.isnan(moves['y']))
+    x0 = np.concatenate([[np.nan], x[:-1]])
+    y0 = np.concatenate([[np.nan], y[:-1]])
+    lengths = np.hypot(x - x0, y - y0)
+    mergeable &= ~np.isnan(lengths)
+    rates = np.divide(e, lengths, out=np.full(len(e), np.inf), where=lengths > 0)
+    # line can join the previous line
+    joinable = np.zeros(len(lines), dtype=bool)
+    joinable[1:] = mergeable[1:] & mergeable[:-1] \
+        & ((f[1:] == f[:-1]) | (np.isnan(f[1:]) & np.isnan(f[:-1])))
+
+    merged_into = {} # {removed line index: index of the line it is merged into}
+    n_collinear = 0
+    n_micro = 0
+    group_start = None # index of the first line of the current group
+    removed = [] # removed points of the current group: (index, allowed distance)
+    for i in np.flatnonzero(joinable):
+        if group_start is None or i - 1 != (removed[-1][0] + 1 if removed else group_start):
+            group_start = i - 1 # new group starting with the previous line
+            removed = []
+        last = i - 1 # candidate point to remove (end of the previous line)
+        micro = lengths[last] < min_length or lengths[i] < min_length
+        rate_0 = e[group_start:i].sum() / max(lengths[group_start:i].sum(), 1e-12)
+        same_rate = abs(rates[i] - rate_0) <= rate_tolerance * rate_0
+        if not (micro or same_rate):
+            group_start = i
+            removed = []
+            continue
+
+        sx, sy = x0[group_start], y0[group_start]
+        dx, dy = x[i] - sx, y[i] - sy
+        chord = np.hypot(dx, dy)
+        candidates = removed + [(last, min_length if micro else tolerance)]
+        index = np.array([c[0] for c in candidates])
+        allowed = np.array([c[1] for c in candidates])
+        # distances of removed points from the merged segment
+        if chord > 0:
+            t = np.clip((dx * (x[index] - sx) + dy * (y[index] - sy)) / chord**2, 0, 1)
+        else:
+            t = np.zeros(len(index))
+        distances = np.hypot(x[index] - (sx + t * dx), y[index] - (sy + t * dy))
+        if np.all(distances <= allowed):
+            removed = candidates
+            if micro:
+                n_micro += 1
+            else:
+                n_collinear += 1
+            for k, _ in removed:
+                merged_into[k] = i
+        else:
+            group_start = i
+            removed = []
+
+    # merged lines: E words of removed lines are added to the line they are merged into
+    e_words = {}
+    for k in sorted(merged_into.keys()):
+        e_words.setdefault(merged_into[k], []).append(k)
+    new_lines = []
+    for i, line in enumerate(lines):
+        if i in merged_into:
+            continue
+        if i in e_words:
+            code, sep, comment = line.partition(';')
+            words = code.split()
+            group = e_words[i] + [i]
+            group_e = [_get_word(lines[k], 'E') for k in group]
+            words = [f'E{_merge_e_words(group_e)}' if w[0] == 'E' else w for w in words]
+            line = ' '.join(words) + (' ' + sep + comment if sep else '')
+        new_lines.append(line)
+    new_g_code = '\n'.join(new_lines)
+
+    extrusion_before = _total_e(lines)
+    extrusion_after = _total_e(new_lines)
+    if extrusion_before != extrusion_after:
+        raise Exception(f'Total extrusion changed: {extrusion_before} -> {extrusion_after} mm.')
+
+    report = {
+        'lines_before': len(lines),
+        'lines_after': len(new_lines),
+        'removed_lines': len(lines) - len(new_lines),
+        'merged_collinear': n_collinear,
+        'merged_micro': n_micro,
+        'extrusion_mm': float(extrusion_before),
+    }
+    return new_g_code, report
+
+
+def _get_word(line, key):
+    """Returns the value string of a word of a g_code line (None if not defined)."""
+    for word, value in _WORD.findall(line.split(';', 1)[0]):
+        if word == key:
+            return value
+    return None
+
+
+def _total_e(lines):
+    """Returns exact sum of E words of G0/G1 lines (Decimal)."""
+    total = Decimal(0)
+    for line in lines:
+        if line[:3] in ['G0 ', 'G1 ']:
+            value = _get_word(line, 'E')
+            if value is not None:
+                total += Decimal(value)
+    return total
+
+
+def get_moves_context(moves, tool='', region='', start_z=None):
+    """Adds region heading, tool and layer z of each line to parsed moves
+    (keys 'region', 'tool', 'layer_z', computed once and kept in moves).
+
+    Args:
+        moves (dict): see parse_moves
+        tool (string, optional): tool loaded before the first line. Defaults to '' (no tool).
+        region (string, optional): heading of the region open before the first line.
+                                   Defaults to '' (no region).
+        start_z (float, optional): z before the first Z word. Defaults to None.
+
+    Returns:
+        moves (dict): moves with context arrays
+    """
+    if 'layer_z' in moves:
+        return moves
+    lines = moves['lines']
+    regions = np.empty(len(lines), dtype=object)
+    tools = np.empty(len(lines), dtype=object)
+    open_regions = [region] if region else []
+    for i, line in enumerate(lines):
+        if line[:1] == ';':
+            name, kind = get_section_name(line)
+            if name is not None and name.startswith('print region - '):
+                heading = name[len('print region - '):]
+                if kind == 'start':
+                    open_regions.append(heading)
+                elif heading in open_regions:
+                    open_regions.remove(heading)
+        elif line[:1] == 'T':
+            tool = line.split()[0]
+            tool = '' if tool == 'T-1' else tool
+        regions[i] = open_regions[-1] if open_regions else ''
+        tools[i] = tool
+
+    z = fill_modal(moves['z'])
+    if start_z is not None:
+        z[np.isnan(z)] = start_z
+    moves['region'] = regions
+    moves['tool'] = tools
+    moves['layer_z'] = get_layers_z(z) if np.any(~np.isnan(z)) else z
+    return moves
+
+
+def get_tool_temps(g_code):
+    """Returns active (S) and idle (R) temps of tools - first G10 P<n> S/R words.
+
+    Args:
+        g_code (string or bytes): g_code (e.g. memory-mapped file)
+
+    Returns:
+        dict: {tool number (string): {'S': active temp, 'R': idle temp}}
+    """
+    pattern = _TOOL_TEMP if isinstance(g_code, str) else _TOOL_TEMP.encode()
+    temps = {}
+    for match in re.finditer(pattern, g_code, re.MULTILINE):
+        tool_num, word, value = [v if isinstance(v, str) else v.decode() for v in match.groups()]
+        temps.setdefault(tool_num, {}).setdefault(word, float(value))
+    return temps
+
+
+def _set_words(line, values):
+    """Returns g_code line with words replaced, e.g. values={'E': '0.12345'}."""
+    code, sep, comment = line.partition(';')
+    words = [word[0] + values[word[0]] if word[0] in values else word for word in code.split()]
+    return ' '.join(words) + (' ' + sep + comment if sep else '')
+
+
+def _rewrite_temps(line, temps, old_temps, bed_temp):
+    """Returns temperature line with new tool or bed temps (or None if unchanged).
+    Tool temps (G10 P<n> S/R) equal to the old active or idle temp are replaced with the new
+    ones, other temps (e.g. deep standby of preheat_job) are shifted with the idle temp.
+    """
+    words = line.partition(';')[0].split()
+    if bed_temp is not None and words[0] in ['M140', 'M190']:
+        return _set_words(line, {'S': f'{bed_temp:g}'})
+    if words[0] != 'G10' or len(words) < 2 or words[1][0] != 'P':
+        return None
+    tool = f'T{words[1][1:]}'
+    if tool not in temps or words[1][1:] not in old_temps:
+        return None
+    active, idle = temps[tool]
+    old = old_temps[words[1][1:]]
+    old_active, old_idle = old.get('S'), old.get('R', old.get('S'))
+    values = {}
+    for word in words[2:]:
+        if word[0] in 'SR':
+            value = float(word[1:])
+            if value == old_active:
+                value = active
+            elif value == old_idle:
+                value = idle
+            else:
+                value += idle - old_idle
+            values[word[0]] = f'{value:g}'
+    return _set_words(line, values)
+
+
+def reparameterize_moves(moves, rules=None, temps=None, bed_temp=None, old_temps=None):
+    """Rewrites extrusions (E), print feedrates (F) and temperatures of a generated job
+    without regenerating the toolpaths. Scale factors of all matching rules are applied
+    to extrusion moves (G1 with X/Y and E > 0) at once (vectorized), retracts and travels
+    are not changed. Only rewritten lines are formatted again.
+    Moves can be parsed once (parse_moves) and reparameterized repeatedly.
+
+    Args:
+        moves (dict, list or string): parsed moves (see parse_moves), g_code lines or g_code
+        rules (list, optional): list of dicts with selectors 'heading' (region heading),
+                                'tool' (e.g. 'T3'), 'z_min', 'z_max' (layer z range in mm,
+                                included) and factors 'extrude_factor', 'speed_factor'.
+                                Defaults to None.
+        temps (dict, optional): {tool: [active temp, idle temp]}, e.g. {'T3': [215, 170]}.
+                                Defaults to None.
+        bed_temp (float, optional): bed temp (M140, M190). Defaults to None.
+        old_temps (dict, optional): see get_tool_temps. Defaults to None (from moves).
+
+    Returns:
+        g_code (string): rewritten g_code
+        report (dict): includes keys:
+                            'rewritten_lines'
+                            'extrusion_mm_before'
+                            'extrusion_mm_after'
+    """
+    if not isinstance(moves, dict):
+        moves = parse_moves(moves)
+    moves = get_moves_context(moves)
+    lines = list(moves['lines'])
+    e = moves['e']
+    f = moves['f']
+
+    # scale factors of extrusion moves
+    printing = moves['is_move'] & (np.nan_to_num(e) > 0) & ~(np.isnan(moves['x']) & np.isnan(moves['y']))
+    e_scale = np.ones(len(lines))
+    f_scale = np.ones(len(lines))
+    for rule in rules or []:
+        mask = printing.copy()
+        if rule.get('heading') is not None:
+            mask &= moves['region'] == rule['heading']
+        if rule.get('tool') is not None:
+            mask &= moves['tool'] == rule['tool']
+        if rule.get('z_min') is not None:
+            mask &= moves['layer_z'] >= rule['z_min'] - 1e-6
+        if rule.get('z_max') is not None:
+            mask &= moves['layer_z'] <= rule['z_max'] + 1e-6
+        e_scale[mask] *= rule.get('extrude_factor', 1)
+        f_scale[mask] *= rule.get('speed_factor', 1)
+    e_new = e * e_scale
+    f_new = f * f_scale
+
+    rewritten = 0
+    for i in np.flatnonzero((e_scale != 1) | (f_scale != 1)):
+        values = {'E': f'{e_new[i]:.5f}'}
+        if not np.isnan(f_new[i]):
+            values['F'] = f'{f_new[i]:.0f}'
+        lines[i] = _set_words(lines[i], values)
+        rewritten += 1
+
+    # temperatures
+    if temps or bed_temp is not None:
+        if old_temps is None:
+            old_temps = get_tool_temps('\n'.join(moves['lines']))
+        for i, line in enumerate(lines):
+            if line[:4] in ['G10 ', 'M140', 'M190']:
+                new_line = _rewrite_temps(line, temps or {}, old_temps, bed_temp)
+                if new_line is not None and new_line != line:
+                    lines[i] = new_line
+                    rewritten += 1
+
+    report = {
+        'rewritten_lines': rewritten,
+        'extrusion_mm_before': float(np.nansum(e)),
+        'extrusion_mm_after': float(np.nansum(np.where(printing, e_new, e))),
+    }
+    return '\n'.join(lines), report
+
+
+def reparameterize_file(reader, filepath, rules=None, temps=None, bed_temp=None):
+    """Rewrites a g_code file with an index (see G_code_reader) into a new file
+    (see reparameterize_moves). Only layers in z ranges of rules are parsed and rewritten,
+    other layers are copied as bytes (all layers with temps or rules without z range).
+
+    Args:
+        reader (G_code_reader): reader of the generated g_code file
+        filepath (string): path to rewritten g_code file
+        rules, temps, bed_temp: see reparameterize_moves
+
+    Returns:
+        report (dict): see reparameterize_moves (extrusions of rewritten layers),
+                       with key 'rewritten_layers'
+    """
+    rules = rules or []
+    layer_z = reader.index['layer_z']
+    if temps or bed_temp is not None or any(rule.get('z_min') is None and rule.get('z_max') is None
+                                            for rule in rules):
+        selected = np.ones(len(layer_z), dtype=bool)
+    else:
+        selected = np.zeros(len(layer_z), dtype=bool)
+        for rule in rules:
+            z_min = rule['z_min'] if rule.get('z_min') is not None else -np.inf
+            z_max = rule['z_max'] if rule.get('z_max') is not None else np.inf
+            selected |= (layer_z >= z_min - 1e-6) & (layer_z <= z_max + 1e-6)
+    old_temps = get_tool_temps(reader.mm) if temps else None
+    sections = reader.get_sections('print region - ')
+
+    report = {'rewritten_lines': 0, 'extrusion_mm_before': 0, 'extrusion_mm_after': 0,
+              'rewritten_layers': int(np.sum(selected))}
+    with open(filepath, 'wb') as f:
+        for layer in range(len(layer_z)):
+            start = reader.index['layer_start'][layer]
+            end = reader.index['layer_end'][layer]
+            if not selected[layer]:
+                f.write(reader.mm[int(start):int(end)])
+                continue
+            region = ''
+            for name, s, e in sections: # region open at the start of the layer
+                if s < start < e:
+                    region = name[len('print region - '):]
+            moves = get_moves_context(parse_moves(reader.read_layer(layer)),
+                                      tool=reader.get_tool_at(start) or '', region=region,
+                                      start_z=layer_z[layer])
+            g_code, layer_report = reparameterize_moves(moves, rules, temps, bed_temp, old_temps)
+            f.write(g_code.encode())
+            for key in ['rewritten_lines', 'extrusion_mm_before', 'extrusion_mm_after']:
+                report[key] += layer_report[key]
+    return report
@@ -0,0 +1,182 @@
+import re
+import numpy as np
+from gcode_functions import process_g_code_lines
+
+_WORD = re.compile(r'([XYZEF])(-?\d*\.?\d+)')
+
+
+def get_line_comment(line):
+    """Returns comment of a g_code line (text after ';') or None."""
+    if ';' not in line:
+        return None
+    return line.split(';', 1)[1].strip()
+
+
+def get_line_words(line):
+    """Returns dict of X, Y, Z, E, F values of a G0/G1 g_code line."""
+    code = line.split(';', 1)[0]
+    return {key: float(value) for key, value in _WORD.findall(code)}
+
+
+def points_to_segments_distance(points, segments):
+    """Calculates the shortest distance of each point to any of the segments.
+
+    Args:
+        points (numpy array): shape (P, 2)
+        segments (numpy array): shape (S, 2, 2) - [[x0, y0], [x1, y1]]
+
+    Returns:
+        numpy array: shape (P,) distances in mm
+    """
+    a = segments[:,0][None,:,:]
+    ab = (segments[:,1] - segments[:,0])[None,:,:]
+    ap = points[:,None,:] - a
+    ab_len2 = np.sum(ab**2, axis=2)
+    ab_len2[ab_len2 == 0] = 1
+    t = np.clip(np.sum(ap * ab, axis=2) / ab_len2, 0, 1)
+    closest = a + t[:,:,None] * ab
+    distances = np.sqrt(np.sum((points[:,None,:] - closest)**2, axis=2))
+    return distances.min(axis=1)
+
+
+def _match_travel(lines, i):
+    """Matches the path end + path start sequence of G_code_generator at line i:
+    retract, wipe 1, wipe 2, lift Z, [comments], move over print point, lower Z, unretract
+    (without wipe with firmware retraction).
+
+    Returns:
+        dict with line indices of the sequence or None
+    """
+    sequence_end = ['retract', 'wipe 1', 'wipe 2', 'lift Z']
+    if i + 1 < len(lines) and get_line_comment(lines[i + 1]) == 'lift Z': # firmware retraction
+        sequence_end = ['retract', 'lift Z']
+    sequence_start = ['move over print point', 'lower Z', 'unretract']
+
+    for j, comment in enumerate(sequence_end):
+        if i + j >= len(lines) or get_line_comment(lines[i + j]) != comment:
+            return None
+    k = i + len(sequence_end)
+    comment_lines = []
+    while k < len(lines) and lines[k].strip()[:1] in ['', ';']: # only comments and empty lines
+        if k == len(lines) - 1 and lines[k].strip() == '':
+            return None
+        comment_lines.append(k)
+        k += 1
+    for j, comment in enumerate(sequence_start):
+        if k + j >= len(lines) or get_line_comment(lines[k + j]) != comment:
+            return None
+
+    return {
+        'retract': i,
+        'lift': i + len(sequence_end) - 1,
+        'comments': comment_lines,
+        'move_over': k,
+        'lower': k + 1,
+        'unretract': k + 2,
+    }
+
+
+def plan_travels(g_code, max_travel=2.0, require_printed=True, printed_tolerance=0.5,
+                 tool_unload_time=3, tool_load_time=20):
+    """Elides retract, wipe and Z-hop of short travels between toolpaths of the same tool
+    (e.g. perimeter to infill inside print_surface or between adjacent regions).
+    The path end and the next path start are chained with a single travel move at print height.
+
+    Args:
+        g_code (string): g_code generated with G_code_generator
+        max_travel (float, optional): longest travel in mm without retraction. Defaults to 2.0.
+        require_printed (bool, optional): travel must stay over traces already printed in
+                                          the current layer. Defaults to True.
+        printed_tolerance (float, optional): max distance of travel from printed trace
+                                             centerlines in mm. Defaults to 0.5.
+        tool_unload_time (int, optional): see process_g_code. Defaults to 3.
+        tool_load_time (int, optional): see process_g_code. Defaults to 20.
+
+    Returns:
+        g_code (string): planned g_code
+        report (dict): includes keys:
+                            'elided_travels'
+                            'removed_lines'
+                            'print_time_sec_before'
+                            'print_time_sec_after'
+                            'time_saved_sec'
+    """
+    lines = g_code.split('\n')
+
+    new_lines = []
+    layer_segments = [] # printed segments of the current layer
+    layer_z = None
+    x = y = z = None
+    elided_travels = 0
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        words = line.split()
+
+        # tracking printed segments of the current layer
+        if len(words) > 0 and words[0] in ['G0', 'G1']:
+            values = get_line_words(line)
+            x_new = values.get('X', x)
+            y_new = values.get('Y', y)
+            z = values.get('Z', z)
+            if words[0] == 'G1' and values.get('E', 0) > 0 and x is not None \
+                    and (x_new, y_new) != (x, y):
+                if z != layer_z:
+                    layer_z = z
+                    layer_segments = []
+                layer_segments.append([[x, y], [x_new, y_new]])
+            x, y = x_new, y_new
+
+        match = _match_travel(lines, i) if get_line_comment(line) == 'retract' else None
+        if match is not None:
+            retract = get_line_words(lines[match['retract']]).get('E', 'G10')
+            unretract = get_line_words(lines[match['unretract']]).get('E', 'G11')
+            lift = get_line_words(lines[match['lift']])
+            move_over = get_line_words(lines[match['move_over']])
+            lower = get_line_words(lines[match['lower']])
+
+            p0 = np.array([lift['X'], lift['Y']])
+            p1 = np.array([lower['X'], lower['Y']])
+            travel = np.linalg.norm(p1 - p0)
+            firmware = (retract, unretract) == ('G10', 'G11')
+            elide = (firmware or 'G11' not in [retract, unretract] and retract == -unretract) \
+                and lift['Z'] == move_over['Z'] \
+                and lower['Z'] == z \
+                and travel <= max_travel
+
+            if elide and require_printed:
+                if len(layer_segments) == 0:
+                    elide = False
+                else:
+                    n = int(np.ceil(travel / (printed_tolerance / 2))) + 1
+                    samples = p0 + np.linspace(0, 1, n)[:,None] * (p1 - p0)
+                    distances = points_to_segments_distance(samples, np.asarray(layer_segments))
+                    elide = np.all(distances <= printed_tolerance)
+
+            if elide:
+                for k in match['comments']:
+                    new_lines.append(lines[k])
+                new_lines.append(f'G0 X{lower["X"]:.3f} Y{lower["Y"]:.3f} Z{lower["Z"]:.3f} '
+                                 f'E{0:.1f} F{move_over["F"]:.0f} ; travel (retract elided)')
+                x, y, z = lower['X'], lower['Y'], lower['Z']
+                elided_travels += 1
+                i = match['unretract'] + 1
+                continue
+
+        new_lines.append(line)
+        i += 1
+
+    planned_g_code = '\n'.join(new_lines)
+
+    before = process_g_code_lines(lines, tool_unload_time, tool_load_time)
+    after = process_g_code_lines(new_lines, tool_unload_time, tool_load_time)
+    report = {
+        'elided_travels': elided_travels,
+        'removed_lines': len(lines) - len(new_lines),
+        'print_time_sec_before': before['print_time_sec'],
+        'print_time_sec_after': after['print_time_sec'],
+        'time_saved_sec': round(before['print_time_sec'] - after['print_time_sec'], 2),
+    }
+
+    return planned_g_code, report